@@ -1,23 +1,39 @@
 import numpy as np
 
 import time
-from functools import reduce
+from functools import reduce, partial
 
-import matplotlib.pyplot as plt
-import matplotlib
+from lazy_imports import lazy_import, lazy_from, lazy_pyplot, import_report
 
 SMALL_SIZE = 12
-matplotlib.rc('font', size=SMALL_SIZE)
-matplotlib.rc('axes', titlesize=SMALL_SIZE)
+plt = lazy_pyplot(font_size = SMALL_SIZE)
 
-from scipy.io import loadmat
-import pysindy as ps
+loadmat, = lazy_from('scipy.io', 'loadmat')
+ps = lazy_import('pysindy')
 
-from epde.interface.logger import Logger
-import epde.interface.interface as epde_alg
-from epde.interface.prepared_tokens import CacheStoredTokens, CustomEvaluator, CustomTokens
+Logger, = lazy_from('epde.interface.logger', 'Logger')
+epde_alg = lazy_import('epde.interface.interface')
+CacheStoredTokens, CustomTokens = lazy_from('epde.interface.prepared_tokens', 'CacheStoredTokens', 'CustomTokens')
 
-from epde.interface.equation_translator import translate_equation
+translate_equation, = lazy_from('epde.interface.equation_translator', 'translate_equation')
+
+get_preprocessor_pipeline, = lazy_from('preprocessing', 'get_preprocessor_pipeline')
+use_gram_coefficients, = lazy_from('population_fitting', 'use_gram_coefficients')
+from grids import broadcast_grids, grids_section, axis_values
+from profiling import PROFILER, profile_phase, memory_log
+from precision import set_precision, as_working
+from token_cache import CachedCustomEvaluator, SharedTermStore
+from search_modes import multiresolution_discovery, select_by_complexity, tiled_attempts, parallel_attempts
+from workers import SharedArrays
+from weak_form import weak_sindy_pde, weak_equation_text
+from sketching import sketched_regression
+
+# x is periodic in kdv.mat, so the spatial derivatives are taken in the Fourier space; the same filter is used
+# by the search and by the pools, in which its equations are translated
+SPECTRAL_PREPROCESSOR_KWARGS = {'periodic_axes' : (1,), 'filter_type' : 'exponential'}
+# boundary and polynomial differentiation of the search, also used for the pool of the multi-resolution refit
+SEARCH_BOUNDARY = 10
+SEARCH_POLY_KWARGS = {'sigma' : 1, 'polynomial_window' : 5, 'poly_order' : 4}
 
 
 def translate_sindy_eq(equation):
@@ -102,30 +118,38 @@ def Heatmap(Matrix, interval = None, area = ((0, 1), (0, 1)), xlabel = '', ylabe
     if type(filename) != type(None): plt.savefig(filename + '.eps', format='eps')
 
 
-def epde_discovery(x, t, u, use_ann = False, smooth = False):
-    grids = np.meshgrid(t, x, indexing = 'ij')
+def epde_discovery(x, t, u, use_ann = False, smooth = False, use_spectral = False, population_size = 9,
+                   training_epochs = None, max_deriv_order = (1, 3), equation_terms_max_number = 6,
+                   gram_coefficients = False, shared_terms = False):
+    grids = broadcast_grids(t, x)
     print(u.shape, grids[0].shape, grids[1].shape)
     multiobjective_mode = True
     dimensionality = u.ndim - 1
     
     epde_search_obj = epde_alg.EpdeSearch(multiobjective_mode=multiobjective_mode, use_solver = False, 
-                                          dimensionality = dimensionality, boundary = 10,
+                                          dimensionality = dimensionality, boundary = SEARCH_BOUNDARY,
                                           coordinate_tensors = grids)    
+    if gram_coefficients:
+        # coefficients of all the offsprings of a generation are fitted in one solve on the shared Gram matrix
+        # with shared_terms the evaluated terms are also shared with the other attempts and workers on the same data
+        use_gram_coefficients(epde_search_obj, store = SharedTermStore() if shared_terms else None)
     
     if use_ann:
         epde_search_obj.set_preprocessor(default_preprocessor_type='ANN',
                                          preprocessor_kwargs={'epochs_max' : 35000})
+    elif use_spectral:
+        epde_search_obj.set_preprocessor(preprocessor_pipeline=get_preprocessor_pipeline('periodic_spectral',
+                                                                                         SPECTRAL_PREPROCESSOR_KWARGS))
     else:
         epde_search_obj.set_preprocessor(default_preprocessor_type='poly',
-                                         preprocessor_kwargs={'use_smoothing' : smooth, 'sigma' : 1, 
-                                                              'polynomial_window' : 5, 'poly_order' : 4})
-    popsize = 9
+                                         preprocessor_kwargs={'use_smoothing' : smooth, **SEARCH_POLY_KWARGS})
+    popsize = population_size
     if multiobjective_mode:
         epde_search_obj.set_moeadd_params(population_size = popsize, 
-                                          training_epochs=55)
+                                          training_epochs=55 if training_epochs is None else training_epochs)
     else:
         epde_search_obj.set_singleobjective_params(population_size = popsize,
-                                                   training_epochs=85)
+                                                   training_epochs=85 if training_epochs is None else training_epochs)
     
     custom_grid_tokens = CacheStoredTokens(token_type = 'grid',
                                            token_labels = ['t', 'x'],
@@ -136,8 +160,8 @@ def epde_discovery(x, t, u, use_ann = False, smooth = False):
     custom_trigonometric_eval_fun = {'cos(t)sin(x)': lambda *grids, **kwargs: (np.cos(grids[0]) 
                                                                                * np.sin(grids[1])) ** kwargs['power']}
     
-    custom_trig_evaluator = CustomEvaluator(custom_trigonometric_eval_fun,
-                                            eval_fun_params_labels=['power'])
+    custom_trig_evaluator = CachedCustomEvaluator(custom_trigonometric_eval_fun,
+                                                  eval_fun_params_labels=['power'])
     trig_params_ranges = {'power': (1, 1)}
     trig_params_equal_ranges = {}
 
@@ -152,15 +176,16 @@ def epde_discovery(x, t, u, use_ann = False, smooth = False):
     opt_val = 1e-1
     bounds = (1e-9, 1e0) if multiobjective_mode else (opt_val, opt_val)    
     print(u.shape, grids[0].shape)
-    epde_search_obj.create_pool(data = u, variable_names=['u'], max_deriv_order=(1, 3),  
+    epde_search_obj.create_pool(data = u, variable_names=['u'], max_deriv_order=max_deriv_order,  
                                 additional_tokens=[custom_trig_tokens, custom_grid_tokens])
     
 
-    epde_search_obj.fit(data=u, variable_names=['u',], max_deriv_order=(1, 3),
-                        equation_terms_max_number=6, data_fun_pow = 1, additional_tokens=[custom_trig_tokens, 
-                                                                                          custom_grid_tokens], 
-                        equation_factors_max_number=factors_max_number,
-                        eq_sparsity_interval=bounds)
+    with profile_phase('epde_search'):
+        epde_search_obj.fit(data=u, variable_names=['u',], max_deriv_order=max_deriv_order,
+                            equation_terms_max_number=equation_terms_max_number, data_fun_pow = 1, additional_tokens=[custom_trig_tokens, 
+                                                                                              custom_grid_tokens], 
+                            equation_factors_max_number=factors_max_number,
+                            eq_sparsity_interval=bounds)
     
     equation_obtained = False; compl = [6.,]; attempt = 0
     
@@ -181,23 +206,26 @@ def epde_discovery(x, t, u, use_ann = False, smooth = False):
     return epde_search_obj, res
 
 
-def get_epde_pool(x, t, u, use_ann = False):
-    grids = np.meshgrid(t, x, indexing = 'ij')
+def get_epde_pool(x, t, u, use_ann = False, use_spectral = False, boundary = 20,
+                  poly_kwargs = {'use_smoothing' : True, 'sigma' : 1, 'polynomial_window' : 3, 'poly_order' : 3}):
+    grids = broadcast_grids(t, x)
     print(u.shape, grids[0].shape, grids[1].shape)
     multiobjective_mode = True
     dimensionality = u.ndim - 1
     
     epde_search_obj = epde_alg.EpdeSearch(multiobjective_mode=multiobjective_mode, use_solver = False, 
-                                          dimensionality = dimensionality, boundary = 20,
+                                          dimensionality = dimensionality, boundary = boundary,
                                           coordinate_tensors = grids)    
     
     if use_ann:
         epde_search_obj.set_preprocessor(default_preprocessor_type='ANN', # use_smoothing = True poly
                                          preprocessor_kwargs={'epochs_max' : 35000})# 
+    elif use_spectral:
+        epde_search_obj.set_preprocessor(preprocessor_pipeline=get_preprocessor_pipeline('periodic_spectral',
+                                                                                         SPECTRAL_PREPROCESSOR_KWARGS))
     else:
         epde_search_obj.set_preprocessor(default_preprocessor_type='poly', # use_smoothing = True poly
-                                         preprocessor_kwargs={'use_smoothing' : True, 'sigma' : 1, 
-                                                              'polynomial_window' : 3, 'poly_order' : 3}) # 'epochs_max' : 10000})# 
+                                         preprocessor_kwargs=poly_kwargs) # 'epochs_max' : 10000})# 
 
     custom_grid_tokens = CacheStoredTokens(token_type = 'grid',
                                            token_labels = ['t', 'x'],
@@ -208,8 +236,8 @@ def get_epde_pool(x, t, u, use_ann = False):
     custom_trigonometric_eval_fun = {
         'cos(t)sin(x)': lambda *grids, **kwargs: (np.cos(grids[0]) * np.sin(grids[1])) ** kwargs['power']}
     
-    custom_trig_evaluator = CustomEvaluator(custom_trigonometric_eval_fun,
-                                            eval_fun_params_labels=['power'])
+    custom_trig_evaluator = CachedCustomEvaluator(custom_trigonometric_eval_fun,
+                                                  eval_fun_params_labels=['power'])
     trig_params_ranges = {'power': (1, 1)}
     trig_params_equal_ranges = {}
 
@@ -226,10 +254,10 @@ def get_epde_pool(x, t, u, use_ann = False):
     return epde_search_obj.pool
 
 
-def sindy_provided_l0(grids, u):
-    t = np.unique(grids[0])
+def sindy_provided_l0(grids, u, sketch = None):
+    t = axis_values(grids[0], 0)
     print('t.shape', t.shape)
-    x = np.unique(grids[1])        
+    x = axis_values(grids[1], 1)        
     u = u.T.reshape(len(x), len(t), 1) # 
     
     library_functions = [lambda x: x, lambda x: x * x]
@@ -245,38 +273,63 @@ def sindy_provided_l0(grids, u):
     print('SR3 model, L0 norm: ')
     optimizer = ps.SR3(threshold=7, max_iter=10000, tol=1e-15, nu=1e2,
                    thresholder='l0', normalize_columns=True)
-    model = ps.SINDy(feature_library=pde_lib, optimizer=optimizer)
-    model.fit(u, t=t[1] - t[0])
+    if sketch is None:
+        model = ps.SINDy(feature_library=pde_lib, optimizer=optimizer)
+        model.fit(u, t=t[1] - t[0])
+    else:
+        # SR3 runs on the row sketch of the library (and of u_t) with the number of rows, doubled until
+        # the least squares coefficients settle, instead of all the (x, t) points
+        theta = np.asarray(pde_lib.fit_transform(u))
+        theta = theta.reshape(-1, theta.shape[-1])
+        u_t = np.asarray(ps.FiniteDifference(axis=-2)(u, t[1] - t[0])).reshape(-1)
+        theta_s, u_t_s, _ = sketched_regression(theta, u_t, method = sketch)
+        print(f'Sketched regression on {theta_s.shape[0]} of {theta.shape[0]} rows')
+        model = ps.SINDy(feature_library=ps.IdentityLibrary(), optimizer=optimizer,
+                         feature_names=pde_lib.get_feature_names())
+        model.fit(theta_s, x_dot=u_t_s.reshape(-1, 1))
     model.print()    
     return model
 
 
 if __name__ == "__main__":
+    precision = 'float64' # with 'float32' data and grids are kept in single precision (epde caches stay float64)
+    set_precision(precision)
+    profile_memory = False # peak RSS and top allocation sites of the search and prediction phases in the logs
+    if profile_memory:
+        PROFILER.enable()
+
     kdV = loadmat('datasets/kdv/kdv.mat')
-    t = np.ravel(kdV['t'])
-    x = np.ravel(kdV['x'])
-    u = np.real(kdV['usol']).T
+    t = as_working(np.ravel(kdV['t']))
+    x = as_working(np.ravel(kdV['x']))
+    u = as_working(np.real(kdV['usol']).T)
 
     dt = t[1] - t[0]
     dx = x[1] - x[0]
 
     train_max = 200    
     
-    grids = np.meshgrid(t, x, indexing = 'ij')
-    grids_training = (grids[0][:train_max, ...], grids[1][:train_max, ...])
-    grids_test = (grids[0][train_max:, ...], grids[1][train_max:, ...])    
+    grids = broadcast_grids(t, x)
+    grids_training = grids_section(grids, np.s_[:train_max, ...])
+    grids_test = grids_section(grids, np.s_[train_max:, ...])
 
     t_train, t_test = t[:train_max], t[train_max:]
     data_train, data_test = u[:train_max, ...], u[train_max:, ...]
 
     run_epde = True
     run_sindy = True
+    use_spectral = False
+    multiresolution = False # search on the (2, 2)-decimated grid, refinement of the Pareto front on the full one
+    tiled = False # separate searches on the overlapping (t, x) patches, merged into the consensus equation
+    parallel = False # attempts of the magnitude in the worker processes, data is passed through the shared memory
+    use_weak = False # SINDy on the weak form of the library (FFT-convolved test functions) instead of PDELibrary
+    # 'leverage', 'countsketch', 'gaussian' or 'uniform': SINDy on the row sketch of the library, EPDE is not sketched
+    sindy_sketch = None
 
     exps = {}
     test_launches = 10
     magnitudes = [0, 1.*1e-2, 2.5*1e-2, 5.*1e-2]
     for magnitude in magnitudes:
-        data_train_n = data_train + np.random.normal(scale = magnitude * np.abs(data_train), size = data_train.shape)
+        data_train_n = as_working(data_train + np.random.normal(scale = magnitude * np.abs(data_train), size = data_train.shape))
         
         errs_epde = []
         models_epde = []
@@ -284,31 +337,69 @@ if __name__ == "__main__":
         pool = None
         
         if run_epde:
+            # placed into the shared memory once per magnitude, the workers of all the attempts get the handles
+            shared = SharedArrays(x, t_train, data_train_n) if (tiled or parallel) else ()
+            if parallel:
+                t1 = time.time()
+                parallel_forms = parallel_attempts(epde_discovery, *shared, attempts = test_launches, processes = 4)
+                attempt_time = (time.time() - t1) / test_launches
+                epde_pool = get_epde_pool(x, t_train, data_train_n, use_spectral = use_spectral)
+            elif tiled:
+                # the tiles of all the attempts are searched in one pool of workers
+                t1 = time.time()
+                tiled_forms = tiled_attempts(epde_discovery, *shared, attempts = test_launches, tiles = (2, 2),
+                                             overlap = 0.2, processes = 4)
+                attempt_time = (time.time() - t1) / test_launches
+                epde_pool = get_epde_pool(x, t_train, data_train_n, use_spectral = use_spectral)
             for idx in range(test_launches):
                 t1 = time.time()
-                epde_search_obj, system = epde_discovery(x, t_train, data_train_n, False)
+                if multiresolution:
+                    # the front is refitted on the derivatives, taken by the preprocessing of the search
+                    search_fun = partial(epde_discovery, use_spectral = use_spectral)
+                    pool_fun = partial(get_epde_pool, use_spectral = use_spectral, boundary = SEARCH_BOUNDARY,
+                                       poly_kwargs = {'use_smoothing' : False, **SEARCH_POLY_KWARGS})
+                    epde_pool, front = multiresolution_discovery(search_fun, pool_fun, x, t_train, data_train_n,
+                                                                 steps = (2, 2), boundary = SEARCH_BOUNDARY)
+                    system = select_by_complexity(front, [6.,])
+                elif parallel:
+                    system = translate_equation(parallel_forms[idx], epde_pool)
+                    t1 -= attempt_time
+                elif tiled:
+                    consensus, tiles_stats = tiled_forms[idx]
+                    system = translate_equation(consensus, epde_pool)
+                    t1 -= attempt_time
+                else:
+                    epde_search_obj, system = epde_discovery(x, t_train, data_train_n, False, use_spectral = use_spectral)
+                    epde_pool = epde_search_obj.pool
                 t2 = time.time()
                 if pool is None:
-                    pool = epde_search_obj.pool                
+                    pool = epde_pool
                 try:
-                    logger.add_log(key = f'KdV_{magnitude}_attempt_{idx}', entry = system, aggregation_key = ('epde', magnitude), time = t2 - t1)
+                    logger.add_log(key = f'KdV_{magnitude}_attempt_{idx}', entry = system, aggregation_key = ('epde', magnitude), time = t2 - t1, **memory_log())
                 except NameError:
                     logger = Logger(name = 'logs/KdV_0_from_mat.json', referential_equation = '1.0 * d^3u/dx2^3{power: 1.0} + 6.0 * u{power: 1.0} * du/dx2{power: 1.0}  + 0.0 = du/dx1{power: 1.0}', 
-                                    pool = epde_search_obj.pool)
-                    logger.add_log(key = f'KdV_{magnitude}_attempt_{idx}', entry = system, aggregation_key = ('epde', magnitude), time = t2 - t1)
+                                    pool = epde_pool)
+                    logger.add_log(key = f'KdV_{magnitude}_attempt_{idx}', entry = system, aggregation_key = ('epde', magnitude), time = t2 - t1, **memory_log())
+            if shared:
+                shared.unlink()
         if run_sindy:
             if pool is None:
-                pool = get_epde_pool(x, t_train, data_train_n)
+                pool = get_epde_pool(x, t_train, data_train_n, use_spectral = use_spectral)
             t1 = time.time()
-            model_base = sindy_provided_l0(grids_training, data_train_n)
-            t2 = time.time()
-            system = translate_equation(translate_sindy_eq(model_base.equations()[0]), pool)            
+            if use_weak:
+                model_base = weak_sindy_pde(data_train_n, t_train, x, threshold = 0.5, degree = 2, max_order = 3)
+                t2 = time.time()
+                system = translate_equation(weak_equation_text(*model_base), pool)
+            else:
+                model_base = sindy_provided_l0(grids_training, data_train_n, sketch = sindy_sketch)
+                t2 = time.time()
+                system = translate_equation(translate_sindy_eq(model_base.equations()[0]), pool)            
             try:
-                logger.add_log(key = f'Burgers_sindy_{magnitude}', entry = system, aggregation_key = ('sindy', magnitude), time = t2 - t1)
+                logger.add_log(key = f'Burgers_sindy_{magnitude}', entry = system, aggregation_key = ('sindy', magnitude), time = t2 - t1, **memory_log())
             except NameError:
                 logger = Logger(name = 'logs/Burgers_SINDy_new.json', referential_equation = '1.0 * d^3u/dx2^3{power: 1.0} + 6.0 * u{power: 1.0} * du/dx2{power: 1.0}  + 0.0 = du/dx1{power: 1.0}', 
                                 pool = pool)
-                logger.add_log(key = f'Burgers_sindy_{magnitude}', entry = system, aggregation_key = ('sindy', magnitude), time = t2 - t1)
+                logger.add_log(key = f'Burgers_sindy_{magnitude}', entry = system, aggregation_key = ('sindy', magnitude), time = t2 - t1, **memory_log())
             errs_sindy, calc_sindy = None, None
 
         else:
@@ -317,4 +408,4 @@ if __name__ == "__main__":
         exps[magnitude] = {'epde': (models_epde, errs_epde, calc_epde),
                            'SINDy': (model_base, errs_sindy, calc_sindy)}
     logger.dump()
-        
+    import_report()
@@ -8,28 +8,31 @@ Created on Wed Jun 28 13:55:18 2023
 import numpy as np
 import time
 
-import torch
-
-import matplotlib.pyplot as plt
-import matplotlib
+from lazy_imports import lazy_import, lazy_from, lazy_pyplot, import_report
 
 SMALL_SIZE = 12
-matplotlib.rc('font', size=SMALL_SIZE)
-matplotlib.rc('axes', titlesize=SMALL_SIZE)
+plt = lazy_pyplot(font_size = SMALL_SIZE)
 
 
 from functools import reduce
 
-import pysindy as ps
+ps = lazy_import('pysindy')
+
+epde_alg = lazy_import('epde.interface.interface')
+Logger, = lazy_from('epde.interface.logger', 'Logger')
 
-import epde.interface.interface as epde_alg
-from epde.interface.solver_integration import BOPElement
-from epde.interface.logger import Logger
+get_preprocessor_pipeline, run_batch = lazy_from('preprocessing', 'get_preprocessor_pipeline', 'run_batch')
+ChunkedSeries, StreamingSINDy, stream_refit = lazy_from('streaming', 'ChunkedSeries', 'StreamingSINDy', 'stream_refit')
 
-from epde.preprocessing.preprocessor_setups import PreprocessorSetup
-from epde.preprocessing.preprocessor import ConcretePrepBuilder
+translate_equation, = lazy_from('epde.interface.equation_translator', 'translate_equation')
 
-from epde.interface.equation_translator import translate_equation
+from profiling import PROFILER, profile_phase, memory_log
+from canonical import EquationMemo
+from boundary import BoundarySet
+from solver_models import SolutionModelCache
+from precision import set_precision, as_working
+from sindy_tools import EnsembleSINDy
+from synthetic_data import load_dataset
 
 
 def second_order_ODE_by_RK(initial: tuple, timestep: float, steps: int, epsilon: float):
@@ -59,7 +62,7 @@ def prepare_data(initial = (np.sqrt(3)/2., 1./2.), step = 0.05, steps_num = 640,
     t = np.arange(start = 0., stop = step * steps_num, step = step)
     solution = second_order_ODE_by_RK(initial=initial, timestep=step, steps=steps_num, 
                                       epsilon=epsilon)
-    return t, solution
+    return as_working(t), as_working(solution) # integration itself is held in double precision
 
 
 def translate_sindy_eq(equation):
@@ -180,10 +183,11 @@ def epde_discovery_as_system(t, x, y, use_ann = False):
     epde_search_obj.set_moeadd_params(population_size = popsize, training_epochs=85)
     factors_max_number = {'factors_num' : [1, 2, 3], 'probas' : [0.4, 0.3, 0.3]}
     
-    epde_search_obj.fit(data=[x, y], variable_names=['u', 'v'], max_deriv_order=(1,),
-                        equation_terms_max_number=6, data_fun_pow = 3,
-                        equation_factors_max_number=factors_max_number,
-                        eq_sparsity_interval=(1e-12, 1e-4))
+    with profile_phase('epde_search'):
+        epde_search_obj.fit(data=[x, y], variable_names=['u', 'v'], max_deriv_order=(1,),
+                            equation_terms_max_number=6, data_fun_pow = 3,
+                            equation_factors_max_number=factors_max_number,
+                            eq_sparsity_interval=(1e-12, 1e-4))
     '''
     Смотрим на найденное Парето-множество, 
     
@@ -227,10 +231,11 @@ def epde_discovery_as_ode(t, x, y, use_ann = False):
     epde_search_obj.set_moeadd_params(population_size = popsize, training_epochs=100)
     factors_max_number = {'factors_num' : [1, 2, 3], 'probas' : [0.4, 0.3, 0.3]}
     
-    epde_search_obj.fit(data=[x,], variable_names=['u',], max_deriv_order=(2,),
-                        equation_terms_max_number=6, data_fun_pow = 2,
-                        equation_factors_max_number=factors_max_number,
-                        eq_sparsity_interval=(1e-12, 1e-3))
+    with profile_phase('epde_search'):
+        epde_search_obj.fit(data=[x,], variable_names=['u',], max_deriv_order=(2,),
+                            equation_terms_max_number=6, data_fun_pow = 2,
+                            equation_factors_max_number=factors_max_number,
+                            eq_sparsity_interval=(1e-12, 1e-3))
 
     epde_search_obj.equations(only_print = True, num = 1)
     equation_obtained = False; compl = [5,]; attempt = 0
@@ -250,49 +255,66 @@ def epde_discovery_as_ode(t, x, y, use_ann = False):
     return epde_search_obj, res
 
 if __name__ == "__main__":
+    precision = 'float64' # with 'float32' data and grids are kept in single precision (epde caches stay float64)
+    set_precision(precision)
+    profile_memory = False # peak RSS and top allocation sites of the search and prediction phases in the logs
+    if profile_memory:
+        PROFILER.enable()
+
     as_system = False
-    t, x_stacked = prepare_data(steps_num=640)
-    t_max = 320
-    x, y = x_stacked[:, 0], x_stacked[:, 1]
-    t_train, t_test = t[:t_max], t[:t_max]
-    x_train, x_test = x[:t_max], x[:t_max]
-    y_train, y_test = y[:t_max], y[:t_max]
-    
-    aux_preprocessor_type = 'poly'
-    aux_preprocessor_kwargs = {'use_smoothing' : False,
-                               'include_time' : True}
-    
-    setup = PreprocessorSetup()
-    builder = ConcretePrepBuilder()
-    setup.builder = builder    
-    
-    if aux_preprocessor_type == 'ANN':
-        setup.build_ANN_preprocessing(**aux_preprocessor_kwargs)
-    elif aux_preprocessor_type == 'poly':
-        setup.build_poly_diff_preprocessing(**aux_preprocessor_kwargs)
-    elif aux_preprocessor_type == 'spectral':
-        setup.build_spectral_preprocessing(**aux_preprocessor_kwargs)
+    streaming = False # long recording in the memory-mapped dataset (see synthetic_data), processed by windows
+    if streaming:
+        # x of the stored (x, x') state is streamed: the search runs on the decimated series of t_max samples,
+        # the coefficients and SINDy are fitted on the normal equations, accumulated over all the windows
+        stream_dataset = 'datasets/synthetic/van_der_pol_long'
+        coords, states, _ = load_dataset(stream_dataset) # states stay memory-mapped
+        t_max = 320
+        stream = ChunkedSeries(coords[0], states, window = 8192, halo = 16, columns = [0,])
+        t_train, train_states = ChunkedSeries(coords[0], states, window = 8192).decimated(t_max)
+        t_test = t_train
+        x_train, y_train = train_states[:, 0], train_states[:, 1]
+        x_test, y_test = x_train, y_train
     else:
-        raise NotImplementedError('Incorrect default preprocessor type. Only ANN or poly are allowed.')
-    aux_preprocessor_pipeline = setup.builder.prep_pipeline
-
-    if 'max_order' not in aux_preprocessor_pipeline.deriv_calculator_kwargs.keys():
-        aux_preprocessor_pipeline.deriv_calculator_kwargs['max_order'] = None
+        t, x_stacked = prepare_data(steps_num=640)
+        t_max = 320
+        x, y = x_stacked[:, 0], x_stacked[:, 1]
+        t_train, t_test = t[:t_max], t[:t_max]
+        x_train, x_test = x[:t_max], x[:t_max]
+        y_train, y_test = y[:t_max], y[:t_max]
+    
+    # 'batched_poly' is the same local polynomial differentiation, as 'poly', applied to all the noisy 
+    # realizations (magnitude x replicate x time) at once
+    aux_preprocessor_type = 'batched_poly'
+    aux_preprocessor_kwargs = {'polynomial_window' : 9}
+    aux_preprocessor_pipeline = get_preprocessor_pipeline(aux_preprocessor_type, aux_preprocessor_kwargs)
         
       
     run_epde = True
     run_sindy = True
+    ensemble_sindy = False # bagging of SINDy over the bootstrap replicates of the library matrix
     pool = None
     pred = False
 
+    boundary = BoundarySet() # initial state of the test interval, shared by all the predictions
+    boundary.add_point('u', t_test[0], x_test[0], term = [None])
+    boundary.add_point('dudt', t_test[0], y_test[0], term = [0])
+
     exps = {}
+    prediction_memo = EquationMemo() # predictions of the repeated discoveries are reused
+    solution_models = SolutionModelCache() # solver training starts from the model of the similar system
     magnitudes = [0, 0.5*1e-2, 1.*1e-2, 2.5*1e-2, 5.*1e-2]# 10.*1e-2, 15.*1e-2] # # 
-    for magnitude in magnitudes:
-        x_train_n = x_train + np.random.normal(scale = np.abs(magnitude*x_train), 
-                                              size = x_train.shape)
-        _, dx_train_n = aux_preprocessor_pipeline.run(x_train_n, grid=[t_test,],
-                                                            max_order=(1,))
-        dx_train_n = dx_train_n.reshape(-1)               
+    replicates = 1
+    if streaming:
+        # the decimated noisy series are the samples of the same noisy streams, that are used in the refits
+        streams = [stream.with_noise(magnitude) for magnitude in magnitudes]
+        x_train_batch = np.stack([stream_n.decimated(t_max)[1][:, 0] for stream_n in streams])[:, np.newaxis]
+    else:
+        x_train_batch = as_working(x_train + np.random.normal(size = (len(magnitudes), replicates) + x_train.shape) 
+                                   * np.abs(np.reshape(magnitudes, (-1, 1, 1)) * x_train))
+    _, dx_train_batch = run_batch(aux_preprocessor_pipeline, x_train_batch, grid=[t_test,], max_order=(1,))
+    for mag_idx, magnitude in enumerate(magnitudes):
+        x_train_n = x_train_batch[mag_idx, 0]
+        dx_train_n = dx_train_batch[mag_idx, 0, :, 0]
         plt.plot(t_train, x_train, color = 'k', label = 'Initial data')
         plt.plot(t_train, x_train_n, color = 'r', label = 'Corrupted data')
         plt.grid()
@@ -312,15 +334,13 @@ if __name__ == "__main__":
                     epde_search_obj = epde_discovery_as_system(t_train, x_train_n, y_train, True)
                 else:
                     epde_search_obj, sys = epde_discovery_as_ode(t_train, x_train_n, y_train, True)
+                    if streaming:
+                        refitted, _ = stream_refit({'u' : sys.vals['u'].text_form}, streams[mag_idx],
+                                                   variable_names = ['u',], max_order = 2,
+                                                   pipeline = aux_preprocessor_pipeline)
+                        sys = translate_equation(refitted, epde_search_obj.pool)
                 t2 = time.time()
 
-                def get_ode_bop(key, grid_loc, value, var = 0, term = [None]):
-                    bop = BOPElement(axis = 0, key = key, term = term, power = 1, var = var)
-                    bop_grd_np = np.array([[grid_loc,]])
-                    bop.set_grid(torch.from_numpy(bop_grd_np).type(torch.FloatTensor))
-                    bop.values = torch.from_numpy(np.array([[value,]])).float()
-                    return bop
-
                 if pred:
                     plt.plot(t_train[50:-50], x_train[50:-50], color = 'k', label = "x, input")
                     plt.plot(t_train[50:-50], epde_search_obj.cache[1].get(('u', (1.0,)))[50:-50], 
@@ -337,10 +357,8 @@ if __name__ == "__main__":
                     plt.show()
                     
                     
-                    bop_u = get_ode_bop('u', t_test[0], x_test[0], term = [None])
-                    bop_dudt = get_ode_bop('dudt', t_test[0], y_test[0], term = [0])
-                    pred_u_v = epde_search_obj.predict(system=sys, boundary_conditions=[bop_u(), bop_dudt()], 
-                                                        grid = [t_test,], strategy='autograd')
+                    with profile_phase('prediction'):
+                        pred_u_v = prediction_memo.evaluate(sys, lambda: solution_models.predict(sys, boundary(), grid = [t_test,], strategy='autograd'))
                     pred_u_v = pred_u_v.reshape(x_test.shape)
                     
                     
@@ -374,12 +392,12 @@ if __name__ == "__main__":
                 calc_epde.append(pred_u_v)            
                 try:
                     logger.add_log(key = f'Van_der_Pol_noise_{magnitude}_attempt_{idx}', entry = sys, aggregation_key = ('epde', magnitude), 
-                                error_pred = np.mean(np.abs(x_test - pred_u_v)), time = t2 - t1)
+                                error_pred = np.mean(np.abs(x_test - pred_u_v)), time = t2 - t1, **memory_log())
                 except NameError:
                     logger = Logger(name = 'logs/Van_der_Pol_time_check.json', referential_equation = '-0.2 * du/dx1{power: 1.0} * u{power: 2.0} + 0.2 * du/dx1{power: 1.0} + -1.000 * u{power: 1.0} + 0.0 * u{power: 1.0} * d^2u/dx1^2{power: 2.0} + 0.0 = d^2u/dx1^2{power: 1.0}', 
                                     pool = epde_search_obj.pool)
                     logger.add_log(key = f'Van_der_Pol_noise_{magnitude}_attempt_{idx}', entry = sys, aggregation_key = ('epde', magnitude),
-                                error_pred = np.mean(np.abs(x_test - pred_u_v)), time = t2 - t1)
+                                error_pred = np.mean(np.abs(x_test - pred_u_v)), time = t2 - t1, **memory_log())
             
         errs_SINDy = []
         models_SINDy = []
@@ -393,7 +411,16 @@ if __name__ == "__main__":
                     pool = get_epde_pool(t_train, x_train_n, dx_train_n)
 
                     t1 = time.time()                       
-                    model_base = sindy_discovery(t_train, x_train_n, dx_train_n, sparsity=sparsity_thr)
+                    if streaming:
+                        model_base = StreamingSINDy(poly_order = 4, alpha = sparsity_thr, derivative_state = True,
+                                                    pipeline = aux_preprocessor_pipeline).fit(streams[mag_idx])
+                        model_base.print()
+                    elif ensemble_sindy:
+                        model_base = EnsembleSINDy(alpha = sparsity_thr, replicates = 100, processes = 4)
+                        model_base.fit(np.array([x_train_n, dx_train_n]).T, t_train)
+                        model_base.print()
+                    else:
+                        model_base = sindy_discovery(t_train, x_train_n, dx_train_n, sparsity=sparsity_thr)
                     t2 = time.time()
                     
                     if pred:
@@ -429,14 +456,17 @@ if __name__ == "__main__":
                 
                 try:
                     logger.add_log(key = f'VdP_SINDy_noise_{magnitude}_attempt_{idx}', entry = sys, aggregation_key = ('sindy', magnitude), 
-                                   error_pred = (err_u, err_v), time = t2 - t1)
+                                   error_pred = (err_u, err_v), time = t2 - t1, **memory_log())
                 except NameError:
                     logger = Logger(name = 'logs/Van_der_Pol_time_check.json', referential_equation = {'u' : '20.0 * u{power: 1.0} + -20.0 * u{power: 1.0} * v{power: 1.0} + 0.0 = du/dx1{power: 1.0}',
                                                                                                    'v' : '-20.0 * v{power: 1.0} + 20.0 * u{power: 1.0} * v{power: 1.0} + 0.0 = dv/dx1{power: 1.0}'}, 
                                     pool = pool)
                     logger.add_log(key = f'VdP_noise_{magnitude}_attempt_{idx}', entry = sys, aggregation_key = ('sindy', magnitude), 
-                                   error_pred = (err_u, err_v), time = t2 - t1) 
+                                   error_pred = (err_u, err_v), time = t2 - t1, **memory_log())
         exps[magnitude] = {'epde' : (models_epde, errs_epde, calc_epde),
                            'sindy' : (models_SINDy, errs_SINDy, calc_SINDy)}
                     
-    logger.dump()
\ No newline at end of file
+    logger.dump()
+    prediction_memo.report()
+    solution_models.report()
+    import_report()
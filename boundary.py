@@ -0,0 +1,52 @@
+import numpy as np
+
+from lazy_imports import lazy_import, lazy_from
+from precision import to_solver_tensor
+
+torch = lazy_import('torch')
+BOPElement, = lazy_from('epde.interface.solver_integration', 'BOPElement')
+
+
+class BoundarySet(object):
+    '''
+    Boundary conditions of the predictions on the fixed test grid: the boundary grids and operators are built once
+    (per test grid and data) with the tensors already in the solver dtype on the target device, and the same
+    list of conditions is passed into every ``predict`` / ``SolverAdapter.solve_epde_system`` call.
+    The values, that change between the attempts (e.g. derivatives from the discovery), are updated in place.
+    '''
+    def __init__(self, device: str = 'cpu'):
+        self.device = device
+        self._elements = {}
+        self._conditions = None
+
+    def tensor(self, array):
+        return to_solver_tensor(array).to(self.device)
+
+    def cartesian_grid(self, *coords):
+        '''
+        Boundary grid as the cartesian product of the coordinates along the axes (a single value for the fixed one).
+        '''
+        return torch.cartesian_prod(*[self.tensor(np.ravel(coord)) for coord in coords])
+
+    def add(self, key: str, axis: int, grid, values, term: list = [None], power: int = 1, var: int = 0):
+        bop = BOPElement(axis = axis, key = key, term = term, power = power, var = var)
+        bop.set_grid(grid if torch.is_tensor(grid) else self.tensor(grid))
+        bop.values = self.tensor(values)
+        self._elements[key] = bop
+        self._conditions = None
+        return self
+
+    def add_point(self, key: str, location: float, value: float, term: list = [None], var: int = 0):
+        '''
+        Condition of the ODE in the single point, e.g. initial value of the variable or its derivative.
+        '''
+        return self.add(key, 0, [[location,]], [[value,]], term = term, var = var)
+
+    def set_values(self, key: str, values):
+        bop_values = self._elements[key].values
+        bop_values.copy_(torch.from_numpy(np.ascontiguousarray(values).reshape(tuple(bop_values.shape))))
+
+    def __call__(self):
+        if self._conditions is None:
+            self._conditions = [bop() for bop in self._elements.values()]
+        return self._conditions
@@ -8,27 +8,37 @@ Created on Fri Mar 31 12:53:27 2023
 
 import numpy as np
 
-import torch
 import os
 from functools import reduce
 
 
-import matplotlib.pyplot as plt
-import matplotlib
+from lazy_imports import lazy_import, lazy_from, lazy_pyplot, import_report
 
 SMALL_SIZE = 12
-matplotlib.rc('font', size=SMALL_SIZE)
-matplotlib.rc('axes', titlesize=SMALL_SIZE)
+plt = lazy_pyplot(font_size = SMALL_SIZE)
 
-from scipy.io import loadmat
+loadmat, = lazy_from('scipy.io', 'loadmat')
 
-import pysindy as ps
+ps = lazy_import('pysindy')
+
+Logger, = lazy_from('epde.interface.logger', 'Logger')
+translate_equation, = lazy_from('epde.interface.equation_translator', 'translate_equation')
+epde_alg = lazy_import('epde.interface.interface')
+TrigonometricTokens, CacheStoredTokens = lazy_from('epde.interface.prepared_tokens', 'TrigonometricTokens',
+                                                   'CacheStoredTokens')
+
+get_preprocessor_pipeline, = lazy_from('preprocessing', 'get_preprocessor_pipeline')
+from grids import broadcast_grids, grids_section, axis_values
+from profiling import PROFILER, profile_phase, memory_log
+from canonical import EquationMemo
+from boundary import BoundarySet
+from solver_models import SolutionModelCache, predict
+from precision import set_precision, as_working
+from weak_form import weak_sindy_pde, weak_equation_text
+
+# the same filter is used by the search and by the pool, in which the SINDy equations are translated
+SPECTRAL_PREPROCESSOR_KWARGS = {'periodic_axes' : (1,), 'filter_type' : 'exponential'}
 
-from epde.interface.logger import Logger
-from epde.interface.equation_translator import translate_equation
-import epde.interface.interface as epde_alg
-from epde.interface.prepared_tokens import TrigonometricTokens, CacheStoredTokens
-from epde.interface.solver_integration import BOPElement, SolverAdapter
 
 def translate_sindy_eq(equation: str):
     correspondence = {"0" : "u{power: 1.0}",
@@ -70,8 +80,8 @@ def Heatmap(Matrix, interval = None, area = ((0, 1), (0, 1)), xlabel = '', ylabe
     if type(filename) != type(None): plt.savefig(filename + '.' + filename_type, format=filename_type)
     plt.show()
 
-def get_epde_pool(x, t, u, use_ann = False):
-    grids = np.meshgrid(t, x, indexing = 'ij')
+def get_epde_pool(x, t, u, use_ann = False, use_spectral = False):
+    grids = broadcast_grids(t, x)
     print(u.shape, grids[0].shape, grids[1].shape)
     multiobjective_mode = True
     dimensionality = u.ndim - 1
@@ -83,6 +93,9 @@ def get_epde_pool(x, t, u, use_ann = False):
     if use_ann:
         epde_search_obj.set_preprocessor(default_preprocessor_type='ANN', # use_smoothing = True
                                           preprocessor_kwargs={'epochs_max' : 2})
+    elif use_spectral:
+        epde_search_obj.set_preprocessor(preprocessor_pipeline=get_preprocessor_pipeline('periodic_spectral',
+                                                                                         SPECTRAL_PREPROCESSOR_KWARGS))
     popsize = 7
     if multiobjective_mode:
         epde_search_obj.set_moeadd_params(population_size = popsize, 
@@ -104,8 +117,8 @@ def get_epde_pool(x, t, u, use_ann = False):
 
     return epde_search_obj.pool
 
-def epde_discovery(x, t, u, use_ann = False):
-    grids = np.meshgrid(t, x, indexing = 'ij')
+def epde_discovery(x, t, u, use_ann = False, use_spectral = False):
+    grids = broadcast_grids(t, x)
     print(u.shape, grids[0].shape, grids[1].shape)
     multiobjective_mode = True
     dimensionality = u.ndim - 1
@@ -117,6 +130,9 @@ def epde_discovery(x, t, u, use_ann = False):
     if use_ann:
         epde_search_obj.set_preprocessor(default_preprocessor_type='ANN',
                                           preprocessor_kwargs={'epochs_max' : 20000})
+    elif use_spectral:
+        epde_search_obj.set_preprocessor(preprocessor_pipeline=get_preprocessor_pipeline('periodic_spectral',
+                                                                                         SPECTRAL_PREPROCESSOR_KWARGS))
     popsize = 7
     if multiobjective_mode:
         epde_search_obj.set_moeadd_params(population_size = popsize, 
@@ -137,10 +153,11 @@ def epde_discovery(x, t, u, use_ann = False):
     opt_val = 1e-1
     bounds = (1e-9, 1e0) if multiobjective_mode else (opt_val, opt_val)    
     print(u.shape, grids[0].shape)
-    epde_search_obj.fit(data=u, variable_names=['u',], max_deriv_order=(2, 2),
-                        equation_terms_max_number=5, data_fun_pow = 1, additional_tokens=[trig_tokens, custom_grid_tokens], 
-                        equation_factors_max_number=factors_max_number,
-                        eq_sparsity_interval=bounds)
+    with profile_phase('epde_search'):
+        epde_search_obj.fit(data=u, variable_names=['u',], max_deriv_order=(2, 2),
+                            equation_terms_max_number=5, data_fun_pow = 1, additional_tokens=[trig_tokens, custom_grid_tokens], 
+                            equation_factors_max_number=factors_max_number,
+                            eq_sparsity_interval=bounds)
     
     equation_obtained = False; compl = [4.5,]; attempt = 0
     
@@ -161,8 +178,8 @@ def epde_discovery(x, t, u, use_ann = False):
 
             
 def sindy_provided_l0(grids, u):
-    t = np.unique(grids[0])
-    x = np.unique(grids[1])        
+    t = axis_values(grids[0], 0)
+    x = axis_values(grids[1], 1)        
     u = u.T.reshape(len(x), len(t), 1)
     
     library_functions = [lambda x: x, lambda x: x * x]
@@ -190,7 +207,7 @@ def sindy_provided_l0(grids, u):
     elif opt == 'SSR':
         optimizer = ps.SSR(normalize_columns=True, kappa=1)
     model = ps.SINDy(feature_library=pde_lib, optimizer=optimizer)
-    model.fit(u, t=dt)
+    model.fit(u, t=t[1] - t[0])
     model.print()    
     return model
 
@@ -205,9 +222,15 @@ if __name__ == '__main__':
     print(u_file)
     data = loadmat(u_file)
 
-    t = np.ravel(data['t'])
-    x = np.ravel(data['x'])
-    u = np.real(data['usol']).T
+    precision = 'float64' # with 'float32' data and grids are kept in single precision (epde caches stay float64)
+    set_precision(precision)
+    profile_memory = False # peak RSS and top allocation sites of the search and prediction phases in the logs
+    if profile_memory:
+        PROFILER.enable()
+
+    t = as_working(np.ravel(data['t']))
+    x = as_working(np.ravel(data['x']))
+    u = as_working(np.real(data['usol']).T)
     dt = t[1] - t[0]
     dx = x[1] - x[0]
 
@@ -216,9 +239,9 @@ if __name__ == '__main__':
     raise NotImplementedError()
 
     train_max = 51    
-    grids = np.meshgrid(t, x, indexing = 'ij')
-    grids_training = (grids[0][:train_max, ...], grids[1][:train_max, ...])
-    grids_test = (grids[0][train_max:, ...], grids[1][train_max:, ...])    
+    grids = broadcast_grids(t, x)
+    grids_training = grids_section(grids, np.s_[:train_max, ...])
+    grids_test = grids_section(grids, np.s_[train_max:, ...])
 
     t_train, t_test = t[:train_max], t[train_max:]
     data_train, data_test = u[:train_max, ...], u[train_max:, ...]
@@ -228,12 +251,24 @@ if __name__ == '__main__':
 
     run_epde = True
     run_sindy = True
+    use_spectral = False
+    use_weak = False # SINDy on the weak form of the library: robust to the high noise without ANN smoothing
+
+    # boundary conditions on the test grid; derivative in the first test moment is set after each discovery
+    boundary = BoundarySet()
+    bnd_t = boundary.cartesian_grid([t[train_max + 1]], x)
+    boundary.add('u_t', 0, bnd_t, data_test[0, ...])
+    boundary.add('dudt', 0, bnd_t, np.zeros_like(x), term = [0])
+    boundary.add('u_x1', 1, boundary.cartesian_grid(t[train_max:], [x[0]]), data_test[..., 0])
+    boundary.add('u_x2', 1, boundary.cartesian_grid(t[train_max:], [x[-1]]), data_test[..., -1])
 
     exps = {}
+    prediction_memo = EquationMemo() # predictions of the repeated discoveries are reused
+    solution_models = SolutionModelCache() # solver training starts from the model of the similar system
     test_launches = 5
     magnitudes = [0, 1.*1e-2, 2.5*1e-2, 5.*1e-2, 1.*1e-1, 1.5 * 1e-1, 2. * 1e-1, 2.5 * 1e-1]
     for magnitude in magnitudes:
-        data_train_n = data_train + np.random.normal(scale = magnitude * np.abs(data_train), size = data_train.shape)
+        data_train_n = as_working(data_train + np.random.normal(scale = magnitude * np.abs(data_train), size = data_train.shape))
         
         errs_epde = []
         models_epde = []
@@ -242,37 +277,17 @@ if __name__ == '__main__':
         
         if run_epde:
             for idx in range(test_launches):
-                epde_search_obj, sys = epde_discovery(x, t_train, data_train_n, False)
+                epde_search_obj, sys = epde_discovery(x, t_train, data_train_n, False, use_spectral = use_spectral)
                 if pool is None:
                     pool = epde_search_obj.pool
         
-                bnd_t = torch.cartesian_prod(torch.from_numpy(np.array([t[train_max + 1]], dtype=np.float64)),
-                                              torch.from_numpy(x)).float()
-                
-                bop_1 = BOPElement(axis = 0, key = 'u_t', term = [None], power = 1, var = 0)
-                bop_1.set_grid(bnd_t)
-                bop_1.values = torch.from_numpy(data_test[0, ...]).float()
-                
                 t_der = epde_search_obj.saved_derivaties['u'][..., 0].reshape(grids_training[0].shape)
-                bop_2 = BOPElement(axis = 0, key = 'dudt', term = [0], power = 1, var = 0)
-                bop_2.set_grid(bnd_t)
-                bop_2.values = torch.from_numpy(t_der[-1, ...]).float()
-                
-                bnd_x1 = torch.cartesian_prod(torch.from_numpy(t[train_max:]),
-                                              torch.from_numpy(np.array([x[0]], dtype=np.float64))).float()
-                bnd_x2 = torch.cartesian_prod(torch.from_numpy(t[train_max:]),
-                                              torch.from_numpy(np.array([x[-1]], dtype=np.float64))).float()            
+                boundary.set_values('dudt', t_der[-1, ...])
                 
-                bop_3 = BOPElement(axis = 1, key = 'u_x1', term = [None], power = 1, var = 0)
-                bop_3.set_grid(bnd_x1)
-                bop_3.values = torch.from_numpy(data_test[..., 0]).float()            
-        
-                bop_4 = BOPElement(axis = 1, key = 'u_x2', term = [None], power = 1, var = 0)
-                bop_4.set_grid(bnd_x2)
-                bop_4.values = torch.from_numpy(data_test[..., -1]).float()            
-                
-                pred_u_v = epde_search_obj.predict(system=sys, boundary_conditions=[bop_1(), bop_2(), bop_3(), bop_4()], 
-                                                    grid = grids_test, strategy='NN')
+                with profile_phase('prediction'):
+                    # boundary conditions include the derivative from the noisy data, hence the magnitude in the key
+                    pred_u_v = prediction_memo.evaluate(sys, lambda: solution_models.predict(sys, boundary(), grid = grids_test, strategy='NN'),
+                                                        context = magnitude)
                 pred_u_v = pred_u_v.reshape(data_test.shape)
                 models_epde.append(epde_search_obj)
                 errs_epde.append(np.mean(np.abs(data_test - pred_u_v)))
@@ -280,43 +295,51 @@ if __name__ == '__main__':
                 
                 try:
                     logger.add_log(key = f'Burgers_{magnitude}_attempt_{idx}', entry = sys, aggregation_key = ('sindy', magnitude),
-                                   error_pred = np.mean(np.abs(data_test - pred_u_v)))
+                                   error_pred = np.mean(np.abs(data_test - pred_u_v)), **memory_log())
                 except NameError:
                     logger = Logger(name = 'logs/Burgers_EPDE_high_noise.json', referential_equation = '0.1 * d^2u/dx2^2{power: 1.0} + 1.0 * u{power: 1.0} * du/dx2{power: 1.0}  + 0.0 = du/dx1{power: 1.0}', 
                                     pool = epde_search_obj.pool)
                     logger.add_log(key = f'Burgers_{magnitude}_attempt_{idx}', entry = sys, aggregation_key = ('sindy', magnitude),
-                                   error_pred = np.mean(np.abs(data_test - pred_u_v)))
+                                   error_pred = np.mean(np.abs(data_test - pred_u_v)), **memory_log())
                  
             
         if run_sindy:
             if pool is None:
-                pool = get_epde_pool(x, t_train, data_train_n)
+                pool = get_epde_pool(x, t_train, data_train_n, use_spectral = use_spectral)
             print(pool)
-            model_base = sindy_provided_l0(grids_training, data_train_n)
-            sys = translate_equation(translate_sindy_eq(model_base.equations()[0]), pool)
+            if use_weak:
+                model_base = weak_sindy_pde(data_train_n, t_train, x, threshold = 0.05, degree = 2, max_order = 2,
+                                            support = (31, 41), stride = (4, 4))
+                sys = translate_equation(weak_equation_text(*model_base), pool)
+            else:
+                model_base = sindy_provided_l0(grids_training, data_train_n)
+                sys = translate_equation(translate_sindy_eq(model_base.equations()[0]), pool)
             
             solver_args = {'model' : None, 'use_cache' : True, 'dim': 2}#len(global_var.grid_cache.get_all()[1])}
             strategy = 'NN'
             
-            adapter = SolverAdapter(var_number = len(sys.vars_to_describe))
-            solution_model = adapter.solve_epde_system(system = sys, grids = grids_test, data = data_test, 
-                                                       strategy = strategy)
-            
-            pred_u_v = solution_model(adapter.convert_grid(grids_test)).detach().numpy().reshape(data_test.shape)
+            with profile_phase('prediction'):
+                # cold start, out of the cache of the EPDE solutions: the errors of the methods stay independent
+                pred_u_v, _ = predict(sys, None, grid = grids_test, strategy = strategy, data = data_test,
+                                      solver_kwargs = {})
+            pred_u_v = pred_u_v.reshape(data_test.shape)
             errs_sindy = np.mean(np.abs(data_test - pred_u_v))
             calc_sindy = pred_u_v
             try:
                 logger.add_log(key = f'Burgers_sindy_{magnitude}', entry = sys, aggregation_key = ('sindy', magnitude), 
-                               error_pred = np.mean(np.abs(data_test - pred_u_v)))
+                               error_pred = np.mean(np.abs(data_test - pred_u_v)), **memory_log())
             except NameError:
                 logger = Logger(name = 'logs/Burgers_SINDy_new.json', referential_equation = '0.1 * d^2u/dx2^2{power: 1.0} + 1.0 * u{power: 1.0} * du/dx2{power: 1.0}  + 0.0 = du/dx1{power: 1.0}', 
                                 pool = pool)
                 logger.add_log(key = f'Burgers_sindy_{magnitude}', entry = sys, aggregation_key = ('sindy', magnitude),
-                               error_pred = np.mean(np.abs(data_test - pred_u_v)))
+                               error_pred = np.mean(np.abs(data_test - pred_u_v)), **memory_log())
 
         else:
             model_base, errs_sindy, calc_sindy = None, None, None
         
         exps[magnitude] = {'epde': (models_epde, errs_epde, calc_epde),
                            'SINDy': (model_base, errs_sindy, calc_sindy)}
-    logger.dump()
\ No newline at end of file
+    logger.dump()
+    prediction_memo.report()
+    solution_models.report()
+    import_report()
@@ -0,0 +1,88 @@
+import hashlib
+from typing import Callable, Union
+
+
+def parse_equation_text(text_form: str):
+    '''
+    Split the equation text form 'c_1 * f_11 * f_12 + ... + c_0 = target' into the dict {term: coefficient}
+    (with factors of each term sorted, and the free coefficient under the key '1') and the target term.
+    '''
+    left, target = text_form.split(' = ')
+    terms = {}
+    for term in left.split(' + '):
+        elems = term.strip().split(' * ')
+        try:
+            coeff = float(elems[0])
+            factors = elems[1:]
+        except ValueError:
+            coeff = 1.
+            factors = elems
+        terms[' * '.join(sorted(factors)) if len(factors) else '1'] = coeff
+    return terms, ' * '.join(sorted(target.strip().split(' * ')))
+
+
+def _text_forms(system) -> dict:
+    if isinstance(system, str):
+        return {'u' : system}
+    elif isinstance(system, dict):
+        return system
+    return {var : system.vals[var].text_form for var in system.vars_to_describe}
+
+
+def quantize(value: float, significant_digits: int = 2):
+    '''
+    Rounding to the significant digits: nearly identical coefficients of the repeated discoveries get the same value.
+    '''
+    return float(f'{value:.{significant_digits}g}')
+
+
+def canonical_form(system: Union[str, dict], significant_digits: int = 2, zero_tol: float = 1e-3):
+    '''
+    Canonical form of the system (SoEq, {variable : text form} or the text form of the single equation):
+    equations sorted by the variables, the terms with sorted factors, sorted and with the quantized
+    coefficients; the terms with coefficients below zero_tol of the largest one in the equation are dropped.
+    '''
+    canonical = []
+    for var, text_form in sorted(_text_forms(system).items()):
+        terms, target = parse_equation_text(text_form)
+        scale = max([abs(coeff) for coeff in terms.values()])
+        terms = tuple(sorted([(term, quantize(coeff, significant_digits)) for term, coeff in terms.items()
+                              if abs(coeff) > zero_tol * scale]))
+        canonical.append((var, target, terms))
+    return tuple(canonical)
+
+
+def equation_hash(system, significant_digits: int = 2, zero_tol: float = 1e-3):
+    return hashlib.sha1(repr(canonical_form(system, significant_digits, zero_tol)).encode()).hexdigest()[:16]
+
+
+class EquationMemo(object):
+    '''
+    Memo of the expensive evaluations of the discovered systems (solver predictions, scores), keyed by the
+    canonical hash of the system and the context (e.g. the noise magnitude, if the boundary conditions depend
+    on it). The duplicates of the previous attempts get the stored result instead of the new solver call.
+    '''
+    def __init__(self, significant_digits: int = 2):
+        self.significant_digits = significant_digits
+        self._results = {}
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, system, context = None):
+        return (equation_hash(system, self.significant_digits), context)
+
+    def evaluate(self, system, fun: Callable, context = None):
+        key = self.key(system, context)
+        if key in self._results:
+            self.hits += 1
+            return self._results[key]
+        self.misses += 1
+        self._results[key] = fun()
+        return self._results[key]
+
+    def clear(self):
+        self._results.clear()
+
+    def report(self):
+        print(f'Equation memo: {len(self._results)} distinct systems, {self.hits} of {self.hits + self.misses} '
+              f'evaluations reused')
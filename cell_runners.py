@@ -0,0 +1,119 @@
+import os
+import json
+import time
+import zlib
+import importlib.util
+import numpy as np
+
+from lazy_imports import lazy_from
+from precision import as_working
+from grids import broadcast_grids, grids_section
+
+loadmat, = lazy_from('scipy.io', 'loadmat')
+
+SCRIPTS = {'kdv' : 'KdV.py', 'burgers' : 'burgers.py', 'lotka_volterra' : 'lotka-volterra.py',
+           'van_der_pol' : 'Van_der_Pol.py'}
+
+_scripts = {}
+
+
+def load_script(system: str):
+    '''
+    Module of the experiment script of the system (the ``__main__`` block is not executed).
+    '''
+    if system not in SCRIPTS:
+        raise NotImplementedError(f'Unknown system {system}. Only {", ".join(SCRIPTS)} are allowed.')
+    if system not in _scripts:
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), SCRIPTS[system])
+        spec = importlib.util.spec_from_file_location(f'{system}_experiment', path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        _scripts[system] = module
+    return _scripts[system]
+
+
+def dataset_path(*parts):
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), 'datasets', *parts)
+
+
+def noise_generator(cell: dict):
+    '''
+    Generator of the noise of the cell, seeded by the system and the magnitude: all the attempts and methods
+    of the magnitude get the same noisy realization, as in the loops of the scripts.
+    '''
+    seed_key = json.dumps({'system' : cell['system'], 'magnitude' : cell['magnitude']}, sort_keys = True)
+    return np.random.default_rng(zlib.crc32(seed_key.encode()))
+
+
+def add_noise(rng, data: np.ndarray, magnitude: float):
+    return as_working(data + rng.normal(scale = magnitude * np.abs(data), size = data.shape))
+
+
+def text_forms(system):
+    return {var : system.vals[var].text_form for var in system.vars_to_describe}
+
+
+def pde_cell(script, dataset: str, train_max: int, method: str, magnitude: float, rng):
+    data = loadmat(dataset_path(*dataset.split('/')))
+    t, x = as_working(np.ravel(data['t'])), as_working(np.ravel(data['x']))
+    u_train = add_noise(rng, as_working(np.real(data['usol']).T)[:train_max, ...], magnitude)
+    if method == 'epde':
+        _, system = script.epde_discovery(x, t[:train_max], u_train, False)
+        return text_forms(system)
+    grids_training = grids_section(broadcast_grids(t, x), np.s_[:train_max, ...])
+    model = script.sindy_provided_l0(grids_training, u_train)
+    return {'u' : script.translate_sindy_eq(model.equations()[0])}
+
+
+def kdv_cell(method: str, magnitude: float, rng):
+    return pde_cell(load_script('kdv'), 'kdv/kdv.mat', 200, method, magnitude, rng)
+
+
+def burgers_cell(method: str, magnitude: float, rng):
+    return pde_cell(load_script('burgers'), 'burgers/burgers.mat', 51, method, magnitude, rng)
+
+
+def lotka_volterra_cell(method: str, magnitude: float, rng):
+    script, t_max = load_script('lotka_volterra'), 150
+    t = as_working(np.load(dataset_path('lotka_volterra', 't_20.npy')))
+    data = as_working(np.load(dataset_path('lotka_volterra', 'data_20.npy')))
+    x_n, y_n = add_noise(rng, data[:t_max, 0], magnitude), add_noise(rng, data[:t_max, 1], magnitude)
+    if method == 'epde':
+        _, system = script.epde_discovery(t[:t_max], x_n, y_n, False)
+        return text_forms(system)
+    model = script.sindy_discovery(t[:t_max], x_n, y_n, sparsity = 50.)
+    return dict(zip(['u', 'v'], script.translate_sindy_eq(model.equations())))
+
+
+def van_der_pol_cell(method: str, magnitude: float, rng):
+    script, t_max = load_script('van_der_pol'), 320
+    t, states = script.prepare_data(steps_num = 640)
+    t_train, x_train, y_train = t[:t_max], states[:t_max, 0], states[:t_max, 1]
+    x_n = add_noise(rng, x_train, magnitude)
+    if method == 'epde':
+        _, system = script.epde_discovery_as_ode(t_train, x_n, y_train, True)
+        return text_forms(system)
+    pipeline = script.get_preprocessor_pipeline('batched_poly', {'polynomial_window' : 9})
+    _, dx_n = script.run_batch(pipeline, x_n[np.newaxis], grid = [t_train,], max_order = (1,))
+    model = script.sindy_discovery(t_train, x_n, dx_n[0, :, 0], sparsity = 50.)
+    return dict(zip(['u', 'v'], script.translate_sindy_eq(model.equations())))
+
+
+CELL_RUNNERS = {'kdv' : kdv_cell, 'burgers' : burgers_cell, 'lotka_volterra' : lotka_volterra_cell,
+                'van_der_pol' : van_der_pol_cell}
+
+
+def run_cell(cell: dict):
+    '''
+    Discovery of the experiment grid cell {'system', 'method', 'magnitude', 'attempt'} with the discovery functions
+    and the training data of the experiment scripts, for ``job_queue.run_worker``. Returns the discovered
+    equations {variable : text form} and the wall time of the discovery; the predictions on the test intervals
+    remain in the scripts.
+    '''
+    if cell['method'] not in ('epde', 'sindy'):
+        raise NotImplementedError(f'Unknown method {cell["method"]}. Only epde or sindy are allowed.')
+    if cell['system'] not in CELL_RUNNERS:
+        raise NotImplementedError(f'Unknown system {cell["system"]}. Only {", ".join(CELL_RUNNERS)} are allowed.')
+    start = time.time()
+    equations = CELL_RUNNERS[cell['system']](cell['method'], cell['magnitude'], noise_generator(cell))
+    return {'equations' : equations, 'time' : time.time() - start}
@@ -0,0 +1,35 @@
+import numpy as np
+
+
+def sparse_grids(*axes):
+    '''
+    Coordinate tensors in the 'ij' indexing with a single non-trivial dimension each, i.e. the output of
+    ``np.meshgrid(*axes, indexing = 'ij', sparse = True)``.
+    '''
+    return np.meshgrid(*axes, indexing = 'ij', sparse = True)
+
+
+def broadcast_grids(*axes):
+    '''
+    Read-only views with the full shape of the domain, equal to the dense ``np.meshgrid(*axes, indexing = 'ij')``,
+    that store only the 1-D axes: the strides along the other dimensions are zero. Slicing these views
+    (e.g. for the train/test split) keeps them views.
+    '''
+    shape = tuple(axis.size for axis in axes)
+    return [np.broadcast_to(grid, shape) for grid in sparse_grids(*axes)]
+
+
+def grids_section(grids, section):
+    return [grid[section] for grid in grids]
+
+
+def axis_values(grid_tensor: np.ndarray, axis: int):
+    '''
+    Coordinates along the ``axis``, extracted from the dense, sparse, broadcast or 1-D grid tensor.
+    Replaces ``np.unique(grid)``, that sorts all the nodes of the domain.
+    '''
+    if grid_tensor.ndim == 1:
+        return grid_tensor
+    section = tuple(slice(None) if ax_idx == axis else 0 for ax_idx in range(grid_tensor.ndim))
+    return np.ravel(grid_tensor[section])
+
@@ -0,0 +1,275 @@
+import os
+import json
+import time
+import socket
+import sqlite3
+import argparse
+import threading
+import importlib
+import multiprocessing as mp
+from itertools import product
+from typing import Callable
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    cell TEXT UNIQUE NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    worker TEXT,
+    tries INTEGER NOT NULL DEFAULT 0,
+    heartbeat REAL,
+    started REAL,
+    finished REAL,
+    result TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id);
+'''
+
+
+def experiment_cells(systems: list, methods: list, magnitudes: list, attempts: int):
+    '''
+    Cells of the experiment grid: every (system, method, magnitude, attempt) combination.
+    '''
+    return [{'system' : system, 'method' : method, 'magnitude' : magnitude, 'attempt' : attempt}
+            for system, method, magnitude, attempt in product(systems, methods, magnitudes, range(attempts))]
+
+
+def worker_name():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+class JobQueue(object):
+    '''
+    Pull-based queue of the experiment cells in the SQLite file, e.g. on the shared filesystem: the workers on any
+    node claim the pending cells one by one, thus the faster nodes process more of them. The running cell is
+    kept alive by the heartbeats of its worker; the cell without heartbeats for ``stale_after`` seconds (crashed
+    worker) returns to the queue, after ``max_tries`` claims it is marked as failed. The results are stored
+    in the same file. The rollback journal is used instead of WAL, as the latter does not work on the network
+    filesystems; the claims are serialized by the write lock of the database.
+    '''
+    def __init__(self, path: str, stale_after: float = 300., max_tries: int = 3, timeout: float = 60.):
+        self.path = path
+        self.stale_after = stale_after
+        self.max_tries = max_tries
+        self._connection = sqlite3.connect(path, timeout = timeout, isolation_level = None,
+                                           check_same_thread = False)
+        self._lock = threading.Lock() # the connection is shared with the heartbeat thread
+        with self._lock:
+            self._connection.executescript(SCHEMA)
+
+    def _transaction(self, statements: Callable):
+        with self._lock:
+            cursor = self._connection.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            try:
+                result = statements(cursor)
+                cursor.execute('COMMIT')
+            except BaseException:
+                cursor.execute('ROLLBACK')
+                raise
+            return result
+
+    def add_cells(self, cells: list):
+        '''
+        Enqueue the cells; the ones, already present in the queue (in any status), are skipped.
+        Returns the number of the added cells.
+        '''
+        rows = [(json.dumps(cell, sort_keys = True),) for cell in cells]
+        def insert(cursor):
+            before = cursor.execute('SELECT COUNT(*) FROM jobs').fetchone()[0]
+            cursor.executemany('INSERT OR IGNORE INTO jobs (cell) VALUES (?)', rows)
+            return cursor.execute('SELECT COUNT(*) FROM jobs').fetchone()[0] - before
+        return self._transaction(insert)
+
+    def requeue_stale(self, cursor = None):
+        if cursor is None:
+            return self._transaction(self.requeue_stale)
+        deadline = time.time() - self.stale_after
+        cursor.execute("UPDATE jobs SET status = 'failed', error = 'worker lost' "
+                       "WHERE status = 'running' AND heartbeat < ? AND tries >= ?", (deadline, self.max_tries))
+        cursor.execute("UPDATE jobs SET status = 'pending', worker = NULL "
+                       "WHERE status = 'running' AND heartbeat < ?", (deadline,))
+        return cursor.rowcount
+
+    def claim(self, worker: str = None):
+        '''
+        Take the next pending cell; returns (job id, cell) or None, if there are no pending cells.
+        '''
+        worker = worker_name() if worker is None else worker
+        def take(cursor):
+            self.requeue_stale(cursor)
+            row = cursor.execute("SELECT id, cell FROM jobs WHERE status = 'pending' ORDER BY id LIMIT 1").fetchone()
+            if row is None:
+                return None
+            now = time.time()
+            cursor.execute("UPDATE jobs SET status = 'running', worker = ?, tries = tries + 1, heartbeat = ?, "
+                           "started = ? WHERE id = ?", (worker, now, now, row[0]))
+            return row[0], json.loads(row[1])
+        return self._transaction(take)
+
+    def heartbeat(self, job_id: int, worker: str):
+        '''
+        Returns False, if the cell is not held by the worker anymore (e.g. was re-queued after the long stall).
+        '''
+        def beat(cursor):
+            cursor.execute("UPDATE jobs SET heartbeat = ? WHERE id = ? AND worker = ? AND status = 'running'",
+                           (time.time(), job_id, worker))
+            return cursor.rowcount == 1
+        return self._transaction(beat)
+
+    def complete(self, job_id: int, worker: str, result):
+        self._transaction(lambda cursor: cursor.execute(
+            "UPDATE jobs SET status = 'done', result = ?, finished = ? WHERE id = ? AND worker = ?",
+            (json.dumps(result, default = str), time.time(), job_id, worker)))
+
+    def fail(self, job_id: int, worker: str, error: str):
+        self._transaction(lambda cursor: cursor.execute(
+            "UPDATE jobs SET status = CASE WHEN tries >= ? THEN 'failed' ELSE 'pending' END, worker = NULL, "
+            "error = ? WHERE id = ? AND worker = ?", (self.max_tries, error, job_id, worker)))
+
+    def status(self):
+        with self._lock:
+            return dict(self._connection.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall())
+
+    def results(self):
+        '''
+        Cells, paired with their results, in the order of the queue.
+        '''
+        with self._lock:
+            rows = self._connection.execute("SELECT cell, result FROM jobs WHERE status = 'done' ORDER BY id").fetchall()
+        return [(json.loads(cell), json.loads(result)) for cell, result in rows]
+
+    def close(self):
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class Heartbeat(object):
+    '''
+    Background thread, that keeps the claimed cell alive while the worker runs it.
+    '''
+    def __init__(self, queue: JobQueue, job_id: int, worker: str, interval: float = 30.):
+        self.queue, self.job_id, self.worker, self.interval = queue, job_id, worker, interval
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target = self._run, daemon = True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                if not self.queue.heartbeat(self.job_id, self.worker):
+                    self.lost = True
+            except sqlite3.OperationalError: # database is busy for longer than the timeout, retried next time
+                pass
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._stop.set()
+        self._thread.join()
+
+
+def _cell_process(run_cell: Callable, cell: dict, connection):
+    try:
+        connection.send(('done', run_cell(cell)))
+    except Exception as error:
+        connection.send(('error', repr(error)))
+    finally:
+        connection.close()
+
+
+def run_isolated(run_cell: Callable, cell: dict, heartbeat: Heartbeat, poll_interval: float = 1.,
+                 start_method: str = 'spawn'):
+    '''
+    Run the cell in the child process, that is terminated, as soon as the heartbeat of the cell is lost (the cell
+    was re-queued and may be already run by the other worker). Returns (status, result or error), the status is
+    'done', 'error' or 'lost'.
+    '''
+    context = mp.get_context(start_method)
+    receiver, sender = context.Pipe(duplex = False)
+    process = context.Process(target = _cell_process, args = (run_cell, cell, sender))
+    process.start()
+    sender.close()
+    try:
+        while not receiver.poll(poll_interval):
+            if heartbeat.lost:
+                process.terminate()
+                return 'lost', None
+        try:
+            return receiver.recv()
+        except EOFError: # the process has died without the result
+            process.join()
+            return 'error', f'cell process exited with code {process.exitcode}'
+    finally:
+        process.join()
+        receiver.close()
+
+
+def run_worker(path: str, run_cell: Callable, worker: str = None, heartbeat_interval: float = 30.,
+               poll_interval: float = 10., wait_for_cells: bool = False, **queue_kwargs):
+    '''
+    Claim and run the cells, until the queue has no pending ones (or forever, with ``wait_for_cells``).
+    ``run_cell(cell)`` returns the JSON-serializable result; its exception marks the cell for the retry.
+    The cell runs in the child process (thus ``run_cell`` has to be defined at the top level of a module), which
+    is stopped, when the cell is lost by the worker. Returns the number of the completed cells.
+    '''
+    worker = worker_name() if worker is None else worker
+    completed = 0
+    with JobQueue(path, **queue_kwargs) as queue:
+        while True:
+            job = queue.claim(worker)
+            if job is None:
+                if not wait_for_cells and not queue.status().get('running', 0):
+                    return completed
+                time.sleep(poll_interval) # the running cells of the lost workers may return to the queue
+                continue
+            job_id, cell = job
+            print(f'{worker}: cell {job_id} {cell}')
+            with Heartbeat(queue, job_id, worker, heartbeat_interval) as heartbeat:
+                status, result = run_isolated(run_cell, cell, heartbeat)
+            if status == 'lost':
+                print(f'{worker}: cell {job_id} was re-queued, abandoned')
+            elif status == 'error':
+                queue.fail(job_id, worker, result)
+            else:
+                queue.complete(job_id, worker, result)
+                completed += 1
+
+
+def resolve(function_path: str):
+    '''
+    Function by the 'module:function' path.
+    '''
+    module_name, function_name = function_path.split(':')
+    return getattr(importlib.import_module(module_name), function_name)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'SQLite queue of the experiment cells')
+    parser.add_argument('command', choices = ['init', 'worker', 'status'])
+    parser.add_argument('queue', help = 'path to the queue database, e.g. on the shared filesystem')
+    parser.add_argument('--systems', nargs = '+', default = ['kdv', 'burgers', 'lotka_volterra', 'van_der_pol'])
+    parser.add_argument('--methods', nargs = '+', default = ['epde', 'sindy'])
+    parser.add_argument('--magnitudes', nargs = '+', type = float, default = [0., 0.01, 0.025, 0.05])
+    parser.add_argument('--attempts', type = int, default = 10)
+    parser.add_argument('--run', default = 'cell_runners:run_cell',
+                        help = "'module:function', called with the cell dict in the worker")
+    args = parser.parse_args()
+
+    if args.command == 'init':
+        with JobQueue(args.queue) as queue:
+            added = queue.add_cells(experiment_cells(args.systems, args.methods, args.magnitudes, args.attempts))
+            print(f'{added} cells added, queue status: {queue.status()}')
+    elif args.command == 'worker':
+        print(f'{run_worker(args.queue, resolve(args.run))} cells completed')
+    else:
+        with JobQueue(args.queue) as queue:
+            print(queue.status())
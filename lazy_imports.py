@@ -0,0 +1,90 @@
+import sys
+import time
+import types
+import importlib
+
+IMPORT_TIMES = {}
+
+
+def timed_import(name: str):
+    '''
+    Import of the module with the record of its duration (including the imports of its dependencies,
+    that were not loaded before) into IMPORT_TIMES.
+    '''
+    if name in sys.modules:
+        return sys.modules[name]
+    start = time.perf_counter()
+    module = importlib.import_module(name)
+    IMPORT_TIMES[name] = time.perf_counter() - start
+    return module
+
+
+class LazyModule(types.ModuleType):
+    '''
+    Placeholder of the module, that is imported on the first access to its attributes. ``on_import`` is called
+    with the loaded module once, e.g. to set the plotting parameters.
+    '''
+    def __init__(self, name: str, on_import=None):
+        super().__init__(name)
+        self._lazy_name = name
+        self._on_import = on_import
+        self._module = None
+
+    def _load(self):
+        if self._module is None:
+            module = timed_import(self._lazy_name)
+            if self._on_import is not None:
+                self._on_import(module)
+            self._module = module
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __dir__(self):
+        return dir(self._load())
+
+
+class LazyCallable(object):
+    '''
+    Placeholder of the function or class from the module, importing the module on the first call.
+    '''
+    def __init__(self, module_name: str, attr: str):
+        self.module_name = module_name
+        self.attr = attr
+
+    def __call__(self, *args, **kwargs):
+        return getattr(timed_import(self.module_name), self.attr)(*args, **kwargs)
+
+
+def lazy_import(name: str, on_import=None):
+    return LazyModule(name, on_import)
+
+
+def lazy_from(module_name: str, *attrs):
+    '''
+    Lazy analogue of ``from module_name import attr_1, attr_2, ...`` for the callable attributes.
+    '''
+    return tuple(LazyCallable(module_name, attr) for attr in attrs)
+
+
+def lazy_pyplot(font_size: int = 12):
+    '''
+    matplotlib.pyplot with the font sizes of the experiment figures, set on the first use.
+    '''
+    def set_fonts(plt):
+        plt.rc('font', size=font_size)
+        plt.rc('axes', titlesize=font_size)
+    return lazy_import('matplotlib.pyplot', on_import = set_fonts)
+
+
+def import_report(verbose: bool = True):
+    '''
+    Durations of the imports, held through this module (the heavy dependencies are imported here only
+    when the code path needs them). For the complete picture use ``python -X importtime``.
+    '''
+    if verbose:
+        for name, duration in sorted(IMPORT_TIMES.items(), key = lambda item: -item[1]):
+            print(f'import {name}: {duration:.2f} s')
+        print(f'Total time of the lazy imports: {sum(IMPORT_TIMES.values()):.2f} s')
+    return dict(IMPORT_TIMES)
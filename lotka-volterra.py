@@ -9,28 +9,37 @@ Created on Fri Mar 31 12:53:27 2023
 import numpy as np
 import time
 
-import torch
 import os
 
-import matplotlib.pyplot as plt
-import matplotlib
+from lazy_imports import lazy_import, lazy_from, lazy_pyplot, import_report
 
 SMALL_SIZE = 12
-matplotlib.rc('font', size=SMALL_SIZE)
-matplotlib.rc('axes', titlesize=SMALL_SIZE)
+plt = lazy_pyplot(font_size = SMALL_SIZE)
 
 
 from functools import reduce
 
-import pysindy as ps
+ps = lazy_import('pysindy')
 
-import epde.interface.interface as epde_alg
-from epde.interface.solver_integration import BOPElement
-from epde.interface.logger import Logger
+epde_alg = lazy_import('epde.interface.interface')
+Logger, = lazy_from('epde.interface.logger', 'Logger')
 
-from epde.interface.equation_translator import translate_equation
+translate_equation, = lazy_from('epde.interface.equation_translator', 'translate_equation')
+dense_resample, get_preprocessor_pipeline = lazy_from('preprocessing', 'dense_resample', 'get_preprocessor_pipeline')
+warm_started_fit, = lazy_from('population_fitting', 'warm_started_fit')
+ChunkedSeries, StreamingSINDy, stream_refit = lazy_from('streaming', 'ChunkedSeries', 'StreamingSINDy', 'stream_refit')
+SlidingWindow, sliding_discovery = lazy_from('sliding_window', 'SlidingWindow', 'sliding_discovery')
+
+from profiling import PROFILER, profile_phase, memory_log
+from canonical import EquationMemo
+from boundary import BoundarySet
+from solver_models import SolutionModelCache
+from precision import set_precision, as_working
+from sindy_tools import EnsembleSINDy
+from synthetic_data import load_dataset
 
 SOLVER_STRATEGY = 'autograd'
+POLY_PREPROCESSOR_KWARGS = {'use_smoothing' : True, 'sigma' : 1, 'polynomial_window' : 3, 'poly_order' : 3}
 
 def write_pareto(dict_of_exp):
     for key, item in dict_of_exp.items():
@@ -115,7 +124,7 @@ def get_epde_pool(t, x, y, use_ann = False):
 
     return epde_search_obj.pool
 
-def epde_discovery(t, x, y, use_ann = False):
+def epde_discovery(t, x, y, use_ann = False, derivs = None, seeds = None, training_epochs = 55):
     dimensionality = x.ndim - 1
     epde_search_obj = epde_alg.EpdeSearch(use_solver = False, dimensionality = dimensionality, boundary = 25,
                                            coordinate_tensors = [t,])
@@ -124,16 +133,21 @@ def epde_discovery(t, x, y, use_ann = False):
                                          preprocessor_kwargs={'epochs_max' : 35000}) 
     else:
         epde_search_obj.set_preprocessor(default_preprocessor_type='poly',
-                                         preprocessor_kwargs={'use_smoothing' : True, 'sigma' : 1, 
-                                                              'polynomial_window' : 3, 'poly_order' : 3}) # 'epochs_max' : 10000})# 
+                                         preprocessor_kwargs=POLY_PREPROCESSOR_KWARGS) # 'epochs_max' : 10000})# 
     popsize = 35
-    epde_search_obj.set_moeadd_params(population_size = popsize, training_epochs=55)
+    epde_search_obj.set_moeadd_params(population_size = popsize, training_epochs=training_epochs)
     factors_max_number = {'factors_num' : [1, 2], 'probas' : [0.5, 0.5]}
+    fit_params = dict(data=[x, y], variable_names=['u', 'v'], max_deriv_order=(1,), derivs = derivs,
+                      equation_terms_max_number=5, data_fun_pow = 2, #additional_tokens=[trig_tokens,], 
+                      equation_factors_max_number=factors_max_number,
+                      eq_sparsity_interval=(1e-12, 1e-4))
     
-    epde_search_obj.fit(data=[x, y], variable_names=['u', 'v'], max_deriv_order=(1,),
-                        equation_terms_max_number=5, data_fun_pow = 2, #additional_tokens=[trig_tokens,], 
-                        equation_factors_max_number=factors_max_number,
-                        eq_sparsity_interval=(1e-12, 1e-4))
+    with profile_phase('epde_search'):
+        if seeds is None:
+            epde_search_obj.fit(**fit_params)
+        else:
+            # initial population contains the Pareto front of the search on the previous window
+            warm_started_fit(epde_search_obj, seeds, **fit_params)
 
     epde_search_obj.equations(only_print = True, num = 1)
     equation_obtained = False; compl = [2.5, 2.5]; attempt = 0
@@ -205,46 +219,122 @@ if __name__ == '__main__':
     '''
     Подгружаем данные, содержащие временные ряды динамики "вида-охотника" и "вида-жертвы"
     '''
+    precision = 'float64' # with 'float32' data and grids are kept in single precision (epde caches stay float64)
+    set_precision(precision)
+    profile_memory = False # peak RSS and top allocation sites of the search and prediction phases in the logs
+    if profile_memory:
+        PROFILER.enable()
+
     try:
         t_file = os.path.join(os.path.dirname( __file__ ), 'datasets/lotka_volterra/t_20.npy')
-        t = np.load(t_file)
+        t = as_working(np.load(t_file))
     except FileNotFoundError:
         t_file = '/home/maslyaev/epde/EPDE_main/projects/hunter-prey/t_20.npy'
-        t = np.load(t_file)
+        t = as_working(np.load(t_file))
     
     try:
         data_file =  os.path.join(os.path.dirname( __file__ ), 'datasets/lotka_volterra/data_20.npy')
-        data = np.load(data_file)
+        data = as_working(np.load(data_file))
     except FileNotFoundError:
         data_file = '/home/maslyaev/epde/EPDE_main/projects/hunter-prey/data_20.npy'
-        data = np.load(data_file)
+        data = as_working(np.load(data_file))
     
     large_data = False
-    if large_data:
-        t_max = 400; t_size_raw = 100; t_size_dense = 1000
+    train_size = 150 # points of the training interval of data_20.npy (of 301), the rest is the test interval
+    streaming = False # long recording in the memory-mapped dataset (see synthetic_data), processed by windows
+    if streaming:
+        # the search runs on the decimated training series, the coefficients of the discovered systems and
+        # SINDy are fitted on the normal equations, accumulated over all the windows of the training series
+        stream_dataset = 'datasets/synthetic/lotka_volterra_long'; stream_points = 1000; test_size = 150
+        coords, data, _ = load_dataset(stream_dataset) # data stays memory-mapped
+        t = coords[0]
+        t_max = len(t) - test_size
+        stream = ChunkedSeries(t[:t_max], data[:t_max], window = 8192, halo = 16)
+        t_train, train_data = stream.decimated(stream_points)
+        t_test = as_working(t[t_max:])
+        t_test_interval_pred = t_test
+    elif large_data:
+        # the sparse measurements (t_size_raw of the noisy training points) are resampled by the smoothing spline 
+        # onto t_size_dense points; the derivatives are passed to the search from the spline.
+        # The training interval is the same, as without large_data: the former t_max = 400 exceeded
+        # the 301 points of data_20.npy and left no test interval
+        t_max = train_size; t_size_raw = 100; t_size_dense = 1000
         t_train = t[:t_max]; t_test = t[t_max:] 
         t_test_interval_pred = t_test
+        raw_idxs = np.linspace(0, t_max - 1, t_size_raw).astype(int)
+        t_train_dense = as_working(np.linspace(t_train[0], t_train[-1], t_size_dense))
 
     else:
-        t_max = 150
+        t_max = train_size
         t_train = t[:t_max]; t_test = t[t_max:] 
         t_test_interval_pred = t_test
         
-    x = data[:t_max, 0]; x_test = data[t_max:, 0]
-    y = data[:t_max, 1]; y_test = data[t_max:, 1]
+    if streaming:
+        x, y = train_data[:, 0], train_data[:, 1]
+        x_test, y_test = as_working(data[t_max:, 0]), as_working(data[t_max:, 1])
+    else:
+        x = data[:t_max, 0]; x_test = data[t_max:, 0]
+        y = data[:t_max, 1]; y_test = data[t_max:, 1]
     
     run_epde = True
     run_sindy = False
+    sliding = False # equations on the window of sliding_window samples, advanced over the whole series by the stride
+    sliding_window, sliding_stride = 150, 25
+    ensemble_sindy = False # bagging of SINDy over the bootstrap replicates of the library matrix
     pool = None
     
+    boundary = BoundarySet() # initial values of the test interval, shared by all the predictions
+    boundary.add_point('u', t_test_interval_pred[0], x_test[0], var = 0)
+    boundary.add_point('v', t_test_interval_pred[0], y_test[0], var = 1)
+
     exps = {}
+    prediction_memo = EquationMemo() # predictions of the repeated discoveries are reused
+    solution_models = SolutionModelCache() # solver training starts from the model of the similar system
     magnitudes = [0, 0.5*1e-2, 1.*1e-2, 2.5*1e-2, 5.*1e-2]#, 1.*1e-1, 1.5*1e-1]
     for magnitude in magnitudes:
-        x_n = x + np.random.normal(scale = magnitude*x, size = x.shape)
-        y_n = y + np.random.normal(scale = magnitude*y, size = y.shape)
+        if streaming:
+            stream_n = stream.with_noise(magnitude)
+            x_n, y_n = stream_n.decimated(stream_points)[1].T
+        else:
+            x_n = as_working(x + np.random.normal(scale = magnitude*x, size = x.shape))
+            y_n = as_working(y + np.random.normal(scale = magnitude*y, size = y.shape))
+        if large_data:
+            dense, dense_derivs = dense_resample(t_train[raw_idxs], np.stack([x_n, y_n])[:, raw_idxs], t_train_dense)
+            fit_data = (t_train_dense, dense[0], dense[1], [dense_derivs[0], dense_derivs[1]])
+        else:
+            fit_data = (t_train, x_n, y_n, None)
         plt.plot(t_train, x_n)
         plt.plot(t_train, y_n)
         plt.show()
+
+        if sliding:
+            # derivatives of the entering samples only, by the same polynomial differentiation, as in the search
+            sliding_pipeline = get_preprocessor_pipeline('poly', POLY_PREPROCESSOR_KWARGS)
+            windows = SlidingWindow(ChunkedSeries(t, data, halo = 8).with_noise(magnitude), window = sliding_window,
+                                    stride = sliding_stride, pipeline = sliding_pipeline)
+            window_discovery = lambda t_w, data_w, derivs_w, seeds: epde_discovery(t_w, data_w[:, 0], data_w[:, 1],
+                                                                                   derivs = [derivs_w[0], derivs_w[1]],
+                                                                                   seeds = seeds,
+                                                                                   training_epochs = 55 if seeds is None else 15)
+            history = sliding_discovery(window_discovery, windows, variable_names = ['u', 'v'])
+            if pool is None:
+                pool = get_epde_pool(t_train, x_n, y_n)
+            for window_idx, record in enumerate(history):
+                print(record['interval'], 'searched' if record['searched'] else 'refitted', record['rms'])
+                system = translate_equation(record['system'], pool)
+                try:
+                    logger.add_log(key = f'Lotka_Volterra_noise_{magnitude}_window_{window_idx}', entry = system,
+                                   aggregation_key = ('epde_sliding', magnitude), interval = record['interval'],
+                                   searched = record['searched'], rms = record['rms'])
+                except NameError:
+                    logger = Logger(name = 'logs/lotka_volterra_sliding_EPDE.json', referential_equation = {'u' : '20.0 * u{power: 1.0} + -20.0 * u{power: 1.0} * v{power: 1.0} + 0.0 = du/dx1{power: 1.0}',
+                                                                                                   'v' : '-20.0 * v{power: 1.0} + 20.0 * u{power: 1.0} * v{power: 1.0} + 0.0 = dv/dx1{power: 1.0}'}, 
+                                    pool = pool)
+                    logger.add_log(key = f'Lotka_Volterra_noise_{magnitude}_window_{window_idx}', entry = system,
+                                   aggregation_key = ('epde_sliding', magnitude), interval = record['interval'],
+                                   searched = record['searched'], rms = record['rms'])
+            exps[magnitude] = {'epde_sliding' : history}
+            continue
         
         test_launches = 10
         errs_epde = []
@@ -254,24 +344,19 @@ if __name__ == '__main__':
         for idx in range(test_launches):
             if run_epde:
                 t1 = time.time()
-                epde_search_obj, system = epde_discovery(t_train, x_n, y_n, False)
+                epde_search_obj, system = epde_discovery(*fit_data[:3], False, derivs = fit_data[3])
+                if streaming:
+                    refitted, _ = stream_refit({var : system.vals[var].text_form for var in system.vars_to_describe},
+                                               stream_n, variable_names = ['u', 'v'],
+                                               pipeline = get_preprocessor_pipeline('poly', POLY_PREPROCESSOR_KWARGS))
+                    system = translate_equation(refitted, epde_search_obj.pool)
                 t2 = time.time()
 
                 print('time_epde', t2-t1)
-                def get_ode_bop(key, var, grid_loc, value):
-                    bop = BOPElement(axis = 0, key = key, term = [None], power = 1, var = var)
-                    bop_grd_np = np.array([[grid_loc,]])
-                    bop.set_grid(torch.from_numpy(bop_grd_np).type(torch.FloatTensor))
-                    bop.values = torch.from_numpy(np.array([[value,]])).float()
-                    return bop
-                    
-                
-                bop_x = get_ode_bop('u', 0, t_test_interval_pred[0], x_test[0])
-                bop_y = get_ode_bop('v', 1, t_test_interval_pred[0], y_test[0])
-                
-                
-                pred_u_v = epde_search_obj.predict(system=system, boundary_conditions=[bop_x(), bop_y()], 
-                                                    grid = [t_test_interval_pred,], strategy=SOLVER_STRATEGY)
+
+                with profile_phase('prediction'):
+                    pred_u_v = prediction_memo.evaluate(system, lambda: solution_models.predict(system, boundary(), grid = [t_test_interval_pred,], 
+                                                                                                strategy=SOLVER_STRATEGY))
                 plt.plot(t_test_interval_pred, x_test, '+', label = 'preys_odeint')
                 plt.plot(t_test_interval_pred, y_test, '*', label = "predators_odeint")
                 plt.plot(t_test_interval_pred, pred_u_v[..., 0], color = 'b', label='preys_NN')
@@ -289,13 +374,13 @@ if __name__ == '__main__':
                 
                 try:
                     logger.add_log(key = f'Lotka_Volterra_noise_{magnitude}_attempt_{idx}', entry = system, aggregation_key = ('epde', magnitude),
-                                   error_pred = (err_u, err_v))
+                                   error_pred = (err_u, err_v), **memory_log())
                 except NameError:
                     logger = Logger(name = 'logs/lotka_volterra_new_EPDE.json', referential_equation = {'u' : '20.0 * u{power: 1.0} + -20.0 * u{power: 1.0} * v{power: 1.0} + 0.0 = du/dx1{power: 1.0}',
                                                                                                    'v' : '-20.0 * v{power: 1.0} + 20.0 * u{power: 1.0} * v{power: 1.0} + 0.0 = dv/dx1{power: 1.0}'}, 
                                     pool = epde_search_obj.pool)
                     logger.add_log(key = f'Lotka_Volterra_noise_{magnitude}_attempt_{idx}', entry = system, aggregation_key = ('epde', magnitude),
-                                   error_pred = (err_u, err_v))
+                                   error_pred = (err_u, err_v), **memory_log())
                             
         errs_SINDy = []
         models_SINDy = []
@@ -312,7 +397,15 @@ if __name__ == '__main__':
                         pool = get_epde_pool(t_train, x_n, y_n)
                     print(pool)
                     t1 = time.time()                                           
-                    model_base = sindy_discovery(t_train, x_n, y_n, sparsity=sparsity_thr)
+                    if streaming:
+                        model_base = StreamingSINDy(poly_order = 2, alpha = sparsity_thr).fit(stream_n)
+                        model_base.print()
+                    elif ensemble_sindy:
+                        model_base = EnsembleSINDy(alpha = sparsity_thr, replicates = 100, processes = 4)
+                        model_base.fit(np.array([x_n, y_n]).T, t_train)
+                        model_base.print()
+                    else:
+                        model_base = sindy_discovery(t_train, x_n, y_n, sparsity=sparsity_thr)
                     t2 = time.time()
                     print('SINDy time', t2-t1)
 
@@ -346,16 +439,19 @@ if __name__ == '__main__':
                 
                 try:
                     logger.add_log(key = f'Lotka_Volterra_SINDy_noise_{magnitude}_attempt_{idx}', entry = system, aggregation_key = ('sindy', magnitude), 
-                                   error_pred = (err_u, err_v))
+                                   error_pred = (err_u, err_v), **memory_log())
                 except NameError:
                     logger = Logger(name = 'logs/lotka_volterra_new_SINDy.json', referential_equation = {'u' : '20.0 * u{power: 1.0} + -20.0 * u{power: 1.0} * v{power: 1.0} + 0.0 = du/dx1{power: 1.0}',
                                                                                                    'v' : '-20.0 * v{power: 1.0} + 20.0 * u{power: 1.0} * v{power: 1.0} + 0.0 = dv/dx1{power: 1.0}'}, 
                                     pool = pool)
                     logger.add_log(key = f'Lotka_Volterra_SINDy_noise_{magnitude}_attempt_{idx}', entry = system, aggregation_key = ('sindy', magnitude), 
-                                   error_pred = (err_u, err_v))
+                                   error_pred = (err_u, err_v), **memory_log())
  
         
                 
         exps[magnitude] = {'epde': (models_epde, errs_epde, calc_epde), 
                            'SINDy' : (models_SINDy, errs_SINDy, calc_SINDy)}
-    logger.dump()
\ No newline at end of file
+    logger.dump()
+    prediction_memo.report()
+    solution_models.report()
+    import_report()
@@ -0,0 +1,299 @@
+import copy
+import numpy as np
+from functools import partial
+
+import epde.globals as global_var
+from epde.operators.utils.operator_mappers import map_operator_between_levels
+from epde.operators.utils.template import CompoundOperator, add_base_param_to_operator
+from epde.operators.multiobjective.selections import MOEADDSelection
+from epde.operators.multiobjective.variation import get_basic_variation
+from epde.operators.multiobjective.moeadd_specific import (OffspringUpdater, InitialParetoLevelSorting, SimpleNeighborSelector,
+                                                           get_basic_populator_updater)
+from epde.operators.multiobjective.mutations import get_basic_mutation
+from epde.operators.common.fitness import L2Fitness
+from epde.operators.common.right_part_selection import RandomRHPSelector
+from epde.operators.common.sparsity import LASSOSparsity
+from epde.operators.common.coeff_calculation import LinRegBasedCoeffsEquation
+from epde.optimizers.builder import add_sequential_operators, StrategyBuilder
+from epde.optimizers.moeadd.moeadd import MOEADDOptimizer
+from epde.optimizers.moeadd.population_constr import SystemsPopulationConstructor
+from epde.optimizers.moeadd.strategy import MOEADDDirector
+from epde.optimizers.moeadd.strategy_elems import MOEADDSectorProcesser
+from epde.structure.main_structures import Equation
+from epde.interface.equation_translator import translate_equation
+
+from token_cache import SharedTermStore, data_key, load_shared_terms, save_shared_terms
+from term_gram import TermGram, equation_terms, fit_population
+
+
+def tensor_cache_key():
+    '''
+    Key of the data, on which the search runs: hash of the base tensors of the variables and their derivatives
+    in the epde tensor cache (the ``(label, (1.0,))`` entries of ``upload_simple_tokens``), i.e. of the data after
+    the preprocessing. The powers and other variants of the tokens, that are added to the cache during the search,
+    are left out, thus the attempts on the same data get the same key.
+    '''
+    cache = global_var.tensor_cache
+    labels = sorted([label for label in cache.base_tensors
+                     if isinstance(label[0], str) and tuple(label[1]) == (1.0,) and label in cache.memory_default],
+                    key = repr)
+    return data_key(*[global_var.tensor_cache.memory_default[label] for label in labels])
+
+
+class GramCoeffsEquation(LinRegBasedCoeffsEquation):
+    '''
+    Replacement of the epde coefficient calculation operator for the batch of equations (e.g. all the equations
+    of the generation without the fitness): the regressions over the non-zero terms, selected by LASSO, are solved
+    in one ``fit_population`` call on the Gram matrix of the term columns, shared by all the equations, evaluated
+    by the operator (i.e. by the whole search), instead of the new feature matrix for each individual. As in
+    the epde operator, the equation without the non-zero terms gets all the weights (free one included) zero.
+    '''
+    def __init__(self, param_keys: list = [], max_bytes: int = 2**28):
+        super().__init__(param_keys)
+        self.max_bytes = max_bytes
+        self.gram = None
+
+    def apply(self, objective, arguments: dict = None):
+        equations = objective if isinstance(objective, (list, tuple)) else [objective,]
+        assert all([equation.weights_internal_evald for equation in equations]), 'Trying to calculate final weights before evaluating intermeidate ones (no sparsity).'
+        fitted = []
+        for equation in equations:
+            if equation_terms(equation)[0]:
+                fitted.append(equation)
+            else:
+                equation.weights_final = np.zeros(len(equation.structure))
+        if not fitted:
+            return
+        if self.gram is None:
+            target = fitted[0].structure[fitted[0].target_idx].evaluate(False)
+            g_func = getattr(global_var.grid_cache, 'g_func', None)
+            self.gram = TermGram(target.size, None if g_func is None else g_func.reshape(-1), self.max_bytes)
+        fit_population(fitted, self.gram)
+
+
+class FittedStage(CompoundOperator):
+    '''
+    Stage of L2Fitness (sparsity or coefficients), that PopulationFitness has already run for the whole batch.
+    '''
+    key = 'FittedStage'
+
+    def apply(self, objective, arguments: dict):
+        pass
+
+    def use_default_tags(self):
+        self._tags = {'gene level', 'no suboperators', 'inplace'}
+
+
+class PopulationFitness(CompoundOperator):
+    '''
+    Fitness of the list of chromosomes (the generation or the offsprings): LASSO for each equation without
+    the fitness, the final coefficients of all of them by one application of ``coeff_calc``, then the epde
+    L2 fitness of each equation with the obtained weights (its own sparsity and coefficient stages are skipped).
+    With the ``store`` the term tensors are shared with the other attempts and processes on the same data: the epde
+    tensor cache is filled from the store before LASSO, and the newly evaluated terms are written back after the fitness.
+    '''
+    key = 'PopulationFitness'
+
+    def __init__(self, param_keys: list = [], store: SharedTermStore = None):
+        super().__init__(param_keys)
+        self.store = store
+        self.data_key = None
+
+    def apply(self, objective: list, arguments: dict):
+        self_args, subop_args = self.parse_suboperator_args(arguments = arguments)
+        equations = [equation for chromosome in objective for equation in chromosome.vals
+                     if not equation.fitness_calculated]
+        terms = [term for equation in equations for term in equation.structure]
+        if self.store is not None:
+            if self.data_key is None:
+                self.data_key = tensor_cache_key()
+            load_shared_terms(self.store, self.data_key, terms, global_var.tensor_cache)
+        for equation in equations:
+            self.suboperators['sparsity'].apply(equation, subop_args['sparsity'])
+        self.suboperators['coeff_calc'].apply(equations, subop_args['coeff_calc'])
+        for equation in equations:
+            self.suboperators['fitness'].apply(equation, subop_args['fitness'])
+        if self.store is not None:
+            save_shared_terms(self.store, self.data_key, terms, global_var.tensor_cache)
+        return objective
+
+    def use_default_tags(self):
+        self._tags = {'fitness evaluation', 'population level', 'contains suboperators', 'inplace'}
+
+
+class BatchedInitialSorting(InitialParetoLevelSorting):
+    '''
+    Initial sorting of epde with the fitness of all the candidates evaluated as one batch.
+    '''
+    def apply(self, objective, arguments: dict):
+        self_args, subop_args = self.parse_suboperator_args(arguments = arguments)
+
+        if len(objective.population) == 0:
+            for idx, candidate in enumerate(objective.unplaced_candidates):
+                while True:
+                    temp_candidate = copy.deepcopy(candidate)
+                    self.suboperators['right_part_selector'].apply(objective = temp_candidate,
+                                                                   arguments = subop_args['right_part_selector'])
+                    if all([temp_candidate != solution for solution in objective.unplaced_candidates[:idx] +
+                            objective.unplaced_candidates[idx+1:]]):
+                        objective.unplaced_candidates[idx] = temp_candidate
+                        break
+            self.suboperators['chromosome_fitness'].apply(objective = objective.unplaced_candidates,
+                                                          arguments = subop_args['chromosome_fitness'])
+            objective.initial_placing()
+        return objective
+
+
+class BatchedOffspringUpdater(OffspringUpdater):
+    '''
+    Placement of the offsprings of epde, where all the offsprings of the generation are mutated first and their
+    fitness is evaluated as one batch. Only the mutations, that repeat the individual of the population, are
+    redone (with the fitness of the single offspring), up to the ``attempt_limit``, as in epde.
+    '''
+    def mutated(self, offspring, subop_args: dict):
+        temp_offspring = self.suboperators['chromosome_mutation'].apply(objective = offspring,
+                                                                        arguments = subop_args['chromosome_mutation'])
+        self.suboperators['right_part_selector'].apply(objective = temp_offspring,
+                                                       arguments = subop_args['right_part_selector'])
+        return temp_offspring
+
+    def apply(self, objective, arguments: dict):
+        self_args, subop_args = self.parse_suboperator_args(arguments = arguments)
+
+        offsprings = []
+        while objective.unplaced_candidates:
+            offspring = objective.unplaced_candidates.pop()
+            offsprings.append((offspring, self.mutated(offspring, subop_args)))
+        self.suboperators['chromosome_fitness'].apply(objective = [temp for _, temp in offsprings],
+                                                      arguments = subop_args['chromosome_fitness'])
+
+        for offspring, temp_offspring in offsprings:
+            attempt = 1
+            while not all([temp_offspring != solution for solution in objective.population]):
+                if attempt >= self.params['attempt_limit']:
+                    print('The algorithm had issues with generating unique offsprings, allowed replication.')
+                    break
+                temp_offspring = self.mutated(offspring, subop_args)
+                self.suboperators['chromosome_fitness'].apply(objective = [temp_offspring,],
+                                                              arguments = subop_args['chromosome_fitness'])
+                attempt += 1
+            self.suboperators['pareto_level_updater'].apply(objective = (temp_offspring, objective),
+                                                            arguments = subop_args['pareto_level_updater'])
+        return objective
+
+
+class GramMOEADDDirector(MOEADDDirector):
+    '''
+    Baseline MOEADD strategy of epde, where the fitness of the initial population and of the offsprings of each
+    generation is evaluated as one batch, with GramCoeffsEquation in place of the coefficient calculation.
+    '''
+    def __init__(self, store: SharedTermStore = None):
+        super().__init__()
+        self.store = store
+
+    def use_baseline(self, variation_params : dict = {}, mutation_params : dict = {}, sorter_params : dict = {},
+                     pareto_combiner_params : dict = {}, pareto_updater_params : dict = {}, **kwargs):
+        add_kwarg_to_operator = partial(add_base_param_to_operator, target_dict = kwargs)
+
+        neighborhood_selector = SimpleNeighborSelector(['number_of_neighbors'])
+        add_kwarg_to_operator(operator = neighborhood_selector)
+        selection = MOEADDSelection(['delta', 'parents_fraction'])
+        add_kwarg_to_operator(operator = selection)
+        selection.set_suboperators({'neighborhood_selector' : neighborhood_selector})
+        variation = get_basic_variation(variation_params)
+        right_part_selector = RandomRHPSelector()
+
+        eq_fitness = L2Fitness(['penalty_coeff'])
+        add_kwarg_to_operator(operator = eq_fitness)
+        eq_fitness.set_suboperators({'sparsity' : FittedStage(), 'coeff_calc' : FittedStage()})
+        self.coeff_calc = GramCoeffsEquation()
+        population_fitness = PopulationFitness(store = self.store)
+        population_fitness.set_suboperators({'sparsity' : LASSOSparsity(), 'coeff_calc' : self.coeff_calc,
+                                             'fitness' : eq_fitness})
+
+        rps_cond = lambda x: any([not elem_eq.right_part_selected for elem_eq in x.vals])
+        sys_rps = map_operator_between_levels(right_part_selector, 'gene level', 'chromosome level', rps_cond)
+
+        initial_sorter = BatchedInitialSorting()
+        add_base_param_to_operator(operator = initial_sorter, target_dict = sorter_params)
+        initial_sorter.set_suboperators(operators = {'right_part_selector' : sys_rps,
+                                                     'chromosome_fitness' : population_fitness})
+        population_updater = BatchedOffspringUpdater()
+        add_base_param_to_operator(operator = population_updater, target_dict = pareto_combiner_params)
+        population_updater.set_suboperators(operators = {'chromosome_mutation' : get_basic_mutation(mutation_params),
+                                                         'pareto_level_updater' : get_basic_populator_updater(pareto_updater_params),
+                                                         'right_part_selector' : sys_rps,
+                                                         'chromosome_fitness' : population_fitness})
+        self.builder = add_sequential_operators(self.builder, [('initial_sorter', initial_sorter),
+                                                               ('selection', selection),
+                                                               ('variation', variation),
+                                                               ('pareto_updater_compl', population_updater)])
+
+
+def use_gram_coefficients(epde_search_obj, director_params: dict = {}, store: SharedTermStore = None):
+    '''
+    Rebuild the strategy of the created (multiobjective) EpdeSearch with the Gram-based coefficient calculation;
+    the director is created anew for each search, since the term columns belong to its data.
+    '''
+    director = GramMOEADDDirector(store)
+    director.builder = StrategyBuilder(MOEADDSectorProcesser)
+    director.use_baseline(params = director_params)
+    epde_search_obj.director = director
+    return director
+
+
+def seed_solution(pop_constructor: SystemsPopulationConstructor, text_form: dict, sparsity: dict = None):
+    '''
+    Candidate of the initial population with the terms of the given system (e.g. of the previous search on
+    the overlapping data), completed by the random terms up to the number of terms of the search, and its
+    sparsity constants. Returns None, if the system has more terms, than the search allows.
+    '''
+    kwargs = {} if sparsity is None else {'sparsity' : [sparsity[var] for var in pop_constructor.vars_demand_equation]}
+    solution = pop_constructor.create(**kwargs)
+    seed = translate_equation(text_form, pop_constructor.pool)
+    for var in solution.vars_to_describe:
+        terms = seed.vals[var].structure
+        if len(terms) > solution.metaparameters['terms_number']['value']:
+            return None
+        equation = Equation(solution.vals[var].pool, basic_structure = terms, var_to_explain = var,
+                            metaparameters = solution.metaparameters)
+        equation.n_immutable = 0 # the seeded terms are mutated as any other
+        solution.vals.replace_gene(var, equation)
+    return solution
+
+
+def warm_started_fit(epde_search_obj, seeds: list, data, equation_terms_max_number = 6, equation_factors_max_number = 1,
+                     variable_names = ['u',], eq_sparsity_interval = (1e-4, 2.5), derivs = None, max_deriv_order = 1,
+                     additional_tokens = [], data_fun_pow: int = 1):
+    '''
+    EpdeSearch.fit of the multiobjective search, where the first individuals of the initial population are
+    seeded with the systems [(text forms {variable : equation}, sparsities {variable : value} or None), ...],
+    e.g. with the Pareto front of the search on the previous window of the series; the rest are random.
+    '''
+    cur_params = {'variable_names' : variable_names, 'max_deriv_order' : max_deriv_order,
+                  'additional_tokens' : [family.token_family.ftype for family in additional_tokens]}
+    if epde_search_obj.pool == None or epde_search_obj.pool_params != cur_params:
+        epde_search_obj.create_pool(data = data, variable_names = variable_names, derivs = derivs,
+                                    max_deriv_order = max_deriv_order, additional_tokens = additional_tokens,
+                                    data_fun_pow = data_fun_pow)
+    population_instruct = {'pool' : epde_search_obj.pool, 'terms_number' : equation_terms_max_number,
+                           'max_factors_in_term' : equation_factors_max_number,
+                           'sparsity_interval' : eq_sparsity_interval}
+    epde_search_obj.optimizer_init_params['population_instruct'] = population_instruct
+
+    optimizer = MOEADDOptimizer(**epde_search_obj.optimizer_init_params)
+    population = optimizer.pareto_levels.unplaced_candidates
+    pop_constructor = SystemsPopulationConstructor(**population_instruct)
+    for idx, (text_form, sparsity) in enumerate(seeds[:len(population)]):
+        seed = seed_solution(pop_constructor, text_form, sparsity)
+        if seed is None or any([seed == solution for solution in population[:idx] + population[idx + 1:]]):
+            continue
+        seed.set_domain(idx)
+        population[idx] = seed
+
+    equations_number = len([1 for token_family in epde_search_obj.pool.families if token_family.status['demands_equation']])
+    optimizer.pass_best_objectives(*np.concatenate((np.zeros(equations_number), np.ones(equations_number))))
+    optimizer.set_strategy(epde_search_obj.director)
+    epde_search_obj.optimizer = optimizer
+    optimizer.optimize(**epde_search_obj.optimizer_exec_params)
+    epde_search_obj.search_conducted = True
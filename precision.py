@@ -0,0 +1,64 @@
+'''
+Working precision of the experiment scripts. In the float32 mode the data, grids and the arrays, derived from
+them in the scripts, are single precision; epde keeps its tensor caches (tokens, derivatives, evaluated terms)
+in float64 in both modes, thus the memory of the search is not halved, and the solver works in float32 in both.
+'''
+import numpy as np
+from typing import Callable
+
+DTYPES = {'float32' : np.float32, 'float64' : np.float64}
+
+_working_dtype = np.float64
+
+
+def set_precision(precision: str = 'float64'):
+    '''
+    Set the floating point type, in which the data and grids of the experiment scripts are kept. The solver
+    inputs are single precision in both modes, the tensor caches of epde are double precision in both.
+    '''
+    global _working_dtype
+    if precision not in DTYPES.keys():
+        raise NotImplementedError(f'Incorrect precision {precision}. Only float32 or float64 are allowed.')
+    _working_dtype = DTYPES[precision]
+
+
+def working_dtype():
+    return _working_dtype
+
+
+def as_working(array):
+    '''
+    Array in the working precision; no copy is made, if the dtype already matches.
+    '''
+    return np.asarray(array, dtype = _working_dtype)
+
+
+def to_solver_tensor(array):
+    '''
+    Torch tensor for the boundary operators and grids of the solver. The epde solver works in single precision,
+    thus in float32 mode the tensor shares memory with the (contiguous) array and no conversion is made.
+    '''
+    import torch
+
+    return torch.from_numpy(np.ascontiguousarray(array, dtype = np.float32))
+
+
+def precision_discrepancy(fun: Callable, *arrays, **kwargs):
+    '''
+    Accuracy check of the single precision mode: maximum absolute discrepancy between the outputs of
+    ``fun(*arrays, **kwargs)`` with arrays passed in float32 and in float64, related to the max. absolute
+    value of the float64 output. Outputs can be arrays or tuples/lists of arrays.
+
+    Rounding errors of the float32 data (relative eps ~ 1.2e-7) are amplified by the differentiation: roughly
+    as eps / h^k for the k-th order finite differences and eps * k_max^k for the spectral ones, thus for KdV
+    (dx ~ 0.12, third order derivatives) discrepancy of 1e-4..1e-3 is expected. The mode is safe, when it is well
+    below the relative noise magnitude of the experiment.
+    '''
+    def flatten(output):
+        if isinstance(output, (list, tuple)):
+            return np.concatenate([np.ravel(np.asarray(elem, dtype = np.float64)) for elem in output])
+        return np.ravel(np.asarray(output, dtype = np.float64))
+
+    reference = flatten(fun(*[np.asarray(array, dtype = np.float64) for array in arrays], **kwargs))
+    single = flatten(fun(*[np.asarray(array, dtype = np.float32) for array in arrays], **kwargs))
+    return np.max(np.abs(reference - single)) / np.max(np.abs(reference))
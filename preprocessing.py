@@ -0,0 +1,203 @@
+import numpy as np
+from typing import Union
+
+from epde.preprocessing.deriv_calculators import AbstractDeriv
+from epde.preprocessing.smoothers import PlaceholderSmoother
+from epde.preprocessing.preprocessor_setups import PreprocessorSetup
+from epde.preprocessing.preprocessor import ConcretePrepBuilder
+
+from grids import axis_values
+
+
+def spectral_filter(wavenumbers: np.ndarray, filter_type: str = None, cutoff: float = 2./3., steepness: int = 4):
+    '''
+    Multiplier for the spectral coefficients. The ``cutoff`` is set as the fraction of the highest
+    resolved wavenumber: 'sharp' drops everything above it, 'butterworth' damps the modes smoothly
+    with the order ``steepness``, 'exponential' is the usual exp(-36 (k/k_c)^(2 steepness)) spectral filter.
+    '''
+    if filter_type is None:
+        return np.ones_like(wavenumbers)
+    k_rel = np.abs(wavenumbers) / np.max(np.abs(wavenumbers))
+    if filter_type == 'sharp':
+        return (k_rel <= cutoff).astype(wavenumbers.dtype)
+    elif filter_type == 'butterworth':
+        return 1. / (1. + (k_rel / cutoff) ** (2 * steepness))
+    elif filter_type == 'exponential':
+        return np.exp(-36. * (k_rel / cutoff) ** (2 * steepness))
+    else:
+        raise NotImplementedError(f'Unknown spectral filter {filter_type}. Only sharp, butterworth or exponential are allowed.')
+
+
+def periodic_spectral_derivatives(data: np.ndarray, coords: np.ndarray, max_order: int, axis: int = -1,
+                                  filter_type: str = None, cutoff: float = 2./3., steepness: int = 4) -> list:
+    '''
+    Derivatives of orders 1, ..., max_order along the periodic ``axis``, obtained with a single real FFT
+    of all the slices along the other axes. The grid along the axis has to be uniform and must not
+    contain the repeated end point.
+    '''
+    n_points = data.shape[axis]
+    step = coords[1] - coords[0]
+    wavenumbers = 2 * np.pi * np.fft.rfftfreq(n_points, d = step)
+    filtered = np.fft.rfft(data, axis = axis) * spectral_filter(wavenumbers, filter_type, cutoff, steepness)
+
+    shape = [1,] * data.ndim
+    shape[axis] = wavenumbers.size
+    multiplier = (1j * wavenumbers).reshape(shape)
+
+    derivs = []
+    for order in range(1, max_order + 1):
+        factor = multiplier ** order
+        if order % 2 and n_points % 2 == 0:
+            # Nyquist mode of the odd-order derivative has no real counterpart
+            factor = factor.copy()
+            np.moveaxis(factor, axis, 0)[-1] = 0
+        derivs.append(np.fft.irfft(filtered * factor, n = n_points, axis = axis))
+    return derivs
+
+
+def finite_difference_derivatives(data: np.ndarray, coords: np.ndarray, max_order: int, axis: int = 0) -> list:
+    derivs = []
+    deriv = data
+    for _ in range(max_order):
+        deriv = np.gradient(deriv, coords, axis = axis, edge_order = 2)
+        derivs.append(deriv)
+    return derivs
+
+
+def dense_resample(t: np.ndarray, series: np.ndarray, t_dense: np.ndarray, max_order: int = 1,
+                   method: str = 'spline', smoothing: float = None, degree: int = 12):
+    '''
+    Resampling of the time series (shape (n_vars, n_t)) onto the dense grid through the representation, built
+    once for all the variables: smoothing cubic spline (with the GCV choice of the smoothing, if it is not set)
+    or the least squares Chebyshev series of the given degree. Derivatives are taken from the representation
+    analytically.
+
+    Returns dense samples with shape (n_vars, n_dense) and derivatives with shape (n_vars, n_dense, max_order),
+    i.e. derivs[idx] is the format of ``derivs`` in EpdeSearch.fit for the ODE variable.
+    '''
+    series = np.atleast_2d(series)
+    if method == 'spline':
+        from scipy.interpolate import make_smoothing_spline
+
+        representation = make_smoothing_spline(t, series, lam = smoothing, axis = 1)
+        evaluate = lambda order: representation.derivative(order)(t_dense) if order else representation(t_dense)
+    elif method == 'chebyshev':
+        cheb = np.polynomial.chebyshev
+        scale = 2. / (t[-1] - t[0])
+        coeffs = cheb.chebfit(scale * (t - t[0]) - 1., series.T, degree)
+        evaluate = lambda order: cheb.chebval(scale * (t_dense - t[0]) - 1., cheb.chebder(coeffs, order, scl = scale))
+    else:
+        raise NotImplementedError(f'Incorrect resampling method {method}. Only spline or chebyshev are allowed.')
+    dense = evaluate(0)
+    derivs = np.stack([evaluate(order) for order in range(1, max_order + 1)], axis = -1)
+    return dense.astype(series.dtype, copy = False), derivs.astype(series.dtype, copy = False)
+
+
+class PeriodicSpectralDeriv(AbstractDeriv):
+    '''
+    Spectral differentiation along the periodic axes (real FFT, batched over the remaining axes),
+    the non-periodic ones (usually time) are processed with the second-order finite differences.
+    Derivatives are ordered in the same way as in epde derivative calculators: by axis, then by order.
+    '''
+    def __init__(self):
+        pass
+
+    def __call__(self, data: np.ndarray, grid: list, max_order: Union[int, list, tuple],
+                 periodic_axes: tuple = (1,), filter_type: str = None, cutoff: float = 2./3.,
+                 steepness: int = 4) -> np.ndarray:
+        if isinstance(max_order, int):
+            max_order = [max_order,] * data.ndim
+        if len(grid) != data.ndim:
+            raise ValueError('Data dimensionality does not fit passed grids.')
+
+        derivs = []
+        for axis in range(data.ndim):
+            coords = axis_values(grid[axis], axis)
+            if axis in periodic_axes:
+                derivs.extend(periodic_spectral_derivatives(data, coords, max_order[axis], axis = axis,
+                                                            filter_type = filter_type, cutoff = cutoff,
+                                                            steepness = steepness))
+            else:
+                derivs.extend(finite_difference_derivatives(data, coords, max_order[axis], axis = axis))
+        return np.vstack([deriv.reshape(-1) for deriv in derivs]).T.astype(data.dtype, copy = False)
+
+
+class BatchedPolynomialDeriv(AbstractDeriv):
+    '''
+    Local polynomial differentiation along the last (time) axis for the stacked batch of the series, e.g. with
+    the shape (magnitudes, replicates, time). The same least squares fit of the polynomial over the centered window,
+    as in epde PolynomialDeriv, is applied to all the series at once as the Savitzky-Golay filter, in the edge
+    windows the polynomial is evaluated off-center. The time grid has to be uniform.
+    Returns the derivatives with shape data.shape + (max_order,); for the single series it is the usual
+    (n_points, n_derivs) output of the derivative calculators.
+    '''
+    def __init__(self):
+        pass
+
+    def __call__(self, data: np.ndarray, grid: list, max_order: Union[int, list, tuple],
+                 polynomial_window: int = 9, poly_order: int = None) -> np.ndarray:
+        from scipy.signal import savgol_filter
+
+        if isinstance(max_order, (list, tuple)):
+            max_order = max_order[-1]
+        t = np.ravel(grid[-1]) if data.ndim > 1 else np.ravel(grid[0])
+        poly_order = max_order + 1 if poly_order is None else poly_order
+        derivs = [savgol_filter(data, polynomial_window, poly_order, deriv = order, delta = t[1] - t[0],
+                                axis = -1, mode = 'interp') for order in range(1, max_order + 1)]
+        return np.stack(derivs, axis = -1).astype(data.dtype, copy = False)
+
+
+def run_batch(pipeline, batch: np.ndarray, grid: list, max_order: Union[int, list, tuple] = 1):
+    '''
+    Derivatives of the stacked series batch (shape (..., time)) with the pipeline: in one call, if its derivative
+    calculator is batched, otherwise series by series. Returns data and derivatives with shape batch.shape + (n_derivs,).
+    '''
+    if isinstance(pipeline.deriv_calculator, BatchedPolynomialDeriv):
+        return pipeline.run(batch, grid = grid, max_order = max_order)
+    data, derivs = np.empty_like(batch), None
+    for idx in np.ndindex(batch.shape[:-1]):
+        data[idx], series_derivs = pipeline.run(batch[idx], grid = grid, max_order = max_order)
+        if derivs is None:
+            derivs = np.empty(batch.shape + (series_derivs.reshape(batch.shape[-1], -1).shape[1],), dtype = batch.dtype)
+        derivs[idx] = series_derivs.reshape(batch.shape[-1], -1)
+    return data, derivs
+
+
+class ExtendedPreprocessorSetup(PreprocessorSetup):
+    def build_batched_poly_preprocessing(self, polynomial_window: int = 9, poly_order: int = None):
+        deriv_calculator_kwargs = {'grid': None, 'polynomial_window': polynomial_window, 'poly_order': poly_order}
+
+        self.builder.set_smoother(PlaceholderSmoother)
+        self.builder.set_deriv_calculator(BatchedPolynomialDeriv, **deriv_calculator_kwargs)
+
+    def build_periodic_spectral_preprocessing(self, periodic_axes: tuple = (1,), filter_type: str = None,
+                                              cutoff: float = 2./3., steepness: int = 4):
+        deriv_calculator_kwargs = {'grid': None, 'periodic_axes': periodic_axes, 'filter_type': filter_type,
+                                   'cutoff': cutoff, 'steepness': steepness}
+
+        self.builder.set_smoother(PlaceholderSmoother)
+        self.builder.set_deriv_calculator(PeriodicSpectralDeriv, **deriv_calculator_kwargs)
+
+
+def get_preprocessor_pipeline(preprocessor_type: str = 'poly', preprocessor_kwargs: dict = {}):
+    setup = ExtendedPreprocessorSetup()
+    builder = ConcretePrepBuilder()
+    setup.builder = builder
+
+    if preprocessor_type == 'ANN':
+        setup.build_ANN_preprocessing(**preprocessor_kwargs)
+    elif preprocessor_type == 'poly':
+        setup.build_poly_diff_preprocessing(**preprocessor_kwargs)
+    elif preprocessor_type == 'spectral':
+        setup.build_spectral_preprocessing(**preprocessor_kwargs)
+    elif preprocessor_type == 'periodic_spectral':
+        setup.build_periodic_spectral_preprocessing(**preprocessor_kwargs)
+    elif preprocessor_type == 'batched_poly':
+        setup.build_batched_poly_preprocessing(**preprocessor_kwargs)
+    else:
+        raise NotImplementedError('Incorrect preprocessor type. Only ANN, poly, spectral, periodic_spectral or batched_poly are allowed.')
+    pipeline = setup.builder.prep_pipeline
+
+    if 'max_order' not in pipeline.deriv_calculator_kwargs.keys():
+        pipeline.deriv_calculator_kwargs['max_order'] = None
+    return pipeline
@@ -0,0 +1,141 @@
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+
+def _read_status(field: str):
+    '''
+    Value of the field from /proc/self/status in MB (linux only), None elsewhere.
+    '''
+    try:
+        with open('/proc/self/status', 'r') as status:
+            for line in status:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) / 1024.
+    except OSError:
+        pass
+    return None
+
+
+def _reset_peak_rss():
+    '''
+    Reset of the peak RSS (VmHWM) of the process, available on linux. Returns False, if the reset is impossible:
+    then the peak of the phase is the peak of the process up to its end.
+    '''
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss():
+    value = _read_status('VmHWM')
+    if value is None:
+        try:
+            import resource
+            value = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024. # kB on linux, B on macOS
+        except ImportError:
+            pass
+    return value
+
+
+def _torch_cuda():
+    '''
+    torch, if it is imported already and uses CUDA: only the CUDA caching allocator has the peak statistics.
+    '''
+    torch = sys.modules.get('torch')
+    if torch is not None and torch.cuda.is_available():
+        return torch
+    return None
+
+
+class MemoryProfiler(object):
+    '''
+    Opt-in memory instrumentation of the pipeline phases. For each phase the record holds the wall time, RSS
+    before and after, peak RSS within the phase, peak of the python allocations and the top allocation
+    sites (tracemalloc), and the peak of the torch CUDA allocator, if it is used.
+    Disabled profiler adds no overhead: the phases are not traced. The phases are not supposed to be nested,
+    as each of them resets the peaks.
+    '''
+    def __init__(self, enabled: bool = False, top_sites: int = 10, frames: int = 1):
+        self.enabled = enabled
+        self.top_sites = top_sites
+        self.frames = frames
+        self.records = []
+
+    def enable(self, top_sites: int = None):
+        self.enabled = True
+        if top_sites is not None:
+            self.top_sites = top_sites
+
+    def disable(self):
+        self.enabled = False
+
+    @contextmanager
+    def phase(self, name: str):
+        if not self.enabled:
+            yield
+            return
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start(self.frames)
+        tracemalloc.reset_peak()
+        peak_reset = _reset_peak_rss()
+        torch = _torch_cuda()
+        if torch is not None:
+            torch.cuda.reset_peak_memory_stats()
+        record = {'phase' : name, 'rss_before_mb' : _read_status('VmRSS')}
+        snapshot_before = tracemalloc.take_snapshot()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            record['time'] = time.perf_counter() - start
+            record['rss_after_mb'] = _read_status('VmRSS')
+            record['peak_rss_mb'] = peak_rss()
+            record['peak_rss_of_phase'] = peak_reset
+            record['python_peak_mb'] = tracemalloc.get_traced_memory()[1] / 2**20
+            filters = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)]
+            stats = tracemalloc.take_snapshot().filter_traces(filters).compare_to(snapshot_before.filter_traces(filters),
+                                                                                 'lineno')
+            record['top_allocations'] = [f'{stat.traceback}: {stat.size_diff / 2**20:+.2f} MB in {stat.count_diff:+d} blocks'
+                                         for stat in stats[:self.top_sites]]
+            if torch is not None:
+                record['torch_cuda_peak_mb'] = torch.cuda.max_memory_allocated() / 2**20
+            if started_tracing:
+                tracemalloc.stop()
+            self.records.append(record)
+
+    def pop_records(self):
+        '''
+        Records of the phases since the last call, e.g. to attach them to the log entry of the attempt.
+        '''
+        records, self.records = self.records, []
+        return records
+
+    def report(self, records: list = None):
+        for record in (self.records if records is None else records):
+            print(f'{record["phase"]}: {record["time"]:.1f} s, peak RSS {record["peak_rss_mb"]} MB, '
+                  f'python peak {record["python_peak_mb"]:.1f} MB')
+            for site in record['top_allocations']:
+                print('    ' + site)
+
+
+PROFILER = MemoryProfiler()
+
+
+def profile_phase(name: str):
+    '''
+    Phase of the shared profiler: ``with profile_phase('search'): ...``; no-op, until PROFILER.enable().
+    '''
+    return PROFILER.phase(name)
+
+
+def memory_log():
+    '''
+    Keyword arguments for Logger.add_log with the records of the phases of the attempt, if the profiling is on.
+    '''
+    return {'memory' : PROFILER.pop_records()} if PROFILER.enabled else {}
@@ -0,0 +1,202 @@
+import os
+import json
+import time
+import numpy as np
+import multiprocessing as mp
+from queue import Empty
+
+from synthetic_data import generate_kdv, load_dataset
+
+BASE_CONFIG = {'train_max' : 200, 'n_x' : 512, 'population_size' : 9, 'training_epochs' : 55,
+               'max_deriv_order' : 3, 'equation_terms_max_number' : 6}
+
+SWEEPS = {'train_max' : [50, 100, 200],
+          'n_x' : [128, 256, 512],
+          'population_size' : [4, 9, 16],
+          'training_epochs' : [15, 30, 55],
+          'max_deriv_order' : [1, 2, 3],
+          'equation_terms_max_number' : [3, 6, 9]}
+
+SIZE_PARAMETERS = ('train_max', 'n_x') # the scaling of these is reported against the number of grid points
+
+DATASETS_PATH = 'datasets/synthetic'
+
+
+def benchmark_data(train_max: int, n_x: int, dt: float = 0.1):
+    '''
+    Synthetic KdV field with train_max time steps and n_x nodes; generated once and reused by the later runs.
+    '''
+    path = os.path.join(DATASETS_PATH, f'kdv_{n_x}_{train_max}')
+    if not os.path.exists(os.path.join(path, 'meta.json')):
+        generate_kdv(path, n_x = n_x, n_t = train_max, t_max = dt * (train_max - 1), seed = 0)
+    (t, x), u, _ = load_dataset(path)
+    return t, x, np.asarray(u)
+
+
+def run_epde(config: dict):
+    from KdV import epde_discovery
+
+    t, x, u = benchmark_data(config['train_max'], config['n_x'])
+    epde_discovery(x, t, u, population_size = config['population_size'],
+                   training_epochs = config['training_epochs'], max_deriv_order = (1, config['max_deriv_order']),
+                   equation_terms_max_number = config['equation_terms_max_number'])
+
+
+def run_sindy(config: dict):
+    from KdV import sindy_provided_l0
+    from grids import broadcast_grids
+
+    t, x, u = benchmark_data(config['train_max'], config['n_x'])
+    sindy_provided_l0(broadcast_grids(t, x), u)
+
+
+def run_weak_sindy(config: dict):
+    from weak_form import weak_sindy_pde
+
+    t, x, u = benchmark_data(config['train_max'], config['n_x'])
+    weak_sindy_pde(u, t, x, threshold = 0.5, degree = 2, max_order = config['max_deriv_order'])
+
+
+RUNNERS = {'epde' : run_epde, 'sindy' : run_sindy, 'weak_sindy' : run_weak_sindy}
+
+RUNNER_PARAMETERS = {'epde' : list(SWEEPS.keys()),
+                     'sindy' : ['train_max', 'n_x'],
+                     'weak_sindy' : ['train_max', 'n_x', 'max_deriv_order']}
+
+
+def _measure(queue, runner: str, config: dict):
+    wall, cpu = time.perf_counter(), time.process_time()
+    RUNNERS[runner](config)
+    measurement = {'wall' : time.perf_counter() - wall, 'cpu' : time.process_time() - cpu, 'peak_rss_mb' : None}
+    try:
+        import resource
+        measurement['peak_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024. # kB on linux
+    except ImportError:
+        pass
+    queue.put(measurement)
+
+
+def measure(runner: str, config: dict, timeout: float = None):
+    '''
+    Run in the fresh process, thus the peak RSS belongs to the single configuration. The failed run or
+    the one, exceeding the timeout, is terminated and recorded with None measurements.
+    '''
+    context = mp.get_context('spawn')
+    queue = context.Queue()
+    process = context.Process(target = _measure, args = (queue, runner, config))
+    process.start()
+    measurement = {'wall' : None, 'cpu' : None, 'peak_rss_mb' : None}
+    deadline = None if timeout is None else time.perf_counter() + timeout
+    while deadline is None or time.perf_counter() < deadline:
+        try:
+            measurement = queue.get(timeout = 1.)
+            break
+        except Empty:
+            if not process.is_alive():
+                try:
+                    measurement = queue.get(timeout = 0.1)
+                except Empty:
+                    pass
+                break
+    process.join(timeout = 1.)
+    if process.is_alive():
+        process.terminate()
+    return measurement
+
+
+def fit_complexity(sizes, values):
+    '''
+    Empirical complexity value ~ C * size^exponent by the least squares in log-log coordinates.
+    '''
+    sizes, values = np.asarray(sizes, dtype = float), np.asarray(values, dtype = float)
+    exponent, log_c = np.polyfit(np.log(sizes), np.log(values), 1)
+    return {'exponent' : exponent, 'constant' : np.exp(log_c)}
+
+
+def extrapolate(fit: dict, size: float):
+    return fit['constant'] * size ** fit['exponent']
+
+
+def run_sweeps(runners: list = ('epde', 'sindy'), sweeps: dict = SWEEPS, base: dict = BASE_CONFIG,
+               repeats: int = 1, timeout: float = None):
+    '''
+    One-at-a-time sweeps: each parameter is varied over its values with the others kept at the base values.
+    Returns {runner : {parameter : [(value, size, wall, cpu, peak_rss_mb), ...]}}.
+    '''
+    results = {}
+    for runner in runners:
+        results[runner] = {}
+        for parameter in RUNNER_PARAMETERS[runner]:
+            results[runner][parameter] = []
+            for value in sweeps[parameter]:
+                config = {**base, parameter : value}
+                size = config['train_max'] * config['n_x'] if parameter in SIZE_PARAMETERS else value
+                for _ in range(repeats):
+                    measurement = measure(runner, config, timeout)
+                    print(f'{runner}, {parameter} = {value}: {measurement}')
+                    results[runner][parameter].append((value, size, measurement['wall'], measurement['cpu'],
+                                                       measurement['peak_rss_mb']))
+    return results
+
+
+def analyze(results: dict, tolerance: float = 0.2, baseline: dict = None, target_size: float = None):
+    '''
+    Fits of the wall time and peak RSS complexity for each sweep. Flags:
+        'super-linear' - time exponent exceeds 1 + tolerance;
+        'regression' - time exponent grew by more than tolerance against the baseline analysis.
+    With ``target_size`` the time for the grid of this number of points is extrapolated from the size sweeps.
+    '''
+    analysis = {}
+    for runner, sweeps in results.items():
+        analysis[runner] = {}
+        for parameter, records in sweeps.items():
+            records = [record for record in records if record[2] is not None]
+            if len(set([record[1] for record in records])) < 2:
+                continue
+            sizes = [record[1] for record in records]
+            entry = {'time' : fit_complexity(sizes, [record[2] for record in records])}
+            if all([record[4] is not None for record in records]):
+                entry['memory'] = fit_complexity(sizes, [record[4] for record in records])
+            flags = []
+            if entry['time']['exponent'] > 1. + tolerance:
+                flags.append('super-linear')
+            try:
+                if entry['time']['exponent'] > baseline[runner][parameter]['time']['exponent'] + tolerance:
+                    flags.append('regression')
+            except (KeyError, TypeError):
+                pass
+            entry['flags'] = flags
+            if target_size is not None and parameter in SIZE_PARAMETERS:
+                entry['extrapolated_time'] = extrapolate(entry['time'], target_size)
+            analysis[runner][parameter] = entry
+    return analysis
+
+
+def report(analysis: dict):
+    for runner, entries in analysis.items():
+        for parameter, entry in entries.items():
+            line = f'{runner:>10} | {parameter:>26} | time ~ n^{entry["time"]["exponent"]:.2f}'
+            if 'memory' in entry:
+                line += f' | memory ~ n^{entry["memory"]["exponent"]:.2f}'
+            if 'extrapolated_time' in entry:
+                line += f' | extrapolated {entry["extrapolated_time"]:.0f} s'
+            if entry['flags']:
+                line += ' | ' + ', '.join(entry['flags']).upper()
+            print(line)
+
+
+if __name__ == '__main__':
+    results_path = 'logs/scaling_benchmark.json'
+    baseline_path = 'logs/scaling_benchmark_baseline.json'
+
+    results = run_sweeps(runners = ['epde', 'sindy', 'weak_sindy'], timeout = 3600.)
+    baseline = None
+    if os.path.exists(baseline_path):
+        with open(baseline_path, 'r') as baseline_file:
+            baseline = json.load(baseline_file)['analysis']
+    analysis = analyze(results, baseline = baseline, target_size = 10**7)
+    report(analysis)
+
+    os.makedirs(os.path.dirname(results_path), exist_ok = True)
+    with open(results_path, 'w') as results_file:
+        json.dump({'base' : BASE_CONFIG, 'results' : results, 'analysis' : analysis}, results_file, indent = 4)
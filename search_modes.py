@@ -0,0 +1,207 @@
+import numpy as np
+from itertools import product
+from typing import Callable, Union
+
+from workers import WorkerPool, SharedArray, SharedArrays, shared_value
+from lazy_imports import lazy_from
+from canonical import parse_equation_text
+from term_gram import TermGram, fit_population
+
+translate_equation, = lazy_from('epde.interface.equation_translator', 'translate_equation')
+
+
+def decimate(x, t, u, steps: Union[int, tuple] = 2):
+    '''
+    Subgrid of the (t, x) field with every ``steps[0]``-th time and every ``steps[1]``-th spatial node.
+    '''
+    if isinstance(steps, int):
+        steps = (steps, steps)
+    return x[::steps[1]], t[::steps[0]], u[::steps[0], ::steps[1]]
+
+
+def pareto_text_forms(epde_search_obj, levels: int = 1):
+    '''
+    Equations of the first ``levels`` non-dominated levels in form of dicts {variable: equation text form},
+    suitable for the translation into the pool, built on other data, paired with their complexities.
+    '''
+    text_forms = []
+    for level in epde_search_obj.equations(only_print = False, num = levels):
+        for system in level:
+            vars_num = len(system.vars_to_describe)
+            text_forms.append(({var: system.vals[var].text_form for var in system.vars_to_describe},
+                               np.sum(system.obj_fun[vars_num:])))  # objectives: discrepancies, then complexities
+    return text_forms
+
+
+def _term_values(term, shape, boundary):
+    values = term.evaluate(False)
+    if values.size != np.prod(shape):
+        return values
+    section = tuple(slice(boundary, dim_size - boundary) for dim_size in shape)
+    return values.reshape(shape)[section].reshape(-1)
+
+
+def refine_pareto_front(text_forms: list, pool, shape, boundary: int = 0):
+    '''
+    Translate the equations, discovered on the coarse grid, into the pool, created on the full resolution data,
+    refit the coefficients of their non-zero terms (zero ones remain zero, thus the structure is preserved)
+    and re-rank them by RMS of the discrepancy. Returns the non-dominated systems as (system, discrepancy,
+    complexity) tuples, sorted by complexity.
+    The refits of the whole front are one batched least squares over the term columns, shared by the equations.
+    '''
+    systems = [translate_equation(text_form, pool) for text_form, _ in text_forms]
+    equations = [system.vals[var] for system in systems for var in system.vars_to_describe]
+    term_values = lambda term: _term_values(term, shape, boundary)
+    for equation in equations:
+        equation.weights_internal = equation.weights_final # structure of the equation is preserved
+    gram = TermGram(term_values(equations[0].structure[equations[0].target_idx]).size)
+    rms = iter(np.sqrt(fit_population(equations, gram, term_values) / gram.n_points))
+    for equation in equations:
+        equation.weights_internal = equation.weights_final
+
+    refined = []
+    for system, (_, complexity) in zip(systems, text_forms):
+        discrepancy = sum([next(rms) for _ in system.vars_to_describe])
+        refined.append((system, discrepancy, complexity))
+
+    refined.sort(key = lambda entry: (entry[2], entry[1]))
+    front = []
+    for entry in refined:
+        if all([entry[1] < selected[1] for selected in front]):
+            front.append(entry)
+    return front
+
+
+def select_by_complexity(front: list, complexity: Union[float, list]):
+    '''
+    System from the refined front with complexity, closest to the requested one (lower discrepancy on ties).
+    '''
+    complexity = np.sum(complexity)
+    return min(front, key = lambda entry: (abs(entry[2] - complexity), entry[1]))[0]
+
+
+def multiresolution_discovery(discovery_fun: Callable, pool_fun: Callable, x, t, u,
+                              steps: Union[int, tuple] = 2, boundary: int = 10, levels: int = 1):
+    '''
+    Conduct the evolutionary search on the decimated data, then re-rank and refit the equations of the
+    resulting Pareto front on the full resolution data. Returns the full resolution pool and the refined front.
+
+    ``discovery_fun(x, t, u)`` shall return a tuple (epde_search_obj, system), as epde_discovery functions of the
+    experiment scripts; ``pool_fun(x, t, u)`` shall return the token pool, created on the passed data with the same
+    preprocessing (differentiation, smoothing and boundary), as the search, otherwise the front is refitted on the
+    other derivatives. The pool is created after the search, since it replaces the contents of epde global caches.
+    '''
+    x_coarse, t_coarse, u_coarse = decimate(x, t, u, steps)
+    epde_search_obj, _ = discovery_fun(x_coarse, t_coarse, u_coarse)
+    text_forms = pareto_text_forms(epde_search_obj, levels)
+
+    pool = pool_fun(x, t, u)
+    return pool, refine_pareto_front(text_forms, pool, u.shape, boundary)
+
+
+def split_domain(shape: tuple, tiles: tuple = (2, 2), overlap: float = 0.2) -> list:
+    '''
+    Sections of the domain into ``tiles[i]`` overlapping patches along each axis; ``overlap`` is the fraction
+    of the patch length, shared with the neighbouring patch.
+    '''
+    axes_sections = []
+    for dim_size, tiles_num in zip(shape, tiles):
+        length = int(np.ceil(dim_size / (tiles_num - (tiles_num - 1) * overlap)))
+        starts = np.linspace(0, dim_size - length, tiles_num).astype(int)
+        axes_sections.append([slice(int(start), int(start) + length) for start in starts])
+    return list(product(*axes_sections))
+
+
+def _tile_discovery(args):
+    discovery_fun, x, t, u, section = args
+    x, t, u = shared_value(x), shared_value(t), shared_value(u) # views of the shared memory in the workers
+    _, system = discovery_fun(x[section[1]], t[section[0]], u[section])
+    return {var: system.vals[var].text_form for var in system.vars_to_describe}
+
+
+def consensus_equation(text_forms: list, frequency_threshold: float = 0.5):
+    '''
+    Merge the equations, discovered on the separate tiles: for each variable, the most common target is kept,
+    the terms, present in at least ``frequency_threshold`` fraction of the equations with this target, enter
+    the consensus with the median coefficient. Returns the consensus text forms {variable: text form} and the
+    statistics {variable: {term: (frequency, median, IQR of the coefficient)}}.
+    '''
+    consensus, stats = {}, {}
+    for var in text_forms[0].keys():
+        parsed = [parse_equation_text(text_form[var]) for text_form in text_forms]
+        targets = [target for _, target in parsed]
+        target = max(set(targets), key = targets.count)
+        equations = [terms for terms, eq_target in parsed if eq_target == target]
+
+        var_stats = {}
+        for term in set().union(*[terms.keys() for terms in equations]):
+            coeffs = np.array([terms[term] for terms in equations if terms.get(term, 0) != 0])
+            frequency = coeffs.size / len(equations)
+            if coeffs.size:
+                var_stats[term] = (frequency, np.median(coeffs),
+                                   np.percentile(coeffs, 75) - np.percentile(coeffs, 25))
+            else:
+                var_stats[term] = (0., 0., 0.)
+        stats[var] = var_stats
+
+        selected = [str(var_stats[term][1]) + ' * ' + term for term in sorted(var_stats.keys())
+                    if term != '1' and var_stats[term][0] >= frequency_threshold]
+        free_coeff = np.median([terms.get('1', 0.) for terms in equations])
+        consensus[var] = ' + '.join(selected + [str(free_coeff),]) + ' = ' + target
+    return consensus, stats
+
+
+def _map_discoveries(discovery_fun: Callable, x, t, u, sections: list, processes: int = 4,
+                     threads_per_worker: int = None, pin: bool = False):
+    '''
+    Discoveries on the sections of the data in the worker processes. The arrays are placed into the shared memory
+    (unless they are SharedArray already, e.g. shared once per noise magnitude by the caller), so each task
+    carries only the handles and the section instead of the pickled copy of the data.
+    '''
+    if processes <= 1:
+        return [_tile_discovery((discovery_fun, shared_value(x), shared_value(t), shared_value(u), section))
+                for section in sections]
+    with SharedArrays(*[array for array in (x, t, u) if not isinstance(array, SharedArray)]) as created:
+        created = iter(created)
+        x, t, u = [array if isinstance(array, SharedArray) else next(created) for array in (x, t, u)]
+        with WorkerPool(processes, threads_per_worker, pin) as pool:
+            text_forms = pool.map(_tile_discovery, [(discovery_fun, x, t, u, section) for section in sections])
+            pool.report()
+    return text_forms
+
+
+def tiled_discovery(discovery_fun: Callable, x, t, u, tiles: tuple = (2, 2), overlap: float = 0.2,
+                    processes: int = 4, frequency_threshold: float = 0.5, threads_per_worker: int = None,
+                    pin: bool = False):
+    '''
+    Split the (t, x) domain into overlapping patches, conduct the discovery on each of them in a separate
+    process (epde keeps its caches in the global state, thus the processes do not interfere) and merge
+    the results into the consensus equation. ``discovery_fun(x, t, u)`` has to be picklable, i.e. defined
+    at the top level of a module. Workers get equal shares of the cores, see ``workers.WorkerPool``.
+    The arrays can be passed as ``workers.SharedArray``.
+    '''
+    return tiled_attempts(discovery_fun, x, t, u, 1, tiles, overlap, processes, frequency_threshold,
+                          threads_per_worker, pin)[0]
+
+
+def tiled_attempts(discovery_fun: Callable, x, t, u, attempts: int = 4, tiles: tuple = (2, 2), overlap: float = 0.2,
+                   processes: int = 4, frequency_threshold: float = 0.5, threads_per_worker: int = None,
+                   pin: bool = False):
+    '''
+    Independent attempts of ``tiled_discovery``: the discoveries on all the tiles of all the attempts are
+    conducted in one pool of workers. Returns the list of (consensus, statistics) of the attempts.
+    '''
+    sections = split_domain(shared_value(u).shape, tiles, overlap)
+    text_forms = _map_discoveries(discovery_fun, x, t, u, sections * attempts, processes, threads_per_worker, pin)
+    return [consensus_equation(text_forms[idx * len(sections) : (idx + 1) * len(sections)], frequency_threshold)
+            for idx in range(attempts)]
+
+
+def parallel_attempts(discovery_fun: Callable, x, t, u, attempts: int = 4, processes: int = 4,
+                      threads_per_worker: int = None, pin: bool = False):
+    '''
+    Independent discovery attempts on the whole data in the worker processes; returns the text forms
+    {variable: text form} of the obtained systems. The arrays can be passed as ``workers.SharedArray``.
+    '''
+    section = (slice(None),) * shared_value(u).ndim
+    return _map_discoveries(discovery_fun, x, t, u, [section,] * attempts, processes, threads_per_worker, pin)
@@ -0,0 +1,153 @@
+import numpy as np
+
+from lazy_imports import lazy_import, lazy_from
+from workers import WorkerPool, SharedArray
+
+ps = lazy_import('pysindy')
+odeint, = lazy_from('scipy.integrate', 'odeint')
+
+
+def stlsq(theta: np.ndarray, target: np.ndarray, threshold: float = 0.1, alpha: float = 0.05, max_iter: int = 20):
+    '''
+    Sequentially thresholded ridge regression, as ps.STLSQ: ridge fits with the removal of the terms with
+    |coefficient| < threshold until the support is stable, then the unregularized refit on the support.
+    Target columns are the equations; returns coefficients with shape (n_targets, n_features).
+    '''
+    target = target.reshape(target.shape[0], -1)
+    return stlsq_normal(theta.T @ theta, theta.T @ target, threshold, alpha, max_iter)
+
+
+def stlsq_normal(gram: np.ndarray, moments: np.ndarray, threshold: float = 0.1, alpha: float = 0.05,
+                 max_iter: int = 20):
+    '''
+    STLSQ on the normal equations: Gram matrix of the library (n_features, n_features) and its products
+    with the targets (n_features, n_targets), e.g. accumulated over the chunks of the data.
+    '''
+    coef = np.zeros((moments.shape[1], gram.shape[0]))
+    for eq_idx in range(moments.shape[1]):
+        active = np.ones(gram.shape[0], dtype = bool)
+        for _ in range(max_iter):
+            weights = np.linalg.solve(gram[np.ix_(active, active)] + alpha * np.eye(active.sum()),
+                                      moments[active, eq_idx])
+            support = np.abs(weights) >= threshold
+            if support.all() or not support.any():
+                active[active] = support
+                break
+            active[active] = support
+        if active.any():
+            coef[eq_idx, active] = np.linalg.lstsq(gram[np.ix_(active, active)], moments[active, eq_idx],
+                                                   rcond = None)[0]
+    return coef
+
+
+def replicate_rows(n_rows: int, rng: np.random.Generator, sample: str = 'bootstrap', fraction: float = 0.6):
+    if sample == 'bootstrap':
+        return rng.integers(0, n_rows, size = n_rows)
+    elif sample == 'subsample':
+        return np.sort(rng.choice(n_rows, size = int(fraction * n_rows), replace = False))
+    else:
+        raise NotImplementedError(f'Incorrect sampling {sample}. Only bootstrap or subsample are allowed.')
+
+
+def _fit_replicate(args):
+    theta, target, seed, sample, fraction, threshold, alpha = args
+    rows = replicate_rows(theta.shape[0], np.random.default_rng(seed), sample, fraction)
+    return stlsq(theta.array[rows], target.array[rows], threshold, alpha)
+
+
+def ensemble_stlsq(theta: SharedArray, target: SharedArray, replicates: int = 100, sample: str = 'bootstrap',
+                   fraction: float = 0.6, threshold: float = 0.1, alpha: float = 0.05, processes: int = 4,
+                   threads_per_worker: int = 1, seed: int = None):
+    '''
+    STLSQ fits on the bootstrap (or row subsample) replicates of the library matrix. The workers get only the
+    handles of the shared library and target arrays and the seeds of the replicates, the rows are drawn
+    inside the worker. With ``processes = 1`` the replicates are fitted in the current process.
+
+    Returns coefficients with shape (replicates, n_targets, n_features).
+    '''
+    seeds = np.random.SeedSequence(seed).generate_state(replicates)
+    tasks = [(theta, target, int(rep_seed), sample, fraction, threshold, alpha) for rep_seed in seeds]
+    if processes > 1:
+        with WorkerPool(processes, threads_per_worker = threads_per_worker) as pool:
+            coefs = pool.map(_fit_replicate, tasks)
+            pool.report()
+    else:
+        coefs = [_fit_replicate(task) for task in tasks]
+    return np.stack(coefs)
+
+
+def ensemble_statistics(coefs: np.ndarray, inclusion_threshold: float = 0.5, interval: tuple = (2.5, 97.5)):
+    '''
+    Inclusion probabilities of the terms (fraction of the replicates with the non-zero coefficient), median
+    coefficients (zeroed for the terms with inclusion below the threshold) and percentile intervals of
+    the coefficients over the replicates.
+    '''
+    inclusion = np.mean(coefs != 0, axis = 0)
+    coef = np.where(inclusion >= inclusion_threshold, np.median(coefs, axis = 0), 0.)
+    low, high = np.percentile(coefs, interval, axis = 0)
+    return coef, inclusion, low, high
+
+
+class EnsembleSINDy(object):
+    '''
+    Bagging version of the polynomial SINDy model from ``sindy_discovery``: library matrix and derivatives are
+    computed once, placed into the shared memory and the STLSQ replicates are fitted in parallel processes.
+    Provides ``equations``, ``print`` and ``simulate`` as ps.SINDy, thus can replace it in the experiment
+    scripts, and the per-term statistics: inclusion probabilities and coefficient intervals.
+    '''
+    def __init__(self, poly_order: int = 4, threshold: float = 0.1, alpha: float = 0.05, replicates: int = 100,
+                 sample: str = 'bootstrap', fraction: float = 0.6, inclusion_threshold: float = 0.5,
+                 processes: int = 4, seed: int = None):
+        self.poly_order = poly_order
+        self.threshold = threshold
+        self.alpha = alpha
+        self.replicates = replicates
+        self.sample = sample
+        self.fraction = fraction
+        self.inclusion_threshold = inclusion_threshold
+        self.processes = processes
+        self.seed = seed
+
+    def fit(self, x: np.ndarray, t: np.ndarray):
+        self.library = ps.PolynomialLibrary(degree = self.poly_order)
+        theta = np.asarray(self.library.fit_transform(x))
+        x_dot = np.asarray(ps.FiniteDifference()._differentiate(x, t = t[1] - t[0]))
+        self.feature_names = self.library.get_feature_names()
+
+        with SharedArray(theta) as theta_shared, SharedArray(x_dot) as x_dot_shared:
+            self.coefs = ensemble_stlsq(theta_shared, x_dot_shared, replicates = self.replicates,
+                                        sample = self.sample, fraction = self.fraction, threshold = self.threshold,
+                                        alpha = self.alpha, processes = self.processes, seed = self.seed)
+        self.coef_, self.inclusion, self.low, self.high = ensemble_statistics(self.coefs, self.inclusion_threshold)
+        return self
+
+    def equations(self, precision: int = 3):
+        '''
+        Equations in the format of ps.SINDy.equations; the free term is always written first.
+        '''
+        equations = []
+        for coef in self.coef_:
+            terms = [f'{coef[0]:.{precision}f} 1',] + [f'{value:.{precision}f} {name}' for value, name
+                                                       in zip(coef[1:], self.feature_names[1:]) if value != 0]
+            equations.append(' + '.join(terms))
+        return equations
+
+    def term_statistics(self):
+        '''
+        {equation index : {term : (inclusion probability, median coefficient, interval low, interval high)}}
+        '''
+        return {eq_idx : {name : (self.inclusion[eq_idx, idx], self.coef_[eq_idx, idx], self.low[eq_idx, idx],
+                                  self.high[eq_idx, idx]) for idx, name in enumerate(self.feature_names)}
+                for eq_idx in range(self.coef_.shape[0])}
+
+    def print(self):
+        for eq_idx, stats in self.term_statistics().items():
+            print(f'(x{eq_idx})\' = {self.equations()[eq_idx]}')
+            for name, (inclusion, median, low, high) in stats.items():
+                if inclusion > 0:
+                    print(f'    {name}: P = {inclusion:.2f}, coeff. {median:.3f} in [{low:.3f}, {high:.3f}]')
+
+    def simulate(self, x0: np.ndarray, t: np.ndarray):
+        powers = self.library.powers_
+        rhs = lambda x, t: self.coef_ @ np.prod(x[np.newaxis, :] ** powers, axis = 1)
+        return odeint(rhs, x0, t)
@@ -0,0 +1,105 @@
+import numpy as np
+
+SKETCH_METHODS = ('uniform', 'leverage', 'countsketch', 'gaussian')
+
+
+class RowSketch(object):
+    '''
+    Linear map S from the n_points rows of the regression to ``rows`` rows, applied to each column (or to the
+    matrix) in the same way, so that the sketched least squares min ||S (theta c - y)|| approximates the full one:
+        'uniform' - rows sampled without replacement, scaled by sqrt(n / m);
+        'leverage' - rows sampled with the probabilities, proportional to the leverage scores of ``theta``
+                     (the most accurate for the given number of rows, see ``approximate_leverage``);
+        'countsketch' - each row is added with the random sign into the random bucket: O(n) per column,
+                        does not depend on the library and keeps the information of all the rows;
+        'gaussian' - dense gaussian projection, O(n m) per column, for the moderate n.
+    '''
+    def __init__(self, n_points: int, rows: int, method: str = 'countsketch', seed: int = None,
+                 theta: np.ndarray = None, leverage: np.ndarray = None):
+        if method not in SKETCH_METHODS:
+            raise NotImplementedError(f'Incorrect sketch {method}. Only {", ".join(SKETCH_METHODS)} are allowed.')
+        rng = np.random.default_rng(seed)
+        self.n_points, self.rows, self.method = n_points, min(rows, n_points), method
+        if method == 'uniform':
+            self.index = np.sort(rng.choice(n_points, self.rows, replace = False))
+            self.scale = np.full(self.rows, np.sqrt(n_points / self.rows))
+        elif method == 'leverage':
+            if leverage is None and theta is None:
+                raise ValueError('Leverage score sampling requires the library matrix theta or its leverage scores.')
+            probas = approximate_leverage(theta, seed = seed) if leverage is None else leverage
+            probas = 0.9 * probas / probas.sum() + 0.1 / n_points # mixing with uniform bounds the scales
+            self.index = rng.choice(n_points, self.rows, replace = True, p = probas)
+            self.scale = 1. / np.sqrt(self.rows * probas[self.index])
+        elif method == 'countsketch':
+            self.buckets = rng.integers(0, self.rows, n_points)
+            self.signs = rng.choice([-1., 1.], n_points)
+        else:
+            self.matrix = rng.normal(scale = 1. / np.sqrt(self.rows), size = (self.rows, n_points))
+
+    def apply(self, values: np.ndarray):
+        '''
+        Sketch of the column (n_points,) or of the matrix (n_points, k).
+        '''
+        values = np.asarray(values).reshape(self.n_points, -1)
+        if self.method in ('uniform', 'leverage'):
+            sketched = values[self.index] * self.scale[:, None]
+        elif self.method == 'countsketch':
+            sketched = np.stack([np.bincount(self.buckets, weights = self.signs * column, minlength = self.rows)
+                                 for column in values.T], axis = 1)
+        else:
+            sketched = self.matrix @ values
+        return sketched[:, 0] if sketched.shape[1] == 1 else sketched
+
+
+def approximate_leverage(theta: np.ndarray, oversampling: int = 4, seed: int = None):
+    '''
+    Leverage scores of the rows of theta (n_points, k) without the QR of the whole matrix: R of the QR of
+    the CountSketch of theta with oversampling * k rows preconditions it, the scores are the squared row norms
+    of theta R^-1.
+    '''
+    theta = np.asarray(theta).reshape(theta.shape[0], -1)
+    sketch = RowSketch(theta.shape[0], oversampling * theta.shape[1] + 10, 'countsketch', seed)
+    _, R = np.linalg.qr(sketch.apply(theta))
+    diag = np.abs(np.diag(R))
+    R = R + np.diag(np.where(diag < 1e-12 * diag.max(), 1e-12 * diag.max(), 0.)) # rank deficient libraries
+    return np.sum(np.linalg.solve(R.T, theta.T)**2, axis = 0)
+
+
+def sketched_regression(theta: np.ndarray, target: np.ndarray, method: str = 'leverage', rows: int = None,
+                        tol: float = 0.02, max_rows: int = None, seed: int = None):
+    '''
+    Sketched least squares with the heuristic stopping rule: the number of rows (by default 20 per library term)
+    is doubled until the relative change of the coefficients between the consecutive sketches falls below ``tol``,
+    or the sketch reaches ``max_rows`` (by default, the half of the rows of theta). The agreement of two sketches
+    does not bound the error against the full least squares, which may be of the order of ``tol`` or larger.
+    Returns the sketched theta and target (to be passed into any regression, e.g. of pysindy) and the
+    least squares coefficients.
+    '''
+    theta = np.asarray(theta).reshape(theta.shape[0], -1)
+    n_points, n_terms = theta.shape
+    rows = 20 * n_terms if rows is None else rows
+    max_rows = n_points // 2 if max_rows is None else max_rows
+    rng = np.random.default_rng(seed)
+    leverage = approximate_leverage(theta, seed = seed) if method == 'leverage' else None
+
+    previous = None
+    while True:
+        sketch = RowSketch(n_points, rows, method, seed = rng.integers(2**32), leverage = leverage)
+        theta_s, target_s = sketch.apply(theta).reshape(-1, n_terms), sketch.apply(target)
+        coeffs = np.linalg.lstsq(theta_s, target_s, rcond = None)[0]
+        if previous is not None and np.linalg.norm(coeffs - previous) <= tol * np.linalg.norm(coeffs):
+            break
+        if rows >= max_rows:
+            break
+        previous, rows = coeffs, min(2 * rows, max_rows)
+    return theta_s, target_s, coeffs
+
+
+def sketch_size(n_terms: int, eps: float = 0.1, method: str = 'countsketch'):
+    '''
+    Number of rows, for which the sketch preserves the residuals of any regression on ``n_terms`` columns within
+    the relative error ~eps: k^2 / eps^2 for CountSketch, k log k / eps^2 for the sampling and the gaussian one.
+    '''
+    if method == 'countsketch':
+        return int(np.ceil(n_terms**2 / eps**2))
+    return int(np.ceil(n_terms * max(np.log(n_terms), 1.) / eps**2))
@@ -0,0 +1,160 @@
+import numpy as np
+from typing import Callable
+
+from canonical import parse_equation_text
+from streaming import ChunkedSeries, window_derivatives, token_values, term_values
+
+CONSTANT_TERM = '1'
+
+
+class SlidingWindow(object):
+    '''
+    Training window of ``window`` samples, advanced over the series by ``stride`` samples. On each shift only
+    the entering samples (with the halo of the stream for the derivative stencils) are read and differentiated,
+    the rest of the window, derivatives included, is kept from the previous position. On the live data the
+    window has to end ``halo`` samples before the latest sample.
+    Iteration yields (t, data, derivatives, new): window samples, derivatives with shape (n_vars, window, max_order)
+    and the slice of the entering samples.
+    '''
+    def __init__(self, stream: ChunkedSeries, window: int, stride: int, max_order: int = 1, pipeline = None):
+        if stride > window:
+            raise ValueError(f'Stride {stride} exceeds the window of {window} samples.')
+        self.stream = stream
+        self.window = window
+        self.stride = stride
+        self.max_order = max_order
+        self.pipeline = pipeline
+
+    def _read(self, start: int, stop: int):
+        low, high = max(start - self.stream.halo, 0), min(stop + self.stream.halo, self.stream.n_points)
+        t, data = self.stream.read(low, high)
+        derivs = window_derivatives(t, data, self.max_order, self.pipeline)
+        core = slice(start - low, stop - low)
+        return t[core], data[core], derivs[:, core]
+
+    def __len__(self):
+        return max((self.stream.n_points - self.window) // self.stride + 1, 0)
+
+    def __iter__(self):
+        t, data, derivs = self._read(0, self.window)
+        yield t, data, derivs, slice(0, self.window)
+        for start in range(self.stride, self.stream.n_points - self.window + 1, self.stride):
+            t_new, data_new, derivs_new = self._read(start + self.window - self.stride, start + self.window)
+            t = np.concatenate([t[self.stride:], t_new])
+            data = np.concatenate([data[self.stride:], data_new])
+            derivs = np.concatenate([derivs[:, self.stride:], derivs_new], axis = 1)
+            yield t, data, derivs, slice(self.window - self.stride, self.window)
+
+
+class SlidingTermMatrix(object):
+    '''
+    Columns of the terms (in the text form of the epde equations) on the current window and their Gram matrix.
+    On the shift of the window only the entering samples are evaluated, the Gram matrix is updated with the products
+    of the entering and leaving rows and recomputed from the columns every ``refresh`` shifts against the drift
+    of the rounding errors. The terms of the new equations are evaluated on the whole window once.
+    '''
+    def __init__(self, window: int, refresh: int = 64):
+        self.refresh = refresh
+        self.terms = {CONSTANT_TERM : 0}
+        self.columns = np.ones((window, 1))
+        self.gram = self.columns.T @ self.columns
+        self._shifts = 0
+
+    def _values(self, tokens: dict, n_rows: int, terms: list = None):
+        terms = list(self.terms) if terms is None else terms
+        return np.stack([np.ones(n_rows) if term == CONSTANT_TERM else term_values(term, tokens) for term in terms],
+                        axis = 1)
+
+    def add_terms(self, terms: list, tokens: dict):
+        new_terms = [term for term in dict.fromkeys(terms) if term not in self.terms]
+        if not new_terms:
+            return
+        new_columns = self._values(tokens, self.columns.shape[0], new_terms)
+        cross = self.columns.T @ new_columns
+        self.gram = np.block([[self.gram, cross], [cross.T, new_columns.T @ new_columns]])
+        self.columns = np.hstack([self.columns, new_columns])
+        for term in new_terms:
+            self.terms[term] = len(self.terms)
+
+    def shift(self, new_tokens: dict, stride: int):
+        entering = self._values(new_tokens, stride)
+        leaving = self.columns[:stride]
+        self.columns = np.concatenate([self.columns[stride:], entering])
+        self._shifts += 1
+        if self._shifts % self.refresh:
+            self.gram += entering.T @ entering - leaving.T @ leaving
+        else:
+            self.gram = self.columns.T @ self.columns
+
+    def fit(self, text_form: str):
+        '''
+        Least squares refit of the nonzero terms of the equation on the window (the zero ones of the epde text form
+        stay out, thus the sparsity of the search is preserved): refitted text form and RMS of its discrepancy.
+        '''
+        terms, target = parse_equation_text(text_form)
+        features = [term for term, coeff in terms.items() if term != CONSTANT_TERM and coeff != 0] + [CONSTANT_TERM,]
+        feature_idxs, target_idx = [self.terms[term] for term in features], self.terms[target]
+        A, b = self.gram[np.ix_(feature_idxs, feature_idxs)], self.gram[feature_idxs, target_idx]
+        scale = 1. / np.sqrt(np.maximum(np.diag(A), np.finfo(float).tiny))
+        coeffs = scale * np.linalg.lstsq(A * scale[:, None] * scale[None, :], b * scale, rcond = None)[0]
+        rss = self.gram[target_idx, target_idx] - 2. * coeffs @ b + coeffs @ A @ coeffs
+        terms = [f'{coeff} * {term}' for coeff, term in zip(coeffs[:-1], features[:-1])]
+        refitted = ' + '.join(terms + [str(coeffs[-1]),]) + ' = ' + target
+        return refitted, float(np.sqrt(max(rss, 0.) / self.columns.shape[0]))
+
+
+def equation_terms(text_form: str):
+    terms, target = parse_equation_text(text_form)
+    return [term for term, coeff in terms.items() if coeff != 0] + [target,]
+
+
+def front_seeds(epde_search_obj, levels: int = 1):
+    '''
+    Systems of the first non-dominated levels as the seeds of the next search: (text forms, sparsity constants).
+    '''
+    seeds = []
+    for level in epde_search_obj.equations(only_print = False, num = levels):
+        for system in level:
+            variables = system.vars_to_describe
+            seeds.append(({var : system.vals[var].text_form for var in variables},
+                          {var : system.vals.chromosome[('sparsity', var)].value for var in variables}))
+    return seeds
+
+
+def sliding_discovery(discovery_fun: Callable, windows: SlidingWindow, variable_names: list = ('u', 'v'),
+                      rediscovery_tol: float = 0.25, front_levels: int = 1, refresh: int = 64):
+    '''
+    Time series of the equations, discovered on the sliding window. The equation of the previous window is refitted
+    on the new one through the incrementally updated term matrix; the search is repeated only if the RMS of the
+    refit exceeds the one of the last search by more than ``rediscovery_tol`` (relative), and is warm-started
+    from the Pareto front of the last search. The first window is searched from scratch.
+    ``discovery_fun(t, data, derivatives, seeds)`` returns the EpdeSearch object and the selected system
+    (``seeds`` are None for the first window).
+    Returns the list of dicts with the time interval of the window, the refitted equations, their RMS and the flag
+    of the search on the window.
+    '''
+    history = []
+    seeds, system, reference_rms, matrix = None, None, None, None
+    for t, data, derivs, new in windows:
+        tokens = token_values(data, derivs, variable_names)
+        if matrix is None:
+            matrix = SlidingTermMatrix(windows.window, refresh)
+        else:
+            matrix.shift(token_values(data[new], derivs[:, new], variable_names), new.stop - new.start)
+
+        searched = False
+        if system is not None:
+            refits = {var : matrix.fit(text_form) for var, text_form in system.items()}
+            rms = sum([var_rms for _, var_rms in refits.values()])
+        if system is None or rms > (1. + rediscovery_tol) * reference_rms:
+            epde_search_obj, found = discovery_fun(t, data, derivs, seeds)
+            seeds = front_seeds(epde_search_obj, front_levels)
+            system = {var : found.vals[var].text_form for var in found.vars_to_describe}
+            matrix.add_terms([term for text_form in system.values() for term in equation_terms(text_form)], tokens)
+            refits = {var : matrix.fit(text_form) for var, text_form in system.items()}
+            rms = reference_rms = sum([var_rms for _, var_rms in refits.values()])
+            searched = True
+        system = {var : refitted for var, (refitted, _) in refits.items()}
+        history.append({'interval' : (float(t[0]), float(t[-1])), 'system' : dict(system),
+                        'rms' : {var : var_rms for var, (_, var_rms) in refits.items()}, 'searched' : searched})
+    return history
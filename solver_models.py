@@ -0,0 +1,105 @@
+import copy
+import hashlib
+import numpy as np
+from collections import OrderedDict
+
+from lazy_imports import lazy_from
+from canonical import canonical_form
+
+SolverAdapter, = lazy_from('epde.interface.solver_integration', 'SolverAdapter')
+
+WARM_STRATEGIES = ('NN', 'autograd') # strategies, where the solution is the network, that can be trained further
+
+
+def grid_key(grid: list):
+    hasher = hashlib.sha1()
+    for subgrid in grid:
+        subgrid = np.ascontiguousarray(subgrid)
+        hasher.update(repr((subgrid.shape, subgrid.dtype.str)).encode())
+        hasher.update(subgrid.tobytes())
+    return hasher.hexdigest()[:16]
+
+
+def structure_key(system):
+    '''
+    Canonical form of the system without the coefficients: the systems with the same terms have close solutions.
+    '''
+    return tuple([(var, target, tuple([term for term, _ in terms])) for var, target, terms in canonical_form(system)])
+
+
+def predict(system, boundary_conditions, grid: list, strategy: str = 'NN', data = None, model = None,
+            solver_kwargs: dict = {'use_cache' : True}):
+    '''
+    Counterpart of EpdeSearch.predict, that starts the training of the solution from the given ``model``
+    (network or its state dict for the default architecture) instead of the random initialization.
+    Returns the prediction on the grid and the trained model.
+    '''
+    var_number = len(system.vars_to_describe)
+    if isinstance(model, dict):
+        adapter = SolverAdapter(var_number = var_number)
+        adapter.model.load_state_dict(model)
+    else:
+        adapter = SolverAdapter(model = model, var_number = var_number)
+    for key, value in solver_kwargs.items(): # set_solver_params would reset the parameters, that are not given
+        adapter.set_param(key, value)
+    solution_model = adapter.solve_epde_system(system = system, grids = grid, data = data,
+                                               boundary_conditions = boundary_conditions, strategy = strategy)
+    return solution_model(adapter.convert_grid(grid)).detach().numpy(), solution_model
+
+
+class SolutionModelCache(object):
+    '''
+    LRU of the trained solution networks, keyed by the canonical structure of the system (terms without the
+    coefficients), the grid and the strategy. The prediction for the system starts from the copy of the model of
+    the same structure, or, with ``grid_fallback``, of the latest system on the same grid (off by default: the solution
+    of the unrelated system is not a neutral initialization): repeated discoveries differ mostly in the coefficients,
+    and their solutions converge in a fraction of the cold-start iterations.
+    Warm-started solves use the smaller minimal number of the epochs ``warm_tmin`` and skip the on-disk
+    model cache of the solver, which would override the initial model.
+    '''
+    def __init__(self, max_size: int = 8, grid_fallback: bool = False, warm_tmin: int = 500):
+        self.max_size = max_size
+        self.grid_fallback = grid_fallback
+        self.warm_tmin = warm_tmin
+        self._models = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, system, grid: list, strategy: str):
+        return (structure_key(system), grid_key(grid), strategy)
+
+    def get(self, system, grid: list, strategy: str):
+        key = self.key(system, grid, strategy)
+        if key not in self._models and self.grid_fallback:
+            key = next((stored for stored in reversed(self._models) if stored[1:] == key[1:]), key)
+        if key not in self._models:
+            return None
+        self._models.move_to_end(key)
+        return copy.deepcopy(self._models[key])
+
+    def put(self, system, grid: list, strategy: str, model):
+        key = self.key(system, grid, strategy)
+        self._models[key] = model
+        self._models.move_to_end(key)
+        while len(self._models) > self.max_size:
+            self._models.popitem(last = False)
+
+    def predict(self, system, boundary_conditions, grid: list, strategy: str = 'NN', data = None,
+                solver_kwargs: dict = {'use_cache' : True}):
+        if strategy not in WARM_STRATEGIES:
+            return predict(system, boundary_conditions, grid, strategy, data, solver_kwargs = solver_kwargs)[0]
+        model = self.get(system, grid, strategy)
+        if model is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            solver_kwargs = {**solver_kwargs, 'use_cache' : False, 'tmin' : self.warm_tmin}
+        prediction, solution_model = predict(system, boundary_conditions, grid, strategy, data, model, solver_kwargs)
+        self.put(system, grid, strategy, solution_model)
+        return prediction
+
+    def clear(self):
+        self._models.clear()
+
+    def report(self):
+        print(f'Solution models: {self.hits} of {self.hits + self.misses} solves warm-started')
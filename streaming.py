@@ -0,0 +1,246 @@
+import re
+import numpy as np
+
+from lazy_imports import lazy_import, lazy_from
+from precision import as_working
+from canonical import parse_equation_text
+from sindy_tools import EnsembleSINDy, stlsq_normal
+from synthetic_data import load_dataset
+
+ps = lazy_import('pysindy')
+finite_difference_derivatives, run_batch = lazy_from('preprocessing', 'finite_difference_derivatives', 'run_batch')
+
+FACTOR_PATTERN = re.compile(r'^(?P<token>[^{]+)\{power: (?P<power>[^}]+)\}$')
+
+
+def window_derivatives(t: np.ndarray, data: np.ndarray, max_order: int = 1, pipeline = None):
+    '''
+    Time derivatives of the window data (n_t, n_vars) with shape (n_vars, n_t, max_order).
+    '''
+    if pipeline is None:
+        return np.stack(finite_difference_derivatives(data.T, t, max_order, axis = 1), axis = -1)
+    _, derivs = run_batch(pipeline, np.ascontiguousarray(data.T), grid = [t,], max_order = (max_order,))
+    return derivs
+
+
+class ChunkedSeries(object):
+    '''
+    Long multivariate series (n_t, n_vars), e.g. memmap of the ``synthetic_data`` dataset, read by the windows of
+    ``window`` samples: only the current window (with ``halo`` samples of each neighbour, that have to cover
+    the half-width of the derivative stencil or smoothing kernel) is held in memory. The derivatives in the core
+    of the window are then the same, as on the whole series.
+    Multiplicative noise of the experiments is drawn per block of ``window`` samples from the seeded generator,
+    thus each sample gets the same noise in every window (and in the decimated series), that contains it.
+    '''
+    def __init__(self, t: np.ndarray, series: np.ndarray, window: int = 4096, halo: int = 16, columns: list = None,
+                 noise_magnitude: float = 0., seed: int = None):
+        self.t = t
+        self.series = series
+        self.window = window
+        self.halo = halo
+        self.columns = list(range(series.shape[1])) if columns is None else list(columns)
+        self.noise_magnitude = noise_magnitude
+        self.seed = np.random.SeedSequence().entropy if seed is None else seed
+
+    @classmethod
+    def from_dataset(cls, path: str, **kwargs):
+        coords, series, _ = load_dataset(path)
+        return cls(coords[0], series, **kwargs)
+
+    def with_noise(self, magnitude: float, seed: int = None):
+        return ChunkedSeries(self.t, self.series, self.window, self.halo, self.columns, magnitude,
+                             self.seed if seed is None else seed)
+
+    @property
+    def n_points(self):
+        return len(self.t)
+
+    def __len__(self):
+        return int(np.ceil(self.n_points / self.window))
+
+    def _noise(self, start: int, stop: int):
+        blocks = range(start // self.window, (stop - 1) // self.window + 1)
+        noise = np.concatenate([np.random.default_rng([self.seed, block]).standard_normal((self.window,
+                                                                                          len(self.columns)))
+                                for block in blocks])
+        offset = blocks[0] * self.window
+        return noise[start - offset:stop - offset]
+
+    def read(self, start: int, stop: int):
+        '''
+        Time and the (noisy) selected columns of the samples [start, stop) in the working precision.
+        '''
+        data = as_working(self.series[start:stop, self.columns])
+        if self.noise_magnitude:
+            data = as_working(data + self.noise_magnitude * np.abs(data) * self._noise(start, stop))
+        return as_working(self.t[start:stop]), data
+
+    def __iter__(self):
+        '''
+        Windows (t, data, core): ``core`` is the slice of the window without the halo samples.
+        '''
+        for start in range(0, self.n_points, self.window):
+            stop = min(start + self.window, self.n_points)
+            low, high = max(start - self.halo, 0), min(stop + self.halo, self.n_points)
+            t, data = self.read(low, high)
+            yield t, data, slice(start - low, stop - low)
+
+    def derivatives(self, max_order: int = 1, pipeline = None):
+        '''
+        Windows (t, data, derivatives) without the halo samples, derivatives with shape (n_vars, n_t, max_order)
+        are taken by the finite differences or by the preprocessing ``pipeline`` (see ``preprocessing.run_batch``).
+        '''
+        for t, data, core in self:
+            derivs = window_derivatives(t, data, max_order, pipeline)
+            yield t[core], data[core], derivs[:, core]
+
+    def decimated(self, max_points: int):
+        '''
+        Every k-th sample of the series (k is the smallest one, that gives at most ``max_points`` samples),
+        collected window by window, e.g. for the search, that needs the whole training series in memory.
+        '''
+        step = int(np.ceil(self.n_points / max_points))
+        ts, datas = [], []
+        for start in range(0, self.n_points, self.window):
+            t, data = self.read(start, min(start + self.window, self.n_points))
+            first = (-start) % step
+            ts.append(t[first::step])
+            datas.append(data[first::step])
+        return np.concatenate(ts), np.concatenate(datas)
+
+
+class NormalEquations(object):
+    '''
+    Normal equations of the least squares theta c = target, accumulated over the chunks of rows: the memory
+    does not depend on the number of rows.
+    '''
+    def __init__(self, n_features: int, n_targets: int = 1):
+        self.gram = np.zeros((n_features, n_features))
+        self.moments = np.zeros((n_features, n_targets))
+        self.target_squares = np.zeros(n_targets)
+        self.n_rows = 0
+
+    def add(self, theta: np.ndarray, target: np.ndarray):
+        target = target.reshape(target.shape[0], -1)
+        self.gram += theta.T @ theta
+        self.moments += theta.T @ target
+        self.target_squares += np.sum(target**2, axis = 0)
+        self.n_rows += theta.shape[0]
+
+    def solve(self, rcond: float = None):
+        '''
+        Least squares coefficients (n_features, n_targets) from the diagonally scaled normal equations.
+        '''
+        scale = 1. / np.sqrt(np.maximum(np.diag(self.gram), np.finfo(float).tiny))
+        scaled = np.linalg.lstsq(self.gram * scale[:, None] * scale[None, :], self.moments * scale[:, None],
+                                 rcond = rcond)[0]
+        return scaled * scale[:, None]
+
+    def rss(self, coeffs: np.ndarray):
+        coeffs = coeffs.reshape(self.gram.shape[0], -1)
+        residuals = (self.target_squares - 2. * np.sum(coeffs * self.moments, axis = 0)
+                     + np.sum(coeffs * (self.gram @ coeffs), axis = 0))
+        return np.maximum(residuals, 0.)
+
+
+class StreamingSINDy(EnsembleSINDy):
+    '''
+    Polynomial SINDy (STLSQ, as in ``sindy_discovery``) on the ChunkedSeries: the library of each window is
+    reduced into the normal equations, thus the whole series is never held in memory. With ``derivative_state``
+    the first derivatives of the variables are the additional state variables (second order ODE as the system).
+    Provides the interface of EnsembleSINDy; the intervals of the coefficients are the normal approximation
+    ones of the refit on the selected terms.
+    '''
+    def __init__(self, poly_order: int = 2, threshold: float = 0.1, alpha: float = 0.05, pipeline = None,
+                 derivative_state: bool = False, z_score: float = 1.96):
+        super().__init__(poly_order = poly_order, threshold = threshold, alpha = alpha, processes = 1)
+        self.pipeline = pipeline
+        self.derivative_state = derivative_state
+        self.z_score = z_score
+
+    def fit(self, stream: ChunkedSeries):
+        self.library = ps.PolynomialLibrary(degree = self.poly_order)
+        normal = None
+        max_order = 2 if self.derivative_state else 1
+        for _, data, derivs in stream.derivatives(max_order, self.pipeline):
+            state, target = data, derivs[..., 0].T
+            if self.derivative_state:
+                state, target = np.hstack([data, derivs[..., 0].T]), np.hstack([target, derivs[..., 1].T])
+            if normal is None:
+                self.library.fit(state)
+                normal = NormalEquations(self.library.n_output_features_, target.shape[1])
+            normal.add(np.asarray(self.library.transform(state)), target)
+        self.feature_names = self.library.get_feature_names()
+        self.coef_ = stlsq_normal(normal.gram, normal.moments, self.threshold, self.alpha)
+
+        self.inclusion = (self.coef_ != 0).astype(float)
+        self.low, self.high = self.coef_.copy(), self.coef_.copy()
+        variances = normal.rss(self.coef_.T) / max(normal.n_rows - self.inclusion.sum(axis = 1).max(), 1)
+        for eq_idx, active in enumerate(self.inclusion.astype(bool)):
+            if active.any():
+                errors = np.sqrt(variances[eq_idx] * np.diag(np.linalg.pinv(normal.gram[np.ix_(active, active)])))
+                self.low[eq_idx, active] -= self.z_score * errors
+                self.high[eq_idx, active] += self.z_score * errors
+        self.n_points = normal.n_rows
+        return self
+
+
+def derivative_label(var: str, order: int, axis: int = 1):
+    if order == 1:
+        return f'd{var}/dx{axis}'
+    return f'd^{order}{var}/dx{axis}^{order}'
+
+
+def token_values(data: np.ndarray, derivs: np.ndarray, variable_names: list):
+    '''
+    Values of the epde tokens (variables and their time derivatives) in the window by their labels.
+    '''
+    tokens = {}
+    for idx, var in enumerate(variable_names):
+        tokens[var] = data[:, idx]
+        for order in range(1, derivs.shape[-1] + 1):
+            tokens[derivative_label(var, order)] = derivs[idx, :, order - 1]
+    return tokens
+
+
+def term_values(term: str, tokens: dict):
+    '''
+    Values of the term in the text form of the epde equations, e.g. 'u{power: 1.0} * dv/dx1{power: 2.0}'.
+    '''
+    values = 1.
+    for factor in term.split(' * '):
+        match = FACTOR_PATTERN.match(factor.strip())
+        if match is None or match.group('token') not in tokens:
+            raise KeyError(f'Factor {factor} can not be evaluated on the streamed data.')
+        values = values * tokens[match.group('token')] ** float(match.group('power'))
+    return values
+
+
+def stream_refit(text_forms: dict, stream: ChunkedSeries, variable_names: list = ('u', 'v'), max_order: int = 1,
+                 pipeline = None):
+    '''
+    Coefficients of the discovered equations (e.g. by the search on the decimated series) refitted over all
+    the windows of the stream: for each equation the normal equations of its terms are accumulated window by
+    window. Terms with zero coefficients (kept in the epde text forms) stay out of the refit, thus the structure
+    of the equations is preserved. ``pipeline`` has to be the preprocessing of the search, the refit on the raw
+    finite differences of the noisy data is biased. Returns the refitted text forms {variable : text form} and
+    the RMS of their discrepancies.
+    '''
+    equations = {var : parse_equation_text(text_form) for var, text_form in text_forms.items()}
+    features = {var : [term for term, coeff in terms.items() if term != '1' and coeff != 0]
+                for var, (terms, _) in equations.items()}
+    normal = {var : NormalEquations(len(features[var]) + 1) for var in equations}
+    for _, data, derivs in stream.derivatives(max_order, pipeline):
+        tokens = token_values(data, derivs, variable_names)
+        for var, (_, target) in equations.items():
+            theta = np.stack([term_values(term, tokens) for term in features[var]] + [np.ones(data.shape[0]),],
+                             axis = 1)
+            normal[var].add(theta, term_values(target, tokens))
+
+    refitted, rms = {}, {}
+    for var, (_, target) in equations.items():
+        coeffs = normal[var].solve()[:, 0]
+        terms = [f'{coeff} * {term}' for coeff, term in zip(coeffs[:-1], features[var])]
+        refitted[var] = ' + '.join(terms + [str(coeffs[-1]),]) + ' = ' + target
+        rms[var] = float(np.sqrt(normal[var].rss(coeffs)[0] / normal[var].n_rows))
+    return refitted, rms
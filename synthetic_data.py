@@ -0,0 +1,162 @@
+import os
+import json
+import numpy as np
+from numpy.lib.format import open_memmap
+
+from lazy_imports import lazy_from
+
+solve_ivp, = lazy_from('scipy.integrate', 'solve_ivp')
+
+
+def create_dataset(path: str, shape: tuple, coords: dict, meta: dict = None, dtype = np.float64):
+    '''
+    Memory-mapped dataset: directory with the field ``u.npy`` (opened as the writable memmap, that is
+    returned), coordinate arrays ``<name>.npy`` and ``meta.json`` with the generation parameters.
+    '''
+    os.makedirs(path, exist_ok = True)
+    for name, values in coords.items():
+        np.save(os.path.join(path, name + '.npy'), np.asarray(values, dtype = dtype))
+    with open(os.path.join(path, 'meta.json'), 'w') as meta_file:
+        json.dump({'coords' : list(coords.keys()), **(meta or {})}, meta_file, indent = 4)
+    return open_memmap(os.path.join(path, 'u.npy'), mode = 'w+', dtype = dtype, shape = shape)
+
+
+def load_dataset(path: str, mmap_mode: str = 'r'):
+    '''
+    Returns the coordinates (in the order of the field axes), the field as the memmap and the metadata.
+    '''
+    with open(os.path.join(path, 'meta.json'), 'r') as meta_file:
+        meta = json.load(meta_file)
+    coords = [np.load(os.path.join(path, name + '.npy')) for name in meta['coords']]
+    return coords, np.load(os.path.join(path, 'u.npy'), mmap_mode = mmap_mode), meta
+
+
+def integrating_factor_rk4(u_out, u0: np.ndarray, linear: np.ndarray, nonlinear, t: np.ndarray, dt: float):
+    '''
+    Pseudo-spectral integration of u_t = L u + N(u) with the periodic boundary: the linear part is integrated
+    exactly in the Fourier space (integrating factor), the nonlinear one by RK4. ``linear`` holds the symbol of L
+    for the rfft wavenumbers, ``nonlinear`` maps the spectrum into the spectrum of N(u). The solution in the
+    moments t is written row by row into ``u_out`` (e.g. memmap), thus the whole field is never held in memory.
+    '''
+    spectrum = np.fft.rfft(u0)
+    u_out[0] = u0
+    for idx in range(1, len(t)):
+        steps = int(np.ceil((t[idx] - t[idx - 1]) / dt))
+        h = (t[idx] - t[idx - 1]) / steps
+        E = np.exp(linear * h / 2.)
+        E2 = E**2
+        for _ in range(steps):
+            a = h * nonlinear(spectrum)
+            b = h * nonlinear(E * (spectrum + a / 2.))
+            c = h * nonlinear(E * spectrum + b / 2.)
+            d = h * nonlinear(E2 * spectrum + E * c)
+            spectrum = E2 * spectrum + (E2 * a + 2. * E * (b + c) + d) / 6.
+        u_out[idx] = np.fft.irfft(spectrum, len(u0))
+    return u_out
+
+
+def _dealiased_derivative_of_square(n_x: int, length: float):
+    '''
+    Spectrum of (u^2)_x from the spectrum of u, with 2/3-rule dealiasing.
+    '''
+    k = 2. * np.pi * np.fft.rfftfreq(n_x, d = length / n_x)
+    mask = np.arange(len(k)) < (n_x // 3)
+    def derivative(spectrum):
+        u = np.fft.irfft(spectrum * mask, n_x)
+        return 1j * k * np.fft.rfft(u**2) * mask
+    return k, derivative
+
+
+def generate_kdv(path: str, n_x: int = 512, n_t: int = 201, length: float = 60., t_max: float = 20.,
+                 n_solitons: int = 2, seed: int = None, dtype = np.float64):
+    '''
+    KdV u_t + 6 u u_x + u_xxx = 0 on the periodic [-length/2, length/2) with the initial condition of n_solitons
+    solitons c/2 sech^2(sqrt(c)/2 (x - x0)) with random speeds c in [0.5, 1] and positions.
+    The layout of the field is (t, x), as in the experiment scripts.
+    '''
+    rng = np.random.default_rng(seed)
+    x = np.linspace(-length / 2., length / 2., n_x, endpoint = False)
+    t = np.linspace(0., t_max, n_t)
+    speeds = rng.uniform(0.5, 1., n_solitons)
+    positions = -length / 4. + length / 2. * (np.arange(n_solitons) + rng.uniform(0.25, 0.75, n_solitons)) / n_solitons
+    u0 = sum([c / 2. / np.cosh(np.sqrt(c) / 2. * (x - x0))**2 for c, x0 in zip(speeds, positions)])
+
+    k, square_derivative = _dealiased_derivative_of_square(n_x, length)
+    nonlinear = lambda spectrum: -3. * square_derivative(spectrum)
+    dt = 0.1 * (length / n_x) / max(np.abs(u0).max(), 1e-3) # stable for the dealiased nonlinear part
+
+    u = create_dataset(path, (n_t, n_x), {'t' : t, 'x' : x}, dtype = dtype,
+                       meta = {'equation' : 'kdv', 'n_x' : n_x, 'n_t' : n_t, 'length' : length, 't_max' : t_max,
+                               'n_solitons' : n_solitons, 'seed' : seed})
+    integrating_factor_rk4(u, u0, 1j * k**3, nonlinear, t, dt)
+    u.flush()
+    return t, x, u
+
+
+def generate_burgers(path: str, n_x: int = 256, n_t: int = 101, length: float = 16., t_max: float = 10.,
+                     nu: float = 0.1, seed: int = None, dtype = np.float64):
+    '''
+    Burgers u_t + u u_x = nu u_xx on the periodic [-length/2, length/2) with the gaussian initial condition of
+    random position and width.
+    '''
+    rng = np.random.default_rng(seed)
+    x = np.linspace(-length / 2., length / 2., n_x, endpoint = False)
+    t = np.linspace(0., t_max, n_t)
+    center, width = rng.uniform(-length / 8., length / 8.), rng.uniform(0.7, 1.3)
+    u0 = np.exp(-((x - center) / width)**2)
+
+    k, square_derivative = _dealiased_derivative_of_square(n_x, length)
+    nonlinear = lambda spectrum: -0.5 * square_derivative(spectrum)
+    dt = 0.2 * (length / n_x) / max(np.abs(u0).max(), 1e-3)
+
+    u = create_dataset(path, (n_t, n_x), {'t' : t, 'x' : x}, dtype = dtype,
+                       meta = {'equation' : 'burgers', 'n_x' : n_x, 'n_t' : n_t, 'length' : length,
+                               't_max' : t_max, 'nu' : nu, 'seed' : seed})
+    integrating_factor_rk4(u, u0, -nu * k**2, nonlinear, t, dt)
+    u.flush()
+    return t, x, u
+
+
+def _generate_ode(path: str, rhs, initial, n_t: int, t_max: float, meta: dict, dtype):
+    t = np.linspace(0., t_max, n_t, endpoint = False)
+    solution = solve_ivp(rhs, (0., t_max), initial, t_eval = t, method = 'DOP853', rtol = 1e-10, atol = 1e-12)
+    u = create_dataset(path, (n_t, len(initial)), {'t' : t}, meta = meta, dtype = dtype)
+    u[...] = solution.y.T
+    u.flush()
+    return t, u
+
+
+def generate_lotka_volterra(path: str, n_t: int = 301, t_max: float = 1., params: tuple = (20., 20., 20., 20.),
+                            initial: tuple = None, seed: int = None, dtype = np.float64):
+    '''
+    Lotka-Volterra u' = a u - b u v, v' = -c v + d u v; without ``initial`` the initial populations are
+    drawn around (4, 2) of the shipped data_20.npy.
+    '''
+    a, b, c, d = params
+    if initial is None:
+        initial = np.array([4., 2.]) * np.random.default_rng(seed).uniform(0.8, 1.2, 2)
+    rhs = lambda t, state: [a * state[0] - b * state[0] * state[1], -c * state[1] + d * state[0] * state[1]]
+    return _generate_ode(path, rhs, list(initial), n_t, t_max, dtype = dtype,
+                         meta = {'equation' : 'lotka_volterra', 'n_t' : n_t, 't_max' : t_max,
+                                 'params' : list(params), 'initial' : list(map(float, initial)), 'seed' : seed})
+
+
+def generate_van_der_pol(path: str, n_t: int = 640, t_max: float = 32., epsilon: float = 0.2,
+                         initial: tuple = None, seed: int = None, dtype = np.float64):
+    '''
+    Van der Pol oscillator x'' = epsilon (1 - x^2) x' - x, stored as (x, x'); without ``initial``
+    the initial state is drawn on the unit circle.
+    '''
+    if initial is None:
+        phase = np.random.default_rng(seed).uniform(0., 2. * np.pi)
+        initial = (np.cos(phase), np.sin(phase))
+    rhs = lambda t, state: [state[1], epsilon * (1. - state[0]**2) * state[1] - state[0]]
+    return _generate_ode(path, rhs, list(initial), n_t, t_max, dtype = dtype,
+                         meta = {'equation' : 'van_der_pol', 'n_t' : n_t, 't_max' : t_max,
+                                 'epsilon' : epsilon, 'initial' : list(map(float, initial)), 'seed' : seed})
+
+
+if __name__ == '__main__':
+    # Sweep of the KdV resolutions for the scaling studies
+    for n_x, n_t in [(128, 51), (256, 101), (512, 201), (1024, 401)]:
+        generate_kdv(f'datasets/synthetic/kdv_{n_x}_{n_t}', n_x = n_x, n_t = n_t, seed = 0)
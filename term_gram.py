@@ -0,0 +1,164 @@
+import numpy as np
+from collections import OrderedDict
+from typing import Callable
+
+from sketching import RowSketch
+
+CONSTANT_KEY = 'const'
+
+
+class TermGram(object):
+    '''
+    Columns of the evaluated terms, shared between all the equations of the population, and their (weighted)
+    Gram matrix, extended by one matrix-vector product, when a new term appears. The regression of any equation
+    is then the small system on the entries of the Gram matrix without the passes over the data.
+    Columns are kept in the LRU order, bounded by the total size in bytes; the evicted column frees its slot.
+    The columns of the batch, that is being built, are pinned: when all the other columns are pinned, ``add``
+    raises MemoryError instead of evicting them.
+    With the ``sketch`` the columns (scaled by the square roots of the weights) are stored sketched, thus the
+    memory and the cost of the new term depend on the number of sketch rows instead of the grid points.
+    '''
+    def __init__(self, n_points: int, weights: np.ndarray = None, max_bytes: int = 2**28, sketch: RowSketch = None):
+        self.n_points = n_points
+        self.weights = np.ones(n_points) if weights is None else np.ravel(weights)
+        self.sketch = sketch
+        self._rows = n_points if sketch is None else sketch.rows
+        self.max_columns = max(int(max_bytes // (8 * self._rows)), 2)
+        self._slots = OrderedDict()
+        self._free = []
+        self._columns = np.empty((self._rows, 0))
+        self._gram = np.empty((0, 0))
+        self.add(CONSTANT_KEY, np.ones(n_points))
+
+    def _grow(self):
+        capacity = min(max(2 * self._columns.shape[1], 8), self.max_columns)
+        columns, gram = np.empty((self._rows, capacity)), np.zeros((capacity, capacity))
+        columns[:, :self._columns.shape[1]] = self._columns
+        gram[:self._gram.shape[0], :self._gram.shape[1]] = self._gram
+        self._free.extend(range(capacity - 1, self._columns.shape[1] - 1, -1))
+        self._columns, self._gram = columns, gram
+
+    def add(self, key, values, pinned: set = frozenset()):
+        '''
+        Slot of the term column; ``values`` (array or callable) are evaluated only for the new term. The columns
+        with the keys from ``pinned`` (referenced by the problems of the current batch) are not evicted.
+        '''
+        if key in self._slots:
+            self._slots.move_to_end(key)
+            return self._slots[key]
+        if not self._free and self._columns.shape[1] < self.max_columns:
+            self._grow()
+        if not self._free:
+            evicted = next((stored for stored in self._slots if stored != CONSTANT_KEY and stored not in pinned), None)
+            if evicted is None:
+                raise MemoryError(f'All {self.max_columns} term columns are used by the current batch.')
+            self._free.append(self._slots.pop(evicted))
+        slot = self._free.pop()
+        column = np.ravel(values() if callable(values) else values)
+        if self.sketch is None:
+            weighted = self.weights * column
+        else:
+            column = weighted = self.sketch.apply(np.sqrt(self.weights) * column)
+        self._columns[:, slot] = column
+        self._slots[key] = slot
+        active = list(self._slots.values())
+        dots = self._columns[:, active].T @ weighted
+        self._gram[slot, active] = dots
+        self._gram[active, slot] = dots
+        return slot
+
+    @property
+    def constant(self):
+        return self._slots[CONSTANT_KEY]
+
+    def solve(self, problems: list, rcond: float = 1e-10):
+        '''
+        Weighted least squares for all the problems [(feature slots, target slot), ...] as one batched call:
+        the normal equations are padded to the largest number of features (with the identity block) and
+        solved by the batched pseudo-inverse of the diagonally scaled Gram submatrices, thus the collinear
+        features get the minimum-norm solution of the scaled problem (with the fitted values of the plain
+        least squares, but not its coefficients).
+        Returns the list of coefficient arrays and the array of the weighted residual sums of squares.
+        '''
+        size = max([len(features) for features, _ in problems] + [1,])
+        A = np.tile(np.eye(size), (len(problems), 1, 1))
+        b = np.zeros((len(problems), size))
+        yy = np.empty(len(problems))
+        for idx, (features, target) in enumerate(problems):
+            k = len(features)
+            A[idx, :k, :k] = self._gram[np.ix_(features, features)]
+            b[idx, :k] = self._gram[features, target]
+            yy[idx] = self._gram[target, target]
+        scale = 1. / np.sqrt(np.maximum(np.diagonal(A, axis1 = 1, axis2 = 2), np.finfo(float).tiny))
+        A_scaled = A * scale[:, :, None] * scale[:, None, :]
+        coeffs = scale * np.einsum('pij,pj->pi', np.linalg.pinv(A_scaled, rcond = rcond, hermitian = True), b * scale)
+        rss = yy - 2. * np.einsum('pi,pi->p', coeffs, b) + np.einsum('pi,pij,pj->p', coeffs, A, coeffs)
+        return [coeffs[idx, :len(features)] for idx, (features, _) in enumerate(problems)], np.maximum(rss, 0.)
+
+    def __len__(self):
+        return len(self._slots)
+
+
+def equation_terms(equation, all_terms: bool = False):
+    '''
+    Non-zero (by ``weights_internal``, or all with ``all_terms``) feature terms of the equation and their indexes
+    in the weights of the equation.
+    '''
+    terms, weight_idxs = [], []
+    for term_idx, term in enumerate(equation.structure):
+        if term_idx == equation.target_idx:
+            continue
+        weight_idx = term_idx if term_idx < equation.target_idx else term_idx - 1
+        if all_terms or equation.weights_internal[weight_idx] != 0:
+            terms.append(term)
+            weight_idxs.append(weight_idx)
+    return terms, weight_idxs
+
+
+def equation_problem(gram: TermGram, equation, term_values: Callable, all_terms: bool = False,
+                     pinned: set = None):
+    '''
+    Slots of the features (see ``equation_terms``) and the free coefficient, the target slot, and indexes of
+    the features in the weights of the equation. The keys of the columns are added to ``pinned``.
+    '''
+    pinned = set() if pinned is None else pinned
+    target_term = equation.structure[equation.target_idx]
+    terms, weight_idxs = equation_terms(equation, all_terms)
+    pinned.update([target_term.cache_label,] + [term.cache_label for term in terms])
+    target = gram.add(target_term.cache_label, lambda: term_values(target_term), pinned)
+    features = [gram.add(term.cache_label, lambda term = term: term_values(term), pinned) for term in terms]
+    return features + [gram.constant,], target, weight_idxs
+
+
+def fit_population(equations: list, gram: TermGram, term_values: Callable = lambda term: term.evaluate(False),
+                   all_terms: bool = False):
+    '''
+    Final coefficients of all the equations (e.g. of the whole generation or Pareto front) in one batched solve
+    over the shared term columns. If the columns of the batch do not fit into the TermGram, it is solved
+    in the several batches. Sets ``weights_final`` of the equations and returns their weighted RSS.
+    '''
+    problems, weight_idxs, coeffs, rss = [], [], [], []
+    pinned = set()
+    for equation in equations:
+        try:
+            features, target, idxs = equation_problem(gram, equation, term_values, all_terms, pinned)
+        except MemoryError:
+            if not problems:
+                raise
+            batch_coeffs, batch_rss = gram.solve(problems)
+            coeffs.extend(batch_coeffs)
+            rss.append(batch_rss)
+            problems, pinned = [], set()
+            features, target, idxs = equation_problem(gram, equation, term_values, all_terms, pinned)
+        problems.append((features, target))
+        weight_idxs.append(idxs)
+    batch_coeffs, batch_rss = gram.solve(problems)
+    coeffs.extend(batch_coeffs)
+    rss = np.concatenate(rss + [batch_rss,])
+    for equation, equation_coeffs, idxs in zip(equations, coeffs, weight_idxs):
+        weights = np.zeros(len(equation.structure))
+        weights[idxs] = equation_coeffs[:-1]
+        weights[-1] = equation_coeffs[-1]
+        equation.weights_final = weights
+        equation.weights_final_evald = True
+    return rss
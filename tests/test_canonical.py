@@ -0,0 +1,38 @@
+from canonical import EquationMemo, canonical_form, equation_hash, parse_equation_text
+
+KDV = {'u' : '-6.0012 * u{power: 1.0} * du/dx2{power: 1.0} + -0.9987 * d^3u/dx2^3{power: 1.0} + 0.0 = du/dx1{power: 1.0}'}
+
+
+def test_parse_equation_text():
+    terms, target = parse_equation_text('2.0 * b * a + -1.5 * c + 0.3 = d')
+    assert terms == {'a * b' : 2.0, 'c' : -1.5, '1' : 0.3} and target == 'd'
+
+
+def test_canonical_form_ignores_order_and_small_terms():
+    reordered = {'u' : '-0.9987 * d^3u/dx2^3{power: 1.0} + 1e-07 * u{power: 2.0} + 0.0 + '
+                       '-6.0012 * du/dx2{power: 1.0} * u{power: 1.0} = du/dx1{power: 1.0}'}
+    assert canonical_form(reordered) == canonical_form(KDV)
+    assert equation_hash(reordered) == equation_hash(KDV)
+
+
+def test_canonical_form_round_trip():
+    (var, target, terms), = canonical_form(KDV)
+    text_form = ' + '.join([f'{coeff} * {term}' if term != '1' else str(coeff) for term, coeff in terms])
+    assert canonical_form({var : text_form + ' = ' + target}) == canonical_form(KDV)
+    assert canonical_form(KDV[var]) == canonical_form(KDV)
+
+
+def test_equation_hash_distinguishes_systems():
+    other = {'u' : KDV['u'].replace('-6.0012', '-3.0')}
+    assert equation_hash(other) != equation_hash(KDV)
+    assert equation_hash(KDV, significant_digits = 5) != equation_hash({'u' : KDV['u'].replace('-6.0012', '-6.0')},
+                                                                      significant_digits = 5)
+
+
+def test_equation_memo_reuses_results():
+    memo, calls = EquationMemo(), []
+    evaluate = lambda: calls.append(1) or len(calls)
+    assert memo.evaluate(KDV, evaluate, context = 0.01) == 1
+    assert memo.evaluate({'u' : KDV['u'].replace('-6.0012', '-6.0')}, evaluate, context = 0.01) == 1
+    assert memo.evaluate(KDV, evaluate, context = 0.05) == 2
+    assert (memo.hits, memo.misses) == (1, 2)
@@ -0,0 +1,73 @@
+import time
+
+import pytest
+
+from job_queue import Heartbeat, JobQueue, experiment_cells, run_isolated, run_worker
+
+
+def square_cell(cell: dict):
+    if cell['attempt'] < 0:
+        raise ValueError('negative attempt')
+    return {'square' : cell['magnitude']**2}
+
+
+def stalled_cell(cell: dict):
+    time.sleep(60.)
+
+
+@pytest.fixture
+def queue(tmp_path):
+    with JobQueue(str(tmp_path / 'queue.db'), stale_after = 0.2, max_tries = 2) as queue:
+        yield queue
+
+
+def test_cells_are_claimed_once_in_order(queue):
+    cells = experiment_cells(['kdv'], ['epde'], [0., 0.01], 2)
+    assert queue.add_cells(cells) == 4 and queue.add_cells(cells[:2]) == 0
+    claimed = [queue.claim('a'), queue.claim('b'), queue.claim('a'), queue.claim('b')]
+    assert [cell for _, cell in claimed] == cells
+    assert queue.claim('a') is None
+    assert queue.status() == {'running' : 4}
+
+
+def test_failed_cell_is_retried_up_to_max_tries(queue):
+    queue.add_cells(experiment_cells(['kdv'], ['sindy'], [0.], 1))
+    job_id, _ = queue.claim('a')
+    queue.fail(job_id, 'a', 'error')
+    assert queue.status() == {'pending' : 1}
+    assert queue.claim('b')[0] == job_id
+    queue.fail(job_id, 'b', 'error')
+    assert queue.status() == {'failed' : 1} and queue.claim('a') is None
+
+
+def test_stale_cell_is_requeued_to_other_worker(queue):
+    queue.add_cells(experiment_cells(['kdv'], ['epde'], [0.], 1))
+    job_id, _ = queue.claim('a')
+    assert queue.claim('b') is None # heartbeat is fresh
+    time.sleep(0.3)
+    assert queue.claim('b')[0] == job_id
+    assert not queue.heartbeat(job_id, 'a') and queue.heartbeat(job_id, 'b')
+    queue.complete(job_id, 'a', {'late' : True}) # the lost worker can not overwrite the cell
+    assert queue.status() == {'running' : 1}
+    time.sleep(0.3)
+    assert queue.requeue_stale() == 0 and queue.status() == {'failed' : 1} # lost after max_tries claims
+
+
+def test_run_worker_completes_and_fails_cells(tmp_path):
+    path = str(tmp_path / 'queue.db')
+    with JobQueue(path, max_tries = 1) as queue:
+        queue.add_cells(experiment_cells(['kdv'], ['sindy'], [0.5, 2.], 1) + [{'magnitude' : 1., 'attempt' : -1}])
+    assert run_worker(path, square_cell, worker = 'a', heartbeat_interval = 1., max_tries = 1) == 2
+    with JobQueue(path) as queue:
+        assert [result for _, result in queue.results()] == [{'square' : 0.25}, {'square' : 4.}]
+        assert queue.status() == {'done' : 2, 'failed' : 1}
+
+
+def test_lost_cell_process_is_terminated(queue):
+    queue.add_cells(experiment_cells(['kdv'], ['epde'], [0.], 1))
+    job_id, cell = queue.claim('a')
+    start = time.time()
+    with Heartbeat(queue, job_id, 'a', interval = 30.) as heartbeat:
+        heartbeat.lost = True
+        status, result = run_isolated(stalled_cell, cell, heartbeat, poll_interval = 0.1)
+    assert (status, result) == ('lost', None) and time.time() - start < 30.
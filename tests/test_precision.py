@@ -0,0 +1,33 @@
+import os
+
+import numpy as np
+import pytest
+
+from precision import precision_discrepancy
+from sindy_tools import stlsq
+from weak_form import weak_form_system
+
+# float32 rounding (~1.2e-7) is summed, not amplified, by the weak form integrals: the discrepancy
+# of the system and of the discovered coefficients stays far below the noise magnitudes of the experiments
+SYSTEM_TOLERANCE = 1e-6
+COEFFICIENTS_TOLERANCE = 1e-4
+
+DATASETS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'datasets')
+
+
+@pytest.fixture
+def kdv_training():
+    loadmat = pytest.importorskip('scipy.io').loadmat
+    data = loadmat(os.path.join(DATASETS, 'kdv', 'kdv.mat'))
+    t, x = np.ravel(data['t']), np.ravel(data['x'])
+    return np.real(data['usol']).T[:200, ...], t[:200], x
+
+
+def test_weak_form_system_in_single_precision(kdv_training):
+    discrepancy = precision_discrepancy(lambda u, t, x: weak_form_system(u, t, x)[:2], *kdv_training)
+    assert discrepancy < SYSTEM_TOLERANCE
+
+
+def test_weak_sindy_coefficients_in_single_precision(kdv_training):
+    discover = lambda u, t, x: stlsq(*weak_form_system(u, t, x)[:2], threshold = 0.1, alpha = 1e-5)
+    assert precision_discrepancy(discover, *kdv_training) < COEFFICIENTS_TOLERANCE
@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('epde')
+
+from preprocessing import PeriodicSpectralDeriv, periodic_spectral_derivatives, spectral_filter
+from grids import broadcast_grids
+
+
+@pytest.mark.parametrize('n_points', [64, 65])
+def test_spectral_derivatives_of_periodic_function(n_points):
+    x = np.linspace(0., 2. * np.pi, n_points, endpoint = False)
+    u = np.sin(3. * x) + 0.5 * np.cos(x)
+    derivs = periodic_spectral_derivatives(u, x, 3)
+    analytic = [3. * np.cos(3. * x) - 0.5 * np.sin(x), -9. * np.sin(3. * x) - 0.5 * np.cos(x),
+                -27. * np.cos(3. * x) + 0.5 * np.sin(x)]
+    for deriv, reference in zip(derivs, analytic):
+        np.testing.assert_allclose(deriv, reference, atol = 1e-9)
+
+
+def test_spectral_filter_keeps_resolved_modes():
+    wavenumbers = np.arange(33.)
+    assert np.all(spectral_filter(wavenumbers) == 1.)
+    assert spectral_filter(wavenumbers, 'sharp')[-1] == 0.
+    assert spectral_filter(wavenumbers, 'exponential')[3] > 1. - 1e-4
+
+
+def test_periodic_spectral_deriv_layout():
+    t = np.linspace(0., 1., 101)
+    x = np.linspace(0., 2. * np.pi, 64, endpoint = False)
+    grids = broadcast_grids(t, x)
+    u = np.exp(-t)[:, None] * np.sin(2. * x)[None, :]
+    derivs = PeriodicSpectralDeriv()(u, grids, max_order = (1, 2), periodic_axes = (1,))
+    assert derivs.shape == (u.size, 3)
+    np.testing.assert_allclose(derivs[:, 0], (-u).reshape(-1), atol = 1e-3) # second order finite differences in t
+    np.testing.assert_allclose(derivs[:, 1], (2. * np.exp(-t)[:, None] * np.cos(2. * x)[None, :]).reshape(-1),
+                               atol = 1e-9)
+    np.testing.assert_allclose(derivs[:, 2], (-4. * u).reshape(-1), atol = 1e-9)
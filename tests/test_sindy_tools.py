@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+
+from sindy_tools import ensemble_statistics, ensemble_stlsq, replicate_rows, stlsq, stlsq_normal
+from workers import SharedArray
+
+
+@pytest.fixture
+def library():
+    rng = np.random.default_rng(0)
+    theta = np.column_stack([np.ones(2000), rng.standard_normal((2000, 5))])
+    coefs = np.array([[0., 1.5, 0., -2., 0., 0.], [0.3, 0., 0., 0., 0.8, 0.]])
+    return theta, theta @ coefs.T + 0.01 * rng.standard_normal((2000, 2)), coefs
+
+
+def test_stlsq_recovers_sparse_coefficients(library):
+    theta, target, coefs = library
+    fitted = stlsq(theta, target, threshold = 0.1)
+    np.testing.assert_array_equal(fitted != 0, coefs != 0)
+    np.testing.assert_allclose(fitted, coefs, atol = 2e-3)
+    np.testing.assert_allclose(stlsq_normal(theta.T @ theta, theta.T @ target), fitted)
+
+
+def test_replicate_rows():
+    rng = np.random.default_rng(1)
+    assert replicate_rows(100, rng).shape == (100,)
+    rows = replicate_rows(100, rng, 'subsample', 0.6)
+    assert rows.shape == (60,) and np.unique(rows).size == 60 and np.all(np.diff(rows) > 0)
+    with pytest.raises(NotImplementedError):
+        replicate_rows(100, rng, 'jackknife')
+
+
+def test_ensemble_is_reproducible_across_processes(library):
+    theta, target, coefs = library
+    with SharedArray(theta) as theta_shared, SharedArray(target) as target_shared:
+        sequential = ensemble_stlsq(theta_shared, target_shared, replicates = 8, processes = 1, seed = 2)
+        parallel = ensemble_stlsq(theta_shared, target_shared, replicates = 8, processes = 2, seed = 2)
+    assert sequential.shape == (8, 2, 6)
+    np.testing.assert_allclose(parallel, sequential)
+    coef, inclusion, low, high = ensemble_statistics(sequential)
+    np.testing.assert_array_equal(inclusion, (coefs != 0).astype(float))
+    np.testing.assert_allclose(coef, coefs, atol = 2e-3)
+    assert np.all(low <= coef) and np.all(coef <= high)
@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+
+from sketching import SKETCH_METHODS, RowSketch, approximate_leverage, sketched_regression
+
+
+@pytest.fixture
+def regression():
+    rng = np.random.default_rng(0)
+    theta = np.column_stack([rng.standard_normal((20000, 4)), np.ones(20000)])
+    coeffs = np.array([1., -2., 0.5, 3., 0.1])
+    return theta, theta @ coeffs + 0.01 * rng.standard_normal(20000)
+
+
+@pytest.mark.parametrize('method', SKETCH_METHODS)
+def test_sketch_is_linear_map_of_rows(method, regression):
+    theta, target = regression
+    theta, target = theta[:2000], target[:2000]
+    sketch = RowSketch(2000, 200, method, seed = 1, theta = theta)
+    sketched = sketch.apply(theta)
+    assert sketched.shape == (200, theta.shape[1])
+    np.testing.assert_allclose(sketched[:, 2], sketch.apply(theta[:, 2]))
+    np.testing.assert_allclose(sketch.apply(2. * target - theta[:, 0]), 2. * sketch.apply(target) - sketched[:, 0],
+                               atol = 1e-10)
+
+
+@pytest.mark.parametrize('method', SKETCH_METHODS)
+def test_sketched_least_squares_close_to_full(method, regression):
+    theta, target = regression
+    if method == 'gaussian':
+        theta, target = theta[:4000], target[:4000]
+    full = np.linalg.lstsq(theta, target, rcond = None)[0]
+    sketch = RowSketch(theta.shape[0], 2000, method, seed = 2, theta = theta)
+    sketched = np.linalg.lstsq(sketch.apply(theta), sketch.apply(target), rcond = None)[0]
+    assert np.linalg.norm(sketched - full) < 0.05 * np.linalg.norm(full)
+
+
+def test_leverage_scores(regression):
+    theta, _ = regression
+    exact = np.sum(np.linalg.qr(theta)[0]**2, axis = 1)
+    approximate = approximate_leverage(theta, oversampling = 40, seed = 3)
+    assert np.isclose(approximate.sum(), theta.shape[1], rtol = 0.3)
+    assert np.corrcoef(exact, approximate)[0, 1] > 0.95
+
+
+def test_sketched_regression(regression):
+    theta, target = regression
+    full = np.linalg.lstsq(theta, target, rcond = None)[0]
+    theta_s, target_s, coeffs = sketched_regression(theta, target, tol = 0.02, seed = 4)
+    assert theta_s.shape[0] < theta.shape[0] and target_s.shape == (theta_s.shape[0],)
+    assert np.linalg.norm(coeffs - full) < 0.1 * np.linalg.norm(full)
+
+
+def test_sketched_term_gram(regression):
+    from term_gram import TermGram
+
+    theta, target = regression
+    gram = TermGram(theta.shape[0], sketch = RowSketch(theta.shape[0], 4000, 'countsketch', seed = 5))
+    features = [gram.add(idx, theta[:, idx]) for idx in range(4)]
+    coeffs, _ = gram.solve([(features + [gram.constant,], gram.add('target', target))])
+    full = np.linalg.lstsq(theta, target, rcond = None)[0]
+    assert np.linalg.norm(coeffs[0] - full) < 0.05 * np.linalg.norm(full)
+
+
+def test_sketched_sparse_regression_matches_full():
+    from sindy_tools import stlsq
+
+    rng = np.random.default_rng(6)
+    theta = rng.standard_normal((50000, 8))
+    coeffs = np.array([0., -6., 0., 1., 0., 0., 0.4, 0.])
+    target = theta @ coeffs + 0.05 * rng.standard_normal(50000)
+    full = stlsq(theta, target, threshold = 0.1)[0]
+    theta_s, target_s, _ = sketched_regression(theta, target, method = 'leverage', tol = 0.01, seed = 7)
+    sketched = stlsq(theta_s, target_s, threshold = 0.1)[0]
+    np.testing.assert_array_equal(sketched != 0, full != 0)
+    assert np.linalg.norm(sketched - full) < 0.02 * np.linalg.norm(full)
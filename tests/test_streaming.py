@@ -0,0 +1,90 @@
+import numpy as np
+import pytest
+
+from streaming import NormalEquations, token_values, term_values
+from sliding_window import SlidingTermMatrix, equation_terms
+
+EQUATION = '0.0 * u{power: 2.0} + 1.9 * u{power: 1.0} + 0.5 * v{power: 1.0} + 0.0 = du/dx1{power: 1.0}'
+
+
+def test_normal_equations_match_lstsq():
+    rng = np.random.default_rng(0)
+    theta, target = rng.standard_normal((1000, 4)), rng.standard_normal((1000, 2))
+    normal = NormalEquations(4, 2)
+    for start in range(0, 1000, 128):
+        normal.add(theta[start:start + 128], target[start:start + 128])
+    coeffs, residuals, _, _ = np.linalg.lstsq(theta, target, rcond = None)
+    np.testing.assert_allclose(normal.solve(), coeffs, atol = 1e-10)
+    np.testing.assert_allclose(normal.rss(coeffs), residuals, rtol = 1e-8)
+    assert normal.n_rows == 1000
+
+
+def test_normal_equations_badly_scaled_columns():
+    rng = np.random.default_rng(1)
+    theta = rng.standard_normal((500, 3)) * np.array([1e-4, 1., 1e4])
+    target = theta @ np.array([2e3, -1., 3e-4])
+    normal = NormalEquations(3)
+    normal.add(theta, target)
+    np.testing.assert_allclose(normal.solve()[:, 0], [2e3, -1., 3e-4], rtol = 1e-6)
+
+
+def tokens(t):
+    u, v = np.exp(np.sin(t)), np.cos(3. * t)
+    return token_values(np.stack([u, v], axis = 1), np.stack([np.cos(t) * u, -3. * np.sin(3. * t)])[..., None],
+                        ['u', 'v'])
+
+
+def test_term_values():
+    t = np.linspace(0., 1., 50)
+    values = tokens(t)
+    np.testing.assert_allclose(term_values('u{power: 2.0} * dv/dx1{power: 1.0}', values),
+                               values['u']**2 * values['dv/dx1'])
+    with pytest.raises(KeyError):
+        term_values('w{power: 1.0}', values)
+
+
+def window_columns(matrix, tokens_values, n_rows):
+    return np.stack([np.ones(n_rows) if term == '1' else term_values(term, tokens_values) for term in matrix.terms],
+                    axis = 1)
+
+
+@pytest.mark.parametrize('refresh', [1, 3, 64])
+def test_sliding_term_matrix_shift(refresh):
+    t = np.linspace(0., 10., 1000)
+    window, stride = 200, 30
+    matrix = SlidingTermMatrix(window, refresh)
+    matrix.add_terms(equation_terms(EQUATION), tokens(t[:window]))
+    for start in range(stride, 500, stride):
+        matrix.shift(tokens(t[start + window - stride:start + window]), stride)
+        columns = window_columns(matrix, tokens(t[start:start + window]), window)
+        np.testing.assert_allclose(matrix.columns, columns)
+        np.testing.assert_allclose(matrix.gram, columns.T @ columns, rtol = 1e-9, atol = 1e-9)
+
+
+def test_sliding_fit_keeps_sparsity():
+    t = np.linspace(0., 10., 200)
+    values = tokens(t)
+    values['du/dx1'] = 1.5 * values['u'] - 0.7 * values['v'] + 0.2 + 0.01 * np.sin(40. * t)
+    matrix = SlidingTermMatrix(200)
+    matrix.add_terms(equation_terms(EQUATION), values)
+    assert 'u{power: 2.0}' not in matrix.terms
+
+    refitted, rms = matrix.fit(EQUATION)
+    theta = np.stack([values['u'], values['v'], np.ones(200)], axis = 1)
+    coeffs, residuals, _, _ = np.linalg.lstsq(theta, values['du/dx1'], rcond = None)
+    assert refitted.count(' * ') == 2 and 'u{power: 2.0}' not in refitted
+    np.testing.assert_allclose([float(term.split(' * ')[0]) for term in refitted.split(' = ')[0].split(' + ')],
+                               coeffs, rtol = 1e-8)
+    np.testing.assert_allclose(rms, np.sqrt(residuals[0] / 200), rtol = 1e-6)
+
+
+def test_stream_refit_keeps_sparsity():
+    pytest.importorskip('epde') # derivatives of the windows are taken by the preprocessing module
+    from streaming import ChunkedSeries, stream_refit
+
+    t = np.linspace(0., 1., 2001)
+    stream = ChunkedSeries(t, np.exp(2. * t)[:, None], window = 500)
+    refitted, rms = stream_refit({'u' : '0.0 * u{power: 2.0} + 1.9 * u{power: 1.0} + 0.0 = du/dx1{power: 1.0}'},
+                                 stream, variable_names = ['u',])
+    assert 'u{power: 2.0}' not in refitted['u']
+    assert abs(float(refitted['u'].split(' * ')[0]) - 2.) < 1e-5 and rms['u'] < 1e-5
@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+
+from synthetic_data import generate_burgers, generate_kdv, generate_lotka_volterra, load_dataset
+
+
+def test_kdv_conserves_mass_and_energy(tmp_path):
+    t, x, u = generate_kdv(str(tmp_path / 'kdv'), n_x = 256, n_t = 21, t_max = 4., seed = 0)
+    dx = x[1] - x[0]
+    mass, energy = np.sum(u, axis = 1) * dx, np.sum(u**2, axis = 1) * dx
+    np.testing.assert_allclose(mass, mass[0], rtol = 1e-10)
+    np.testing.assert_allclose(energy, energy[0], rtol = 1e-3)
+    assert not np.allclose(u[-1], u[0]) # the solitons move
+
+
+def test_burgers_conserves_mass_and_dissipates(tmp_path):
+    t, x, u = generate_burgers(str(tmp_path / 'burgers'), n_x = 128, n_t = 11, t_max = 2., seed = 0)
+    dx = x[1] - x[0]
+    mass, energy = np.sum(u, axis = 1) * dx, np.sum(u**2, axis = 1) * dx
+    np.testing.assert_allclose(mass, mass[0], rtol = 1e-10)
+    assert np.all(np.diff(energy) < 0.)
+
+
+def test_lotka_volterra_first_integral(tmp_path):
+    pytest.importorskip('scipy')
+    a, b, c, d = 20., 20., 20., 20.
+    _, u = generate_lotka_volterra(str(tmp_path / 'lv'), n_t = 101, seed = 0)
+    integral = d * u[:, 0] - c * np.log(u[:, 0]) + b * u[:, 1] - a * np.log(u[:, 1])
+    np.testing.assert_allclose(integral, integral[0], rtol = 1e-7)
+
+
+def test_dataset_round_trip(tmp_path):
+    t, x, u = generate_kdv(str(tmp_path / 'kdv'), n_x = 64, n_t = 5, t_max = 0.5, seed = 1, dtype = np.float32)
+    coords, loaded, meta = load_dataset(str(tmp_path / 'kdv'))
+    assert isinstance(loaded, np.memmap) and loaded.dtype == np.float32
+    np.testing.assert_array_equal(coords[0], t)
+    np.testing.assert_array_equal(coords[1], x)
+    np.testing.assert_array_equal(loaded, u)
+    assert meta['equation'] == 'kdv' and meta['coords'] == ['t', 'x'] and meta['seed'] == 1
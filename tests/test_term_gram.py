@@ -0,0 +1,98 @@
+import numpy as np
+import pytest
+
+from term_gram import TermGram, fit_population
+
+
+class Term(object):
+    def __init__(self, label):
+        self.cache_label = label
+
+
+class Equation(object):
+    '''
+    Minimal stand-in of the epde Equation: the structure of the labelled terms and the weights of LASSO.
+    '''
+    def __init__(self, labels, target_idx, weights_internal = None):
+        self.structure = [Term(label) for label in labels]
+        self.target_idx = target_idx
+        self.weights_internal = np.ones(len(labels)) if weights_internal is None else np.array(weights_internal)
+
+
+def reference_fit(columns, equation, weights = None):
+    features = [idx for idx in range(len(equation.structure)) if idx != equation.target_idx]
+    features = [idx for idx in features if equation.weights_internal[idx if idx < equation.target_idx else idx - 1]]
+    n_points = columns['t0'].size
+    theta = np.stack([columns[equation.structure[idx].cache_label] for idx in features] + [np.ones(n_points),], axis = 1)
+    target = columns[equation.structure[equation.target_idx].cache_label]
+    sqrt_w = np.ones(n_points) if weights is None else np.sqrt(weights)
+    coeffs, _, _, _ = np.linalg.lstsq(theta * sqrt_w[:, None], target * sqrt_w, rcond = None)
+    return coeffs, np.sum(weights_or_ones(weights, n_points) * (theta @ coeffs - target)**2)
+
+
+def weights_or_ones(weights, n_points):
+    return np.ones(n_points) if weights is None else weights
+
+
+@pytest.fixture
+def columns():
+    rng = np.random.default_rng(0)
+    return {f't{idx}' : rng.standard_normal(300) for idx in range(6)}
+
+
+def fit_and_compare(equations, gram, columns, weights = None):
+    rss = fit_population(equations, gram, lambda term: columns[term.cache_label])
+    for equation, equation_rss in zip(equations, rss):
+        coeffs, reference_rss = reference_fit(columns, equation, weights)
+        nonzero = [idx for idx in range(len(equation.structure) - 1) if equation.weights_internal[idx]]
+        np.testing.assert_allclose(equation.weights_final[nonzero + [-1,]], coeffs, atol = 1e-8)
+        np.testing.assert_allclose(equation_rss, reference_rss, rtol = 1e-6)
+
+
+def test_solve_matches_lstsq(columns):
+    equations = [Equation(['t0', 't1', 't2'], 2), Equation(['t3', 't4', 't5'], 0), Equation(['t1', 't5', 't0'], 1)]
+    fit_and_compare(equations, TermGram(300), columns)
+
+
+def test_weighted_solve_matches_lstsq(columns):
+    weights = np.random.default_rng(1).uniform(0.1, 1., 300)
+    equations = [Equation(['t0', 't1', 't2', 't3'], 1)]
+    fit_and_compare(equations, TermGram(300, weights), columns, weights)
+
+
+def test_zero_weights_stay_out(columns):
+    equation = Equation(['t0', 't1', 't2', 't3'], 3, [1., 0., 1.])
+    fit_and_compare([equation,], TermGram(300), columns)
+    assert equation.weights_final[1] == 0
+
+
+def test_collinear_features(columns):
+    columns = dict(columns, t5 = 2. * columns['t0'])
+    equation = Equation(['t0', 't5', 't1'], 2)
+    rss = fit_population([equation,], TermGram(300), lambda term: columns[term.cache_label])
+    theta = np.stack([columns['t0'], columns['t5'], np.ones(300)], axis = 1)
+    coeffs = np.linalg.lstsq(theta, columns['t1'], rcond = None)[0]
+    np.testing.assert_allclose(theta @ equation.weights_final, theta @ coeffs, atol = 1e-8)
+    np.testing.assert_allclose(rss[0], np.sum((theta @ coeffs - columns['t1'])**2), rtol = 1e-6)
+    # minimum norm solution of the diagonally scaled problem: equal contributions of the scaled columns
+    np.testing.assert_allclose(equation.weights_final[0], 2. * equation.weights_final[1])
+
+
+def test_eviction_keeps_batch_columns(columns):
+    # room for the constant and four term columns: the batch of three equations uses all six terms
+    gram = TermGram(300, max_bytes = 8 * 300 * 5)
+    equations = [Equation(['t0', 't1', 't2'], 2), Equation(['t3', 't4', 't5'], 0), Equation(['t1', 't5', 't0'], 1)]
+    fit_and_compare(equations, gram, columns)
+    assert len(gram) <= gram.max_columns
+
+
+def test_batch_larger_than_memory_raises(columns):
+    gram = TermGram(300, max_bytes = 8 * 300 * 3)
+    with pytest.raises(MemoryError):
+        fit_population([Equation(['t0', 't1', 't2', 't3'], 3),], gram, lambda term: columns[term.cache_label])
+
+
+def test_evicted_columns_are_recomputed(columns):
+    gram = TermGram(300, max_bytes = 8 * 300 * 4)
+    for equation in [Equation(['t0', 't1', 't2'], 2), Equation(['t3', 't4', 't5'], 0), Equation(['t0', 't1', 't2'], 2)]:
+        fit_and_compare([equation,], gram, columns)
@@ -0,0 +1,91 @@
+import multiprocessing
+
+import numpy as np
+
+from token_cache import SharedTermStore, load_shared_terms, save_shared_terms
+
+
+class StandInCache(object):
+    '''
+    The entries of the epde tensor cache, used by the term sharing: {(label, normalized) : tensor}.
+    '''
+    def __init__(self):
+        self.memory = {}
+        self.base_tensors = set()
+
+    def __contains__(self, obj):
+        return obj in self.memory
+
+    def add(self, label, tensor, normalized = False):
+        self.memory[(label, normalized)] = tensor
+        return True
+
+    def get(self, label, normalized = False):
+        return self.memory[(label, normalized)]
+
+
+class StandInTerm(object):
+    def __init__(self, cache_label):
+        self.cache_label = cache_label
+
+
+LABELS = [(('u', (1.0,)), ('du/dx1', (1.0,))), (('u', (2.0,)),), (('u', (1.0,)), ('d^3u/dx1^3', (1.0,)))]
+
+
+def search_step(directory: str):
+    '''
+    Evaluation of the terms in the fresh process, as in PopulationFitness: the cache is filled from the store,
+    the missing terms are evaluated and written back. Returns the number of evaluations, store hits and the sums.
+    '''
+    store, cache = SharedTermStore(directory), StandInCache()
+    terms = [StandInTerm(label) for label in LABELS]
+    load_shared_terms(store, 'data', terms, cache)
+    evaluations = 0
+    for idx, term in enumerate(terms):
+        for normalized in (False, True):
+            if (term.cache_label, normalized) not in cache:
+                evaluations += 1
+                values = np.linspace(0., idx + 1., 1000)
+                cache.add(term.cache_label, values - values.mean() if normalized else values, normalized = normalized)
+    save_shared_terms(store, 'data', terms, cache)
+    return evaluations, store.hits, [float(np.sum(cache.get(term.cache_label))) for term in terms]
+
+
+def test_second_process_hits_store(tmp_path):
+    context = multiprocessing.get_context('spawn')
+    results = []
+    for _ in range(2):
+        with context.Pool(1) as pool:
+            results.append(pool.apply(search_step, (str(tmp_path),)))
+    (first_evaluations, first_hits, first_sums), (second_evaluations, second_hits, second_sums) = results
+    assert first_evaluations == 2 * len(LABELS) and first_hits == 0
+    assert second_evaluations == 0 and second_hits == 2 * len(LABELS)
+    assert np.allclose(first_sums, second_sums)
+
+
+def test_base_tensors_are_not_shared(tmp_path):
+    store, cache = SharedTermStore(str(tmp_path)), StandInCache()
+    term = StandInTerm(('u', (1.0,)))
+    cache.base_tensors.add(term.cache_label)
+    cache.add(term.cache_label, np.ones(10))
+    assert save_shared_terms(store, 'data', [term,], cache) == 0
+    assert store.nbytes() == 0
+
+
+def test_grids_fingerprint_is_memoized(monkeypatch):
+    import token_cache
+    from grids import broadcast_grids
+
+    hashed = []
+    hash_grids = token_cache._hash_grids
+    monkeypatch.setattr(token_cache, '_hash_grids', lambda grids: hashed.append(1) or hash_grids(grids))
+    t, x = np.linspace(0., 1., 50), np.linspace(0., 2., 80)
+    grids = broadcast_grids(t, x)
+    fingerprint = token_cache.grids_fingerprint(grids)
+    assert token_cache.grids_fingerprint(grids) == fingerprint and len(hashed) == 1
+
+    same = broadcast_grids(t.copy(), x.copy())
+    assert token_cache.grids_fingerprint(same) == fingerprint and len(hashed) == 2
+    assert token_cache.grids_fingerprint(broadcast_grids(t, 2. * x)) != fingerprint
+    del grids, same
+    assert token_cache.grids_fingerprint(broadcast_grids(t, x)) == fingerprint and len(hashed) == 4
@@ -0,0 +1,43 @@
+import os
+
+import numpy as np
+import pytest
+
+from sindy_tools import stlsq
+import weak_form
+from weak_form import expand_derivative, fft_correlate, weak_equation_text, weak_form_system
+
+DATASETS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'datasets')
+
+
+def test_fft_correlate_matches_direct():
+    rng = np.random.default_rng(0)
+    data, kernels = rng.standard_normal((7, 50)), rng.standard_normal((3, 9))
+    direct = np.stack([[np.correlate(row, kernel, mode = 'valid') for row in data] for kernel in kernels])
+    np.testing.assert_allclose(fft_correlate(data, kernels, axis = 1), direct, atol = 1e-10)
+
+
+def test_test_function_derivatives_vanish_on_edges():
+    phi = weak_form.test_function(61, 0.1, power = 5, max_order = 3)
+    np.testing.assert_allclose(phi[:, [0, -1]], 0., atol = 1e-12)
+    np.testing.assert_allclose(np.gradient(phi[0], 0.1), phi[1], atol = 1e-2 * np.abs(phi[1]).max())
+
+
+def test_expand_derivative():
+    assert expand_derivative(2, 1) == {((0, 1), (1, 1)) : 2.}
+    assert expand_derivative(2, 2) == {((1, 2),) : 2., ((0, 1), (2, 1)) : 2.}
+
+
+def test_weak_form_recovers_kdv():
+    loadmat = pytest.importorskip('scipy.io').loadmat
+    data = loadmat(os.path.join(DATASETS, 'kdv', 'kdv.mat'))
+    t, x, u = np.ravel(data['t'])[:200], np.ravel(data['x']), np.real(data['usol']).T[:200, ...]
+    G, b, labels = weak_form_system(u, t, x)
+    coeffs = stlsq(G, b, threshold = 0.1, alpha = 1e-5)[0]
+    # u_t = -u_xxx - 3 (u^2)_x, i.e. u_t + 6 u u_x + u_xxx = 0
+    expected = {(1, 3) : -1., (2, 1) : -3.}
+    for label, coeff in zip(labels, coeffs):
+        assert np.isclose(coeff, expected.get(label, 0.), atol = 1e-2)
+    text_form = weak_equation_text(coeffs, labels)
+    assert text_form.endswith(' = du/dx1{power: 1.0}')
+    assert 'u{power: 1.0} * du/dx2{power: 1.0}' in text_form and 'd^3u/dx2^3{power: 1.0}' in text_form
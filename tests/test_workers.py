@@ -0,0 +1,59 @@
+import os
+import pickle
+from multiprocessing import shared_memory
+
+import numpy as np
+import pytest
+
+from workers import THREAD_ENV_VARS, SharedArray, SharedArrays, WorkerPool, cpu_budgets, shared_value
+
+
+def thread_limits(task):
+    return task, {var : os.environ.get(var) for var in THREAD_ENV_VARS}
+
+
+def shared_sum(task):
+    shared, section = task
+    values = shared_value(shared)
+    return float(values[section].sum()), values.flags.writeable
+
+
+def test_cpu_budgets():
+    assert cpu_budgets(2, 2, [0, 1, 2, 3]) == [[0, 1], [2, 3]]
+    assert cpu_budgets(3, 2, [0, 1, 2, 3]) == [[0, 1], [2, 3], [0, 1]]
+    assert cpu_budgets(2, 4, [0, 1, 2]) == [[0, 1, 2], [0, 1, 2]]
+
+
+def test_worker_pool_limits_threads():
+    saved = {var : os.environ.get(var) for var in THREAD_ENV_VARS}
+    with WorkerPool(2, threads_per_worker = 1) as pool:
+        outputs = pool.map(thread_limits, list(range(4)))
+        summary = pool.report(verbose = False)
+    assert [task for task, _ in outputs] == list(range(4))
+    assert all([limits == {var : '1' for var in THREAD_ENV_VARS} for _, limits in outputs])
+    assert summary['tasks'] == 4 and summary['threads_per_worker'] == 1
+    assert {var : os.environ.get(var) for var in THREAD_ENV_VARS} == saved # the parent is not limited
+
+
+def test_shared_array_is_attached_by_handle():
+    data = np.arange(12.).reshape(3, 4)
+    with SharedArray(data) as shared:
+        state = pickle.dumps(shared)
+        assert len(state) < data.nbytes + 200 # the handle, not the copy of the data
+        attached = pickle.loads(state)
+        np.testing.assert_array_equal(attached.array, data)
+        assert not attached.array.flags.writeable
+        shared.array[0, 0] = -1. # the same memory
+        assert attached.array[0, 0] == -1.
+        attached.close()
+
+
+def test_shared_arrays_in_workers_and_unlink():
+    data = np.arange(100.)
+    with SharedArrays(data, 2. * data) as (first, second):
+        name = first._shm.name
+        with WorkerPool(2, threads_per_worker = 1) as pool:
+            outputs = pool.map(shared_sum, [(first, slice(0, 50)), (second, slice(50, None))])
+    assert outputs == [(float(data[:50].sum()), False), (float(2. * data[50:].sum()), False)]
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(name = name)
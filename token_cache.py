@@ -0,0 +1,262 @@
+import os
+import hashlib
+import tempfile
+import weakref
+import numpy as np
+from collections import OrderedDict
+from typing import Callable, Union
+
+try:
+    import fcntl
+except ImportError: # windows: the eviction is not synchronized between the processes
+    fcntl = None
+
+
+class TokenTensorCache(object):
+    '''
+    LRU cache of the evaluated token tensors, bounded by the total size of the stored tensors in bytes.
+    '''
+    def __init__(self, max_bytes: int = 2**29):
+        self.max_bytes = max_bytes
+        self._tensors = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        try:
+            tensor = self._tensors[key]
+        except KeyError:
+            self.misses += 1
+            return None
+        self._tensors.move_to_end(key)
+        self.hits += 1
+        return tensor
+
+    def add(self, key, tensor: np.ndarray):
+        if tensor.nbytes > self.max_bytes or key in self._tensors:
+            return False
+        while self.nbytes + tensor.nbytes > self.max_bytes:
+            _, evicted = self._tensors.popitem(last = False)
+            self.nbytes -= evicted.nbytes
+        tensor.setflags(write = False) # the tensor is shared between all the factors with the key
+        self._tensors[key] = tensor
+        self.nbytes += tensor.nbytes
+        return True
+
+    def clear(self):
+        self._tensors.clear()
+        self.nbytes = 0
+
+    def __len__(self):
+        return len(self._tensors)
+
+
+TOKEN_CACHE = TokenTensorCache()
+
+
+def _hash_grids(grids):
+    hasher = hashlib.sha1()
+    for grid in grids:
+        grid = np.asarray(grid)
+        stored = grid[tuple([0 if stride == 0 else slice(None) for stride in grid.strides])]
+        hasher.update(repr((grid.shape, grid.dtype.str, tuple([stride == 0 for stride in grid.strides]))).encode())
+        hasher.update(np.ascontiguousarray(stored).tobytes())
+    return hasher.hexdigest()[:16]
+
+
+_FINGERPRINTS = {}
+
+
+def grids_fingerprint(grids):
+    '''
+    Identifier of the grids, on which the token is evaluated: hash of the shapes, dtypes and contents. The broadcast
+    grids (see ``grids.broadcast_grids``) are hashed by their stored values only, without the dense copy.
+    The hash is computed once per set of grid arrays and then looked up by their identity (checked by the weak
+    references, so the new array at the address of the collected one is hashed anew); the grids are not
+    expected to change in place.
+    '''
+    ids = tuple([id(grid) for grid in grids])
+    memo = _FINGERPRINTS.get(ids)
+    if memo is not None and all([ref() is grid for ref, grid in zip(memo[0], grids)]):
+        return memo[1]
+    fingerprint = _hash_grids(grids)
+    try:
+        refs = tuple([weakref.ref(grid, lambda _, ids = ids: _FINGERPRINTS.pop(ids, None)) for grid in grids])
+    except TypeError: # e.g. the lists of values
+        return fingerprint
+    _FINGERPRINTS[ids] = (refs, fingerprint)
+    return fingerprint
+
+
+class CachedCustomEvaluator(object):
+    '''
+    Replacement of epde ``CustomEvaluator`` for the tokens, defined by the functions of the grids: the function is
+    called once per (label, parameters, grid) on the whole grid (thus, it has to be vectorized, e.g. composed of
+    numpy ufuncs) instead of the element-wise evaluation, and the result is stored in the shared bounded cache.
+    The subsequent evaluations of the factors during the search are the cache lookups.
+    '''
+    def __init__(self, evaluation_functions: Union[Callable, dict], eval_fun_params_labels: Union[list, tuple],
+                 cache: TokenTensorCache = None):
+        self.evaluation_functions = evaluation_functions
+        self.eval_fun_params_labels = eval_fun_params_labels
+        self.cache = cache if cache is not None else TOKEN_CACHE
+
+    def __call__(self, factor, structural: bool = False, grids: list = None, **kwargs):
+        if isinstance(self.evaluation_functions, dict):
+            if factor.label not in self.evaluation_functions.keys():
+                raise KeyError('The label of the token function does not match keys of the evaluator functions')
+            evaluation_function = self.evaluation_functions[factor.label]
+        else:
+            evaluation_function = self.evaluation_functions
+
+        eval_fun_kwargs = dict()
+        for key in self.eval_fun_params_labels:
+            for param_idx, param_descr in factor.params_description.items():
+                if param_descr['name'] == key:
+                    eval_fun_kwargs[key] = factor.params[param_idx]
+
+        if grids is None:
+            grids = factor.grids
+        cache_key = (factor.label, tuple(sorted(eval_fun_kwargs.items())), grids_fingerprint(grids))
+        value = self.cache.get(cache_key)
+        if value is None:
+            value = np.asarray(evaluation_function(*grids, **eval_fun_kwargs))
+            if value.shape != grids[0].shape: # e.g. for the broadcast views of grids
+                value = np.broadcast_to(value, grids[0].shape).copy()
+            self.cache.add(cache_key, value)
+        return value
+
+
+def data_key(*arrays):
+    '''
+    Hash of the contents of the arrays (e.g. noisy data and its derivatives): the terms, evaluated on the same
+    preprocessed data in the different attempts or processes, get the same key.
+    '''
+    hasher = hashlib.blake2b(digest_size = 16)
+    for array in arrays:
+        array = np.ascontiguousarray(array)
+        hasher.update(repr((array.shape, array.dtype.str)).encode())
+        hasher.update(array.data)
+    return hasher.hexdigest()
+
+
+class SharedTermStore(object):
+    '''
+    Term tensors, shared by all the processes on the machine: each tensor is the .npy file in ``directory``
+    (by default in /dev/shm, i.e. in RAM), which the readers open as the read-only memmap, thus the concurrent
+    discovery workers use the same pages without copies. The keys are (data key, canonical term label).
+    Files are written into the temporary ones and renamed, so a reader never sees the partial tensor. The total
+    size is bounded by ``max_bytes``: the least recently used files (by mtime, updated on reads) are evicted
+    under the lock; the readers, that have mapped the evicted tensor, keep their mapping.
+    '''
+    def __init__(self, directory: str = None, max_bytes: int = 2**30):
+        if directory is None:
+            base = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+            directory = os.path.join(base, 'epde_term_cache')
+        os.makedirs(directory, exist_ok = True)
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(repr(key).encode()).hexdigest() + '.npy')
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            tensor = np.load(path, mmap_mode = 'r')
+            os.utime(path)
+        except (FileNotFoundError, ValueError): # ValueError - the file was evicted between the opening and mapping
+            self.misses += 1
+            return None
+        self.hits += 1
+        return tensor
+
+    def add(self, key, tensor: np.ndarray):
+        tensor = np.asarray(tensor)
+        if tensor.nbytes > self.max_bytes:
+            return False
+        descriptor, temp_path = tempfile.mkstemp(dir = self.directory, suffix = '.tmp')
+        with os.fdopen(descriptor, 'wb') as temp_file:
+            np.save(temp_file, tensor)
+        os.replace(temp_path, self._path(key))
+        self._evict()
+        return True
+
+    def __contains__(self, key):
+        return os.path.exists(self._path(key))
+
+    def get_or_add(self, key, evaluate: Callable):
+        tensor = self.get(key)
+        if tensor is None:
+            tensor = np.asarray(evaluate())
+            self.add(key, tensor)
+        return tensor
+
+    def _evict(self):
+        with open(os.path.join(self.directory, '.lock'), 'w') as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            entries = []
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith('.npy'):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total = sum([size for _, size, _ in entries])
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError: # mapped file on windows
+                    pass
+
+    def nbytes(self):
+        return sum([entry.stat().st_size for entry in os.scandir(self.directory) if entry.name.endswith('.npy')])
+
+    def clear(self):
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.npy'):
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass
+
+
+def load_shared_terms(store: SharedTermStore, key: str, terms: list, cache):
+    '''
+    Fill the epde tensor cache (``global_var.tensor_cache``) with the values of the terms (plain and normalized),
+    that any process has already evaluated on the data with the ``key``: the following ``Term.evaluate``
+    calls of LASSO, coefficient calculation and fitness find them in the cache. Returns the number of loaded tensors.
+    '''
+    loaded = 0
+    for term in terms:
+        for normalized in (False, True):
+            if (term.cache_label, normalized) in cache:
+                continue
+            tensor = store.get((key, term.cache_label, normalized))
+            if tensor is not None and cache.add(term.cache_label, tensor, normalized = normalized):
+                loaded += 1
+    return loaded
+
+
+def save_shared_terms(store: SharedTermStore, key: str, terms: list, cache):
+    '''
+    Write the values of the terms, evaluated into the epde tensor cache, and missing in the store, to the store;
+    the base tensors of the data are skipped. Returns the number of the written tensors.
+    '''
+    saved = 0
+    base_tensors = getattr(cache, 'base_tensors', ())
+    for term in terms:
+        if term.cache_label in base_tensors:
+            continue
+        for normalized in (False, True):
+            if (term.cache_label, normalized) in cache and (key, term.cache_label, normalized) not in store:
+                saved += store.add((key, term.cache_label, normalized), cache.get(term.cache_label, normalized = normalized))
+    return saved
@@ -0,0 +1,127 @@
+import numpy as np
+
+from lazy_imports import lazy_import
+
+ps = lazy_import('pysindy')
+
+
+def test_function(support: int, step: float, power: int = 4, max_order: int = 0):
+    '''
+    Bump (1 - s^2)^power, s in [-1, 1], sampled on ``support`` nodes with the grid step ``step``, and its derivatives
+    by the physical coordinate up to ``max_order``: array of shape (max_order + 1, support). The derivatives up
+    to the order power - 1 vanish on the edges of the support, thus power has to exceed max_order.
+    '''
+    if power <= max_order:
+        raise ValueError(f'Test function power {power} is too low for the derivatives of order {max_order}.')
+    s = np.linspace(-1, 1, support)
+    half_width = step * (support - 1) / 2.
+    bump = np.polynomial.Polynomial([1., 0., -1.]) ** power
+    return np.stack([bump.deriv(order)(s) / half_width**order for order in range(max_order + 1)])
+
+
+def fft_correlate(data: np.ndarray, kernels: np.ndarray, axis: int):
+    '''
+    "Valid" correlation of data with each of the kernels (shape (n_kernels, m)) along the axis, computed
+    through FFT: out[k, ..., i, ...] = sum_j kernels[k, j] * data[..., i + j, ...]. Kernels form the new leading axis,
+    the length along the axis becomes n - m + 1.
+    '''
+    n, m = data.shape[axis], kernels.shape[-1]
+    nfft = n + m - 1
+    data_spectrum = np.fft.rfft(data, nfft, axis = axis)
+    shape = [1,] * data.ndim
+    shape[axis] = -1
+    kernels_spectrum = np.fft.rfft(kernels[:, ::-1], nfft, axis = -1).reshape([kernels.shape[0],] + shape)
+    convolution = np.fft.irfft(data_spectrum[np.newaxis, ...] * kernels_spectrum, nfft, axis = axis + 1)
+    return np.take(convolution, np.arange(m - 1, n), axis = axis + 1)
+
+
+def weak_form_system(u: np.ndarray, t: np.ndarray, x: np.ndarray, degree: int = 3, max_order: int = 3,
+                     support: tuple = (31, 61), stride: tuple = (4, 8), power: tuple = (4, 5)):
+    '''
+    Weak form of the library for the data u(t, x) on the uniform grid (shape (len(t), len(x))): the columns are
+    integrals of d^a/dx^a (u^k) for k <= degree, a <= max_order against the test functions phi(t) * phi(x),
+    the target is the integral of du/dt. The derivatives are moved onto the test functions, thus the noisy data
+    is never differentiated.
+
+    The test functions are centered in each ``stride`` node of the grid, where the ``support`` fits, and all the
+    integrals are obtained as the separable FFT correlations of the stacked powers of u with the derivatives of the
+    1D test functions: thousands of test functions cost a few FFTs of the data-sized arrays.
+
+    Returns: G with shape (n_test_functions, n_terms), b with shape (n_test_functions,) and labels of the
+    columns as (k, a) tuples; (0, 0) is the free term.
+    '''
+    dt, dx = t[1] - t[0], x[1] - x[0]
+    phi_t = test_function(support[0], dt, power[0], max_order = 1)
+    phi_x = test_function(support[1], dx, power[1], max_order = max_order)
+
+    powers = np.stack([u**k for k in range(degree + 1)])
+    integrals_x = fft_correlate(powers, phi_x, axis = 2)[..., ::stride[1]] * dx # (order, k, t, x_test)
+    integrals = fft_correlate(integrals_x, phi_t, axis = 2)[:, :, :, ::stride[0], :] * dt # (t_order, order, k, t_test, x_test)
+
+    labels = [(0, 0),] + [(k, order) for k in range(1, degree + 1) for order in range(max_order + 1)]
+    G = np.stack([(-1)**order * integrals[0, order, k].ravel() for k, order in labels], axis = 1)
+    b = -integrals[1, 0, 1].ravel()
+    return G, b, labels
+
+
+def weak_sindy_pde(u: np.ndarray, t: np.ndarray, x: np.ndarray, threshold: float = 0.1, alpha: float = 1e-5,
+                   **system_kwargs):
+    '''
+    Sparse regression on the weak form system with the STLSQ of pysindy. The threshold is applied to the
+    coefficients of the equation itself (the columns are not normalized). Returns the coefficients and
+    labels of the columns.
+    '''
+    G, b, labels = weak_form_system(u, t, x, **system_kwargs)
+    optimizer = ps.STLSQ(threshold = threshold, alpha = alpha)
+    optimizer.fit(G, b)
+    return np.ravel(optimizer.coef_), labels
+
+
+def expand_derivative(power: int, order: int):
+    '''
+    d^order/dx^order (u^power) by the product rule: dict {monomial : coefficient}, where the monomial is the sorted
+    tuple of (derivative order, power) pairs of the factors.
+    '''
+    terms = {((0, power),) : 1.}
+    for _ in range(order):
+        differentiated = {}
+        for monomial, coeff in terms.items():
+            for deriv, factor_power in monomial:
+                factors = dict(monomial)
+                factors[deriv] -= 1
+                if factors[deriv] == 0:
+                    del factors[deriv]
+                factors[deriv + 1] = factors.get(deriv + 1, 0) + 1
+                key = tuple(sorted(factors.items()))
+                differentiated[key] = differentiated.get(key, 0.) + coeff * factor_power
+        terms = differentiated
+    return terms
+
+
+def _factor_name(deriv: int, power: int, var: str = 'u', axis: int = 2):
+    if deriv == 0:
+        name = var
+    elif deriv == 1:
+        name = f'd{var}/dx{axis}'
+    else:
+        name = f'd^{deriv}{var}/dx{axis}^{deriv}'
+    return name + '{power: ' + str(float(power)) + '}'
+
+
+def weak_equation_text(coeffs: np.ndarray, labels: list, var: str = 'u', tol: float = 1e-10):
+    '''
+    Text form of the discovered equation for epde ``translate_equation``: the terms d^a/dx^a (u^k) are expanded
+    into the products of the derivatives, the target is du/dx1.
+    '''
+    monomials = {}
+    free_term = 0.
+    for coeff, (power, order) in zip(coeffs, labels):
+        if power == 0:
+            free_term += coeff
+            continue
+        for monomial, multiplier in expand_derivative(power, order).items():
+            monomials[monomial] = monomials.get(monomial, 0.) + coeff * multiplier
+
+    terms = [f'{coeff} * ' + ' * '.join([_factor_name(deriv, power, var) for deriv, power in monomial])
+             for monomial, coeff in monomials.items() if np.abs(coeff) > tol]
+    return ' + '.join(terms + [str(float(free_term)),]) + ' = ' + _factor_name(1, 1, var, axis = 1)
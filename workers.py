@@ -0,0 +1,219 @@
+import os
+import sys
+import time
+import multiprocessing as mp
+from multiprocessing import shared_memory
+from typing import Callable
+
+import numpy as np
+
+THREAD_ENV_VARS = ['OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS',
+                   'NUMEXPR_NUM_THREADS', 'VECLIB_MAXIMUM_THREADS']
+
+
+def available_cpus():
+    try:
+        return sorted(os.sched_getaffinity(0))
+    except AttributeError:
+        return list(range(os.cpu_count()))
+
+
+def cpu_budgets(workers: int, threads_per_worker: int, cpus: list = None):
+    '''
+    Split the available cores into consecutive groups of ``threads_per_worker`` cores, one per worker.
+    If the cores are not enough, the groups are reused cyclically.
+    '''
+    if cpus is None:
+        cpus = available_cpus()
+    groups = [cpus[start : start + threads_per_worker] for start in range(0, len(cpus), threads_per_worker)]
+    groups = [group for group in groups if len(group) == threads_per_worker] or [cpus,]
+    return [groups[idx % len(groups)] for idx in range(workers)]
+
+
+def limit_threads(threads: int):
+    '''
+    Limit the intra-op threads of BLAS/OpenMP and torch in the current process. Environment variables act
+    on the libraries, loaded afterwards; for the already loaded ones threadpoolctl (if installed) and
+    torch.set_num_threads are used. Torch is not imported here, if the process has not imported it yet.
+    '''
+    for var in THREAD_ENV_VARS:
+        os.environ[var] = str(threads)
+    try:
+        from threadpoolctl import threadpool_limits
+        threadpool_limits(limits = threads)
+    except ImportError:
+        pass
+    if 'torch' in sys.modules:
+        torch = sys.modules['torch']
+        torch.set_num_threads(threads)
+        try:
+            torch.set_num_interop_threads(1)
+        except RuntimeError:
+            pass # can be set only once, before any parallel work of torch
+
+
+def _init_worker(counter, budgets, threads, pin):
+    with counter.get_lock():
+        worker_idx = counter.value
+        counter.value += 1
+    if pin and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, budgets[worker_idx % len(budgets)])
+    limit_threads(threads)
+
+
+def _timed_call(args):
+    fun, task = args
+    wall, cpu = time.perf_counter(), time.process_time()
+    result = fun(task)
+    stats = {'pid' : os.getpid(), 'wall' : time.perf_counter() - wall, 'cpu' : time.process_time() - cpu}
+    return result, stats
+
+
+class WorkerPool(object):
+    '''
+    Process pool, where each worker gets the budget of ``threads_per_worker`` cores: torch and BLAS thread
+    numbers are limited to it and, with ``pin = True``, the worker is bound to its own cores. Thus parallel
+    discovery attempts do not oversubscribe the machine with the intra-op threads.
+
+    ``fun`` for ``map`` has to be picklable, i.e. defined at the top level of a module.
+    '''
+    def __init__(self, workers: int = 4, threads_per_worker: int = None, pin: bool = False,
+                 start_method: str = 'spawn'):
+        cpus = available_cpus()
+        self.workers = workers
+        self.threads = threads_per_worker if threads_per_worker is not None else max(1, len(cpus) // workers)
+        self.budgets = cpu_budgets(workers, self.threads, cpus)
+        self.pin = pin
+        self.stats = []
+        self._elapsed = 0.
+
+        context = mp.get_context(start_method)
+        saved_env = {var : os.environ.get(var) for var in THREAD_ENV_VARS}
+        for var in THREAD_ENV_VARS:
+            os.environ[var] = str(self.threads) # inherited by the workers before their imports
+        try:
+            self._pool = context.Pool(workers, initializer = _init_worker,
+                                      initargs = (context.Value('i', 0), self.budgets, self.threads, pin))
+        finally:
+            for var, value in saved_env.items():
+                if value is None:
+                    os.environ.pop(var, None)
+                else:
+                    os.environ[var] = value
+
+    def map(self, fun: Callable, tasks: list):
+        start = time.perf_counter()
+        outputs = self._pool.map(_timed_call, [(fun, task) for task in tasks], chunksize = 1)
+        self._elapsed += time.perf_counter() - start
+        self.stats.extend([stats for _, stats in outputs])
+        return [result for result, _ in outputs]
+
+    def report(self, verbose: bool = True):
+        '''
+        Utilization summary: CPU time of the tasks related to the time, available for them within their
+        budgets, and the speedup of the pool over the sequential execution of the same tasks.
+        '''
+        tasks_wall = sum([stats['wall'] for stats in self.stats])
+        tasks_cpu = sum([stats['cpu'] for stats in self.stats])
+        summary = {'workers' : self.workers, 'threads_per_worker' : self.threads, 'tasks' : len(self.stats),
+                   'elapsed' : self._elapsed,
+                   'utilization' : tasks_cpu / (tasks_wall * self.threads) if tasks_wall > 0 else 0.,
+                   'speedup' : tasks_wall / self._elapsed if self._elapsed > 0 else 0.}
+        if verbose:
+            print(f'Worker pool: {summary["tasks"]} tasks on {self.workers} workers x {self.threads} threads, '
+                  f'elapsed {summary["elapsed"]:.1f} s, utilization {summary["utilization"]:.2f}, '
+                  f'speedup {summary["speedup"]:.2f}')
+        return summary
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def _attach_shared_memory(name: str):
+    try:
+        return shared_memory.SharedMemory(name = name, track = False) # python >= 3.13
+    except TypeError:
+        return shared_memory.SharedMemory(name = name)
+
+
+class SharedArray(object):
+    '''
+    Numpy array, placed once into the block of ``multiprocessing.shared_memory``. It is pickled as the lightweight
+    handle (name of the block, shape, dtype), thus the worker processes attach to the same memory instead of
+    receiving the copy of the data with each task. In the workers the array is read-only.
+
+    The creating process owns the block and has to ``unlink`` it (or use the object as the context manager).
+    '''
+    def __init__(self, array: np.ndarray):
+        array = np.asarray(array)
+        self.shape, self.dtype = array.shape, array.dtype
+        self._shm = shared_memory.SharedMemory(create = True, size = max(array.nbytes, 1))
+        self._owner = True
+        self.array = np.ndarray(self.shape, dtype = self.dtype, buffer = self._shm.buf)
+        self.array[...] = array
+
+    def __getstate__(self):
+        return {'name' : self._shm.name, 'shape' : self.shape, 'dtype' : self.dtype.str}
+
+    def __setstate__(self, state):
+        self.shape, self.dtype = state['shape'], np.dtype(state['dtype'])
+        self._shm = _attach_shared_memory(state['name'])
+        self._owner = False
+        self.array = np.ndarray(self.shape, dtype = self.dtype, buffer = self._shm.buf)
+        self.array.setflags(write = False)
+
+    def close(self):
+        self.array = None
+        try:
+            self._shm.close()
+        except BufferError:
+            pass # views of the array are still alive, the mapping is released with them
+
+    def unlink(self):
+        self.close()
+        if self._owner:
+            self._shm.unlink()
+            self._owner = False
+
+    def __del__(self):
+        if hasattr(self, '_shm'):
+            self.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.unlink()
+
+
+class SharedArrays(tuple):
+    '''
+    Group of SharedArray, e.g. data, grids and derivatives of the noise magnitude, shared once for all the tasks
+    and unlinked together: ``with SharedArrays(x, t, u) as (x_shared, t_shared, u_shared): ...``.
+    '''
+    def __new__(cls, *arrays):
+        return super().__new__(cls, [SharedArray(array) for array in arrays])
+
+    def unlink(self):
+        for shared in self:
+            shared.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.unlink()
+
+
+def shared_value(obj):
+    '''
+    Array of the SharedArray handle, other objects are returned as they are.
+    '''
+    return obj.array if isinstance(obj, SharedArray) else obj